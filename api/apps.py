@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        """
+        Connects signal handlers, which keep denormalized data up to date
+        :return:
+        """
+        from . import signals  # noqa: F401
@@ -0,0 +1,73 @@
+"""
+Baskets of anonymous visitors.
+
+Every anonymous visitor gets a random basket key, which is kept in the visitor's session (see "SESSION_ENGINE"),
+so the key is shared by all the worker processes and nodes, which share the sessions. Temporary basket
+items of the visitor are stored with this key. The key is kept in the session data, so it survives
+the change of the session key on login and the items can be moved to the user's basket then.
+
+Items are moved once, on login, by a single transaction: counts of the products, which are already
+in the user's basket, are added to the stored ones by one upsert ("INSERT ... ON CONFLICT DO UPDATE",
+supported by PostgreSQL and SQLite), then the temporary items are deleted by one statement.
+So reading the basket never writes.
+"""
+import uuid
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Basket, TemporaryBasket
+
+BASKET_SESSION_KEY = "basket_key"
+
+
+def get_basket_key(request, create: bool = False):
+    """
+    Returns basket key of the visitor, or None if the visitor has no basket yet
+    :param request:
+    :param create: if True, a new key is created for a visitor without a basket
+    :return:
+    """
+    key = request.session.get(BASKET_SESSION_KEY)
+    if key is None and create:
+        key = uuid.uuid4().hex
+        request.session[BASKET_SESSION_KEY] = key
+    return key
+
+
+def merge_basket(user, basket_key) -> int:
+    """
+    Moves temporary basket items with the basket key into the user's basket,
+    adding their counts to the counts of the same products in it.
+    Counts are added by the database in the upsert itself, so items, added to the user's basket
+    by concurrent requests, are never overwritten.
+    :param user:
+    :param basket_key:
+    :return: number of moved products
+    """
+    basket = Basket._meta
+    temporary = TemporaryBasket._meta
+    table = connection.ops.quote_name(basket.db_table)
+    columns = {
+        name: connection.ops.quote_name(model.get_field(name).column)
+        for model, name in ((basket, "user"), (basket, "product"), (basket, "count"), (basket, "date"))
+    }
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {table} ({user}, {product}, {count}, {date}) "
+                "SELECT %s, {temporary_product}, SUM({temporary_count}), %s FROM {temporary_table} "
+                "WHERE {session} = %s GROUP BY {temporary_product} "
+                "ON CONFLICT ({user}, {product}) DO UPDATE SET {count} = {table}.{count} + excluded.{count}".format(
+                    table=table,
+                    temporary_table=connection.ops.quote_name(temporary.db_table),
+                    temporary_product=connection.ops.quote_name(temporary.get_field("product").column),
+                    temporary_count=connection.ops.quote_name(temporary.get_field("count").column),
+                    session=connection.ops.quote_name(temporary.get_field("session").column),
+                    **columns,
+                ),
+                [user.pk, timezone.now(), basket_key],
+            )
+            moved = cursor.rowcount
+        TemporaryBasket.objects.filter(session=basket_key).delete()
+    return moved
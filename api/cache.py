@@ -0,0 +1,345 @@
+"""
+Versioned response cache for catalog endpoints.
+
+Cached responses are keyed on the catalog version and normalized query parameters of the request.
+Catalog version is bumped by signals whenever products, their images, sales, specifications, tags or reviews change,
+so all the cached responses become unreachable at once and expire later by timeout.
+Endpoints are configured in "API_RESPONSE_CACHE" setting and work with any Django cache backend.
+
+Versions of the cached data, including the data, which every process keeps in its memory (category tree,
+tag index, sale schedule), are tokens, stored in the database (see "DataVersion"): the cache may be local
+to the process, and a process must never serve outdated data, whatever cache backend is configured.
+For the same reason hit and miss counters are added to the database in batches (see "ResponseCacheStats").
+
+Read endpoints also support conditional GET requests (see "ConditionalResponseMixin"), so clients and
+proxies revalidate their copies by ETag or Last-Modified without downloading unchanged data.
+"""
+import threading
+import time
+import uuid
+from collections import Counter
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+from .models import DataVersion, ProductSale, ResponseCacheStats
+
+CATALOG_VERSION_KEY = "api:catalog:version"
+VALIDATOR_HEADERS = ("ETag", "Last-Modified")
+
+# hits and misses, counted by the current process and not written to the database yet
+_stats = Counter()
+_stats_lock = threading.Lock()
+_stats_written_at = time.monotonic()
+
+
+def get_stored_version(key: str) -> str:
+    """
+    Returns current version of the data, stored in the database under the key.
+    A version is created by the first request, so it is never mistaken for a version of other data.
+    :param key:
+    :return:
+    """
+    version = DataVersion.objects.filter(key=key).values_list("version", flat=True).first()
+    if version is None:
+        try:
+            with transaction.atomic():
+                version = DataVersion.objects.create(key=key, version=uuid.uuid4().hex).version
+        except IntegrityError:
+            # created by a concurrent request
+            version = DataVersion.objects.get(key=key).version
+    return version
+
+
+def bump_stored_version(key: str) -> None:
+    """
+    Replaces the version of the data, stored in the database under the key, by a new token.
+    The change is a part of the current transaction, so other processes see it right after the commit.
+    :param key:
+    :return:
+    """
+    version = uuid.uuid4().hex
+    if not DataVersion.objects.filter(key=key).update(version=version):
+        get_stored_version(key)
+        DataVersion.objects.filter(key=key).update(version=version)
+
+
+def get_catalog_version() -> str:
+    """
+    Returns current catalog version
+    :return:
+    """
+    return get_stored_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version() -> None:
+    """
+    Invalidates all the cached catalog responses
+    :return:
+    """
+    bump_stored_version(CATALOG_VERSION_KEY)
+
+
+def get_stats_config() -> dict:
+    """
+    Returns batching of hit and miss counters from "API_RESPONSE_CACHE_STATS" setting
+    :return:
+    """
+    config = {"BATCH_SIZE": 100, "BATCH_SECONDS": 60}
+    config.update(getattr(settings, "API_RESPONSE_CACHE_STATS", {}))
+    return config
+
+
+def _count(endpoint: str, counter: str) -> None:
+    """
+    Counts a hit or a miss of the endpoint in the process memory. Counters are added to the stored ones,
+    when there are "BATCH_SIZE" of them or "BATCH_SECONDS" passed since the previous write.
+    :param endpoint:
+    :param counter:
+    :return:
+    """
+    global _stats_written_at
+    config = get_stats_config()
+    with _stats_lock:
+        _stats[endpoint, counter] += 1
+        if (
+            _stats.total() < config["BATCH_SIZE"]
+            and time.monotonic() - _stats_written_at < config["BATCH_SECONDS"]
+        ):
+            return
+        stats = dict(_stats)
+        _stats.clear()
+        _stats_written_at = time.monotonic()
+    write_stats(stats)
+
+
+def write_stats(stats: dict) -> None:
+    """
+    Adds counted hits and misses to the stored counters by a single statement per endpoint
+    :param stats: numbers of hits and misses by (endpoint, "hits" or "misses") pairs
+    :return:
+    """
+    for endpoint in {endpoint for endpoint, _ in stats}:
+        hits, misses = stats.get((endpoint, "hits"), 0), stats.get((endpoint, "misses"), 0)
+        counters = ResponseCacheStats.objects.filter(endpoint=endpoint)
+        if counters.update(hits=F("hits") + hits, misses=F("misses") + misses):
+            continue
+        try:
+            with transaction.atomic():
+                ResponseCacheStats.objects.create(endpoint=endpoint, hits=hits, misses=misses)
+        except IntegrityError:
+            # created by a concurrent request
+            counters.update(hits=F("hits") + hits, misses=F("misses") + misses)
+
+
+def get_cache_stats(endpoint: str) -> dict:
+    """
+    Returns numbers of cache hits and misses of the endpoint: stored ones and ones,
+    counted by the current process since the last write
+    :param endpoint:
+    :return:
+    """
+    stored = ResponseCacheStats.objects.filter(endpoint=endpoint).values("hits", "misses").first()
+    stored = stored or {"hits": 0, "misses": 0}
+    with _stats_lock:
+        return {counter: stored[counter] + _stats[endpoint, counter] for counter in ("hits", "misses")}
+
+
+def get_endpoint_config(endpoint: str) -> dict:
+    """
+    Returns cache configuration of the endpoint from "API_RESPONSE_CACHE" setting.
+    Endpoints, which aren't configured, are not cached.
+    :param endpoint:
+    :return:
+    """
+    config = {"ENABLED": False, "TIMEOUT": 300}
+    config.update(getattr(settings, "API_RESPONSE_CACHE", {}).get(endpoint, {}))
+    return config
+
+
+def get_timeout(timeout: int) -> int:
+    """
+    Returns cache timeout, limited by the time left until the nearest start or end of a sale,
+    because prices of the cached products change at that moment without any changes in the database.
+    :param timeout:
+    :return:
+    """
+    boundary = ProductSale.objects.next_boundary()
+    if boundary is None:
+        return timeout
+    return max(1, min(timeout, int((boundary - timezone.now()).total_seconds()) + 1))
+
+
+def get_not_modified_response(request, headers: dict):
+    """
+    Returns "304 Not Modified" response if the client's copy of the response with the given
+    "ETag" and "Last-Modified" headers is valid, or None in opposite case
+    :param request:
+    :param headers:
+    :return:
+    """
+    if not headers:
+        return None
+    last_modified = headers.get("Last-Modified")
+    return get_conditional_response(
+        request,
+        etag=headers.get("ETag"),
+        last_modified=parse_http_date_safe(last_modified) if last_modified else None,
+    )
+
+
+class CachedResponseMixin:
+    """
+    Mixin for views, which caches data of successful GET responses.
+    "cache_endpoint" is the name of the endpoint in "API_RESPONSE_CACHE" setting.
+    Response has "X-Cache" header with "HIT" or "MISS" value.
+    Cache hit makes a single query (catalog version), cache miss makes one more query to find the nearest
+    sale start or end.
+    """
+    cache_endpoint = None
+
+    def get_cache_params(self) -> list:
+        """
+        Returns normalized query parameters, which responses differ by
+        :return:
+        """
+        return sorted(
+            (key, value)
+            for key, values in self.request.query_params.lists()
+            for value in values
+        )
+
+    def get_cache_key(self) -> str:
+        """
+        Returns cache key of the response: endpoint, catalog version and hash of the query parameters
+        :return:
+        """
+        return "api:response:{endpoint}:{version}:{params}".format(
+            endpoint=self.cache_endpoint,
+            version=get_catalog_version(),
+            params=md5(urlencode(self.get_cache_params()).encode()).hexdigest(),
+        )
+
+    def get_cached_response(self, build_response):
+        """
+        Returns cached response, or builds it with "build_response" callable and caches its data
+        :param build_response:
+        :return:
+        """
+        config = get_endpoint_config(self.cache_endpoint)
+        # queries of the explained requests (see "QueryExplainMixin") have to be actually made
+        if not config["ENABLED"] or getattr(self, "explaining", False):
+            return build_response()
+        key = self.get_cache_key()
+        cached = cache.get(key)
+        if cached is not None:
+            _count(self.cache_endpoint, "hits")
+            data, headers = cached
+            response = get_not_modified_response(self.request, headers) or Response(data)
+            for header, value in headers.items():
+                response[header] = value
+            response["X-Cache"] = "HIT"
+            return response
+        _count(self.cache_endpoint, "misses")
+        response = build_response()
+        if response.status_code == 200:
+            # validators (see "ConditionalResponseMixin") are cached too, so cache hits are validated without
+            # more queries
+            headers = {header: response[header] for header in VALIDATOR_HEADERS if response.has_header(header)}
+            cache.set(key, (response.data, headers), get_timeout(config["TIMEOUT"]))
+        response["X-Cache"] = "MISS"
+        return response
+
+    def get(self, request, *args, **kwargs):
+        """
+        Modified method "get" returns cached response if it exists
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        return self.get_cached_response(lambda: super(CachedResponseMixin, self).get(request, *args, **kwargs))
+
+
+class ConditionalResponseMixin:
+    """
+    Mixin for views, which answers conditional GET requests.
+    View describes the state of the data, its response is built from, by "get_modification_state" method:
+    the last modification time and any other values, which change together with the response.
+    ETag is a hash of the state and the query parameters, Last-Modified is the modification time.
+    If the client's copy is still valid, "304 Not Modified" is returned without building the response.
+    Lists set "send_last_modified" to False: items, deleted from a list or moved out of it, don't move
+    the last modification time of the rest forward, so lists are validated by ETag only.
+    """
+    send_last_modified = True
+
+    def get_modification_state(self):
+        """
+        Returns a list of modification times of the response data (None items are skipped) and
+        a list of other values, which change together with the response (i.e. number of items),
+        or None if the response can't be validated (i.e. the requested object doesn't exist).
+        Responses aren't validated by default.
+        :return:
+        """
+        return None
+
+    def get_validators(self) -> dict:
+        """
+        Returns "ETag" and "Last-Modified" headers of the response, or an empty dict if it can't be validated
+        :return:
+        """
+        state = self.get_modification_state()
+        if state is None:
+            return {}
+        moments, values = state
+        moments = [moment for moment in moments if moment is not None]
+        last_modified = max(moments) if moments else None
+        params = sorted(
+            (key, value)
+            for key, values_list in self.request.query_params.lists()
+            for value in values_list
+        )
+        etag = md5(
+            repr((type(self).__name__, params, last_modified and last_modified.isoformat(), values)).encode()
+        ).hexdigest()
+        headers = {"ETag": quote_etag(etag)}
+        if last_modified is not None and self.send_last_modified:
+            headers["Last-Modified"] = http_date(last_modified.timestamp())
+        return headers
+
+    def get_conditional_response(self, build_response):
+        """
+        Returns "304 Not Modified" response if the client's copy is valid, or builds the response
+        with "build_response" callable and adds the validators to it
+        :param build_response:
+        :return:
+        """
+        headers = self.get_validators()
+        response = get_not_modified_response(self.request, headers)
+        if response is None:
+            response = build_response()
+            if response.status_code != 200:
+                return response
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def get(self, request, *args, **kwargs):
+        """
+        Modified method "get" answers conditional requests
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        return self.get_conditional_response(
+            lambda: super(ConditionalResponseMixin, self).get(request, *args, **kwargs)
+        )
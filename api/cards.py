@@ -0,0 +1,38 @@
+"""
+Precomputed product cards (see "ProductCard" model).
+Product lists read cards together with the products by a single query, while the cards are rebuilt
+here whenever any of their data changes. Rebuilding is cheap enough, because catalog is edited rarely.
+"""
+from .models import Product, ProductCard
+from .serializers import ProductCardSerializer
+
+
+def refresh_cards(product_ids=None, batch_size: int = 500) -> int:
+    """
+    Rebuilds cards of the products with "product_ids" (all the products if None).
+    Products are processed in batches, each batch costs 3 reading queries and a single upsert.
+    :param product_ids:
+    :param batch_size:
+    :return: number of rebuilt cards
+    """
+    products = Product.objects.with_price().prefetch_related("productimage_set", "tags").order_by("pk")
+    if product_ids is not None:
+        product_ids = [pk for pk in product_ids if pk is not None]
+        if not product_ids:
+            return 0
+        products = products.filter(pk__in=product_ids)
+
+    rebuilt = 0
+    last_pk = 0
+    while True:
+        batch = list(products.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return rebuilt
+        ProductCard.objects.bulk_create(
+            [ProductCard(product=product, data=ProductCardSerializer.build_data(product)) for product in batch],
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["data"],
+        )
+        rebuilt += len(batch)
+        last_pk = batch[-1].pk
@@ -0,0 +1,63 @@
+"""
+Category tree of the catalog menu, built once per version of the categories.
+The tree is built with two queries (categories and their subcategories) and rendered to JSON bytes,
+which are kept in the cache and in the process memory under the current categories version.
+The version is stored in the database (see "DataVersion") and is bumped by signals, whenever any category
+or subcategory changes (see "signals.py"), so the tree is rebuilt only after a change.
+"""
+import hashlib
+from collections import namedtuple
+
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+from .cache import bump_stored_version, get_stored_version
+from .models import Category
+from .serializers import CategorySerializer
+
+CATEGORIES_VERSION_KEY = "api:categories:version"
+CATEGORIES_TREE_KEY = "api:categories:tree:{version}"
+
+CategoryTree = namedtuple("CategoryTree", ["version", "content", "etag"])
+
+# tree of the current process, replaced as a whole, so concurrent threads always see a consistent tree
+_tree = CategoryTree(None, None, None)
+
+
+def build_tree() -> bytes:
+    """
+    Renders the category tree to JSON by two queries
+    :return:
+    """
+    categories = Category.objects.prefetch_related("subcategory_set")
+    return JSONRenderer().render(CategorySerializer(categories, many=True).data)
+
+
+def get_tree() -> CategoryTree:
+    """
+    Returns the category tree of the current version. The tree is taken from the process memory,
+    then from the cache, and is built only if neither has the current version.
+    :return:
+    """
+    global _tree
+    version = get_stored_version(CATEGORIES_VERSION_KEY)
+    tree = _tree
+    if tree.version == version:
+        return tree
+    key = CATEGORIES_TREE_KEY.format(version=version)
+    content = cache.get(key)
+    if content is None:
+        content = build_tree()
+        # stale versions are never read again, so they are left for the cache to evict
+        cache.set(key, content, None)
+    tree = CategoryTree(version, content, '"{}"'.format(hashlib.md5(content).hexdigest()))
+    _tree = tree
+    return tree
+
+
+def invalidate_tree() -> None:
+    """
+    Bumps the categories version, so the tree is rebuilt by the next request
+    :return:
+    """
+    bump_stored_version(CATEGORIES_VERSION_KEY)
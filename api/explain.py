@@ -0,0 +1,106 @@
+"""
+Query plan inspection of API requests for staff users.
+Turned on by "API_QUERY_EXPLAIN" setting, which is off by default. Even if it's on, only GET requests
+of staff users with "explain=1" parameter are inspected, all other requests are handled as usual.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.response import Response
+
+EXPLAIN_PARAM = "explain"
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper, which records every query with its parameters and execution time
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                "sql": sql,
+                "params": params,
+                "many": many,
+                "time": (time.perf_counter() - start) * 1000,
+            })
+
+
+def is_explain_requested(request) -> bool:
+    """
+    Checks if query plans of the request should be returned instead of its response
+    :param request: Django request, authenticated by the session middleware
+    :return:
+    """
+    if not getattr(settings, "API_QUERY_EXPLAIN", False):
+        return False
+    user = getattr(request, "user", None)
+    return (
+        request.method == "GET"
+        and request.GET.get(EXPLAIN_PARAM) == "1"
+        and user is not None
+        and user.is_staff
+    )
+
+
+def explain_query(query: dict) -> dict:
+    """
+    Returns report of the recorded query: SQL, parameters, execution time, number of rows and query plan.
+    Only SELECT queries are explained and counted, because they can be safely executed once more.
+    :param query:
+    :return:
+    """
+    params = query["params"] if not query["many"] else None
+    report = {
+        "sql": query["sql"],
+        "params": [str(param) for param in params] if params is not None else None,
+        "time": round(query["time"], 3),
+        "rows": None,
+        "plan": None,
+    }
+    if query["many"] or not query["sql"].lstrip().upper().startswith("SELECT"):
+        return report
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM ({}) explained".format(query["sql"]), params)
+        report["rows"] = cursor.fetchone()[0]
+        cursor.execute("{} {}".format(connection.ops.explain_query_prefix(), query["sql"]), params)
+        report["plan"] = [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+    return report
+
+
+class QueryExplainMixin:
+    """
+    Mixin for views, which returns a report of the queries, made by the request, instead of its response,
+    if the request asks for it (see "is_explain_requested").
+    Cached responses are bypassed, so the report shows the queries of building the response.
+    """
+    explaining = False
+
+    def dispatch(self, request, *args, **kwargs):
+        """
+        Modified method "dispatch" records the queries of the request and returns their report
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        if not is_explain_requested(request):
+            return super().dispatch(request, *args, **kwargs)
+        self.explaining = True
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = super().dispatch(request, *args, **kwargs)
+        report = {
+            "status": response.status_code,
+            "time": round((time.perf_counter() - start) * 1000, 3),
+            "queries": [explain_query(query) for query in recorder.queries],
+        }
+        return self.finalize_response(self.request, Response(report), *args, **kwargs)
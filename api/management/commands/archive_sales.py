@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import sale_archive
+
+
+class Command(BaseCommand):
+    """
+    Command moves sales, which ended more than "--days" days ago, to the sales history.
+    Sales are moved in small batches, each in its own transaction, so the command can be run
+    by schedule (i.e. by cron every night) while the shop is working.
+    """
+    help = "Moves long ended sales to the sales history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30, help="Archive sales, which ended this number of days ago")
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of sales moved at once")
+        parser.add_argument("--pause", type=float, default=0, help="Seconds to sleep between batches")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timezone.timedelta(days=options["days"])
+        archived = sale_archive.archive(cutoff, batch_size=options["batch_size"], pause=options["pause"])
+        self.stdout.write(self.style.SUCCESS(f"Sales archived: {archived}"))
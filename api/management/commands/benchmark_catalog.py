@@ -0,0 +1,162 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from api.models import Category, Product, Subcategory
+from api.views import CatalogListView, LimitedProductsListView
+
+
+class Rollback(Exception):
+    """
+    Raised to roll back the synthetic catalog, when the benchmark is finished
+    """
+
+
+class Command(BaseCommand):
+    """
+    Command benchmarks catalog queries on a large synthetic catalog with and without "Product" indexes.
+    Synthetic catalog is created inside a transaction, which is rolled back at the end,
+    so the command leaves the database unchanged. For every query it shows the query plan and
+    the median time of several runs before the indexes are dropped and after they are created again.
+    """
+    help = "Shows query plans and timings of catalog queries with and without product indexes"
+
+    # query parameters of the benchmarked catalog requests
+    catalog_requests = [
+        {"category": "{subcategory}", "sort": "price"},
+        {"category": "{subcategory}", "filter[minPrice]": "100", "filter[maxPrice]": "300", "sort": "price"},
+        {"category": "{category}", "sort": "date", "sortType": "inc"},
+        {"sort": "price"},
+        {"sort": "rating", "sortType": "inc"},
+        {"pagination": "cursor", "sort": "price", "limit": "20"},
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50000, help="Number of synthetic products")
+        parser.add_argument("--categories", type=int, default=10, help="Number of synthetic categories")
+        parser.add_argument("--subcategories", type=int, default=10, help="Number of subcategories in a category")
+        parser.add_argument("--repeat", type=int, default=5, help="Number of runs of every query")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                subcategory, category = self.create_catalog(
+                    options["products"], options["categories"], options["subcategories"]
+                )
+                queries = self.get_queries(subcategory, category)
+                self.execute_ddl(
+                    "DROP INDEX {}".format(connection.ops.quote_name(index.name)) for index in Product._meta.indexes
+                )
+                before = self.run_queries(queries, options["repeat"], "without indexes")
+                # schema editor can't be used inside a transaction on SQLite, so it only renders the statements
+                editor = connection.schema_editor()
+                self.execute_ddl(str(index.create_sql(Product, editor)) for index in Product._meta.indexes)
+                after = self.run_queries(queries, options["repeat"], "with indexes")
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Summary, ms"))
+        for label in queries:
+            self.stdout.write(f"{before[label]:10.2f} -> {after[label]:10.2f}  {label}")
+
+    @staticmethod
+    def execute_ddl(statements) -> None:
+        """
+        Executes index statements and refreshes planner statistics
+        :param statements:
+        :return:
+        """
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("ANALYZE")
+
+    def create_catalog(self, products: int, categories: int, subcategories: int) -> tuple:
+        """
+        Creates synthetic categories, subcategories and products, bypassing signals.
+        Categories get ids following the existing ones.
+        :param products:
+        :param categories:
+        :param subcategories:
+        :return: ids of a synthetic subcategory and a synthetic category to filter by
+        """
+        first = int(Category.objects.aggregate(last=Max("id"))["last"] or 0) + 1
+        if first + categories > 1000 or subcategories > 999:
+            raise CommandError("Too many categories for the catalog id scheme")
+        category_ids = range(first, first + categories)
+        Category.objects.bulk_create(Category(id=pk, title=f"category {pk}") for pk in category_ids)
+        subcategory_ids = [pk * 1000 + number for pk in category_ids for number in range(1, subcategories + 1)]
+        Subcategory.objects.bulk_create(
+            Subcategory(id=pk, category_id=pk // 1000, title=f"subcategory {pk}") for pk in subcategory_ids
+        )
+        rng = random.Random(0)
+        Product.objects.bulk_create(
+            (
+                Product(
+                    category_id=rng.choice(subcategory_ids),
+                    title=f"product {number}",
+                    price=rng.randint(1, 100000) / 100,
+                    count=rng.randint(0, 100),
+                    freeDelivery=rng.random() < 0.3,
+                    available=rng.random() < 0.8,
+                    archived=rng.random() < 0.1,
+                    limited=rng.random() < 0.05,
+                    rating_avg=rng.randint(10, 50) / 10,
+                    reviews_count=rng.randint(0, 200),
+                )
+                for number in range(products)
+            ),
+            batch_size=1000,
+        )
+        self.stdout.write(f"Synthetic catalog: {products} products in {len(subcategory_ids)} subcategories")
+        return subcategory_ids[0], first
+
+    def get_queries(self, subcategory, category) -> dict:
+        """
+        Returns querysets of the first page of catalog and limited products,
+        built by the views themselves, by their labels
+        :param subcategory:
+        :param category:
+        :return:
+        """
+        queries = {}
+        factory = RequestFactory()
+        for params in self.catalog_requests:
+            params = {
+                key: value.format(subcategory=subcategory, category=category) for key, value in params.items()
+            }
+            view = CatalogListView()
+            view.request = Request(factory.get("/api/catalog", params))
+            view.format_kwarg = None
+            label = "catalog " + " ".join(f"{key}={value}" for key, value in params.items())
+            queries[label] = view.get_queryset()[:20]
+        queries["limited"] = LimitedProductsListView().get_queryset()
+        return queries
+
+    def run_queries(self, queries: dict, repeat: int, title: str) -> dict:
+        """
+        Shows query plans and returns median timings of the queries in milliseconds
+        :param queries:
+        :param repeat:
+        :param title:
+        :return:
+        """
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Query plans {title}"))
+        timings = {}
+        for label, queryset in queries.items():
+            self.stdout.write(self.style.SUCCESS(label))
+            self.stdout.write(queryset.explain())
+            runs = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                runs.append((time.perf_counter() - start) * 1000)
+            timings[label] = statistics.median(runs)
+        return timings
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api import recommendations
+
+
+class Command(BaseCommand):
+    """
+    Command builds "customers also bought" recommendations from paid orders.
+    By default only orders, paid since the previous run, are processed, so the command can be run
+    by schedule (i.e. by cron every hour). "--full" option rebuilds recommendations from all the paid orders.
+    """
+    help = "Builds related products (customers also bought) from paid orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of payments processed at once")
+        parser.add_argument("--full", action="store_true", help="Rebuild from all the paid orders")
+
+    def handle(self, *args, **options):
+        processed = recommendations.update(batch_size=options["batch_size"], full=options["full"])
+        self.stdout.write(self.style.SUCCESS(f"Related products updated from {processed} orders"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api import snapshots
+
+
+class Command(BaseCommand):
+    """
+    Command publishes static snapshots of categories, tags and banners with their manifest.
+    Unchanged snapshots are kept as they are, so the command can be scheduled to run often,
+    i.e. to update prices of the banners, when sales start or end.
+    """
+    help = "Publishes static JSON snapshots of categories, tags and banners"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--root", help='Directory of the snapshots, "ROOT" of "API_SNAPSHOTS" setting by default')
+
+    def handle(self, *args, **options):
+        manifest = snapshots.publish(options["root"])
+        for name, item in manifest.items():
+            self.stdout.write(f"{name}: {item['file']} ({item['size']} bytes)")
+        self.stdout.write(self.style.SUCCESS(f"Snapshots published: {len(manifest)}"))
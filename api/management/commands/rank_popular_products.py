@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import popularity
+
+
+class Command(BaseCommand):
+    """
+    Command rebuilds the popularity ranking of products from their rating, reviews, recent sales and views.
+    Sales and views lose weight with time, so the command should be run by schedule (i.e. by cron every hour).
+    """
+    help = "Rebuilds the popularity ranking of products"
+
+    def handle(self, *args, **options):
+        ranked = popularity.rank()
+        self.stdout.write(self.style.SUCCESS(f"Products ranked: {ranked}"))
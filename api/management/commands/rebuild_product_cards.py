@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api import cards
+
+
+class Command(BaseCommand):
+    """
+    Command rebuilds precomputed cards of all the products.
+    Normally the cards are kept up to date by signals, so the command is needed only after
+    migrations or after products were changed bypassing the ORM.
+    """
+    help = "Rebuilds precomputed cards of all the products"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of products rebuilt at once")
+
+    def handle(self, *args, **options):
+        rebuilt = cards.refresh_cards(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Product cards rebuilt: {rebuilt}"))
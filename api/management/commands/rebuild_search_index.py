@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api import search
+
+
+class Command(BaseCommand):
+    """
+    Command rebuilds full-text search index of the products.
+    Normally the index is kept up to date by signals, so the command is needed only after
+    products were changed bypassing the ORM or to compact the index.
+    """
+    help = "Rebuilds full-text search index of the products"
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(self.style.WARNING("Database backend has no full-text search index"))
+            return
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
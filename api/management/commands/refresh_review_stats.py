@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Command recalculates denormalized "rating_avg" and "reviews_count" columns of all products.
+    Normally the columns are kept up to date by signals, so the command is needed only to backfill them,
+    i.e. after reviews were imported bypassing the ORM.
+    """
+    help = "Recalculates stored rating and number of reviews of the products"
+
+    def handle(self, *args, **options):
+        updated = Product.objects.all().refresh_review_stats()
+        self.stdout.write(self.style.SUCCESS(f"Review stats refreshed for {updated} products"))
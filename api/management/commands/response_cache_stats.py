@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.cache import get_cache_stats, get_endpoint_config
+
+
+class Command(BaseCommand):
+    """
+    Command shows hit and miss counters of the cached endpoints, configured in "API_RESPONSE_CACHE" setting.
+    Counters of all the worker processes are stored in the database, processes write them in batches
+    (see "API_RESPONSE_CACHE_STATS" setting), so the latest requests may be not counted yet.
+    """
+    help = "Shows response cache hits and misses of the cached endpoints"
+
+    def handle(self, *args, **options):
+        for endpoint in getattr(settings, "API_RESPONSE_CACHE", {}):
+            stats = get_cache_stats(endpoint)
+            total = stats["hits"] + stats["misses"]
+            ratio = stats["hits"] / total if total else 0
+            self.stdout.write(
+                "{endpoint}: {state}, hits {hits}, misses {misses}, hit ratio {ratio:.1%}".format(
+                    endpoint=endpoint,
+                    state="enabled" if get_endpoint_config(endpoint)["ENABLED"] else "disabled",
+                    ratio=ratio,
+                    **stats
+                )
+            )
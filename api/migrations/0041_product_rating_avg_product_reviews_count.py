@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:36
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_review_stats(apps, schema_editor):
+    """
+    Fills denormalized review columns for already existing products
+    """
+    Product = apps.get_model("api", "Product")
+    Review = apps.get_model("api", "Review")
+    reviews = Review.objects.filter(product=OuterRef("pk")).order_by().values("product")
+    Product.objects.update(
+        rating_avg=Subquery(reviews.annotate(value=Avg("rate")).values("value")),
+        reviews_count=Coalesce(Subquery(reviews.annotate(value=Count("id")).values("value")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_alter_order_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_review_stats, migrations.RunPython.noop),
+    ]
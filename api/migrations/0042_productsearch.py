@@ -0,0 +1,70 @@
+from django.db import migrations
+
+
+SQLITE_SQL = [
+    """
+    CREATE VIRTUAL TABLE api_productsearch USING fts5(
+        title, description, tags, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    INSERT INTO api_productsearch (rowid, title, description, tags)
+    SELECT p.id, p.title, p.description, COALESCE(
+        (SELECT group_concat(t.name, ' ') FROM api_product_tags pt JOIN api_tag t ON t.id = pt.tag_id
+         WHERE pt.product_id = p.id), ''
+    )
+    FROM api_product p
+    """,
+]
+
+POSTGRESQL_SQL = [
+    """
+    CREATE TABLE api_productsearch (
+        product_id bigint PRIMARY KEY REFERENCES api_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX api_productsearch_document_idx ON api_productsearch USING GIN (document)",
+    """
+    INSERT INTO api_productsearch (product_id, document)
+    SELECT p.id,
+        setweight(to_tsvector('simple', p.title), 'A')
+        || setweight(to_tsvector('simple', COALESCE(
+            (SELECT string_agg(t.name, ' ') FROM api_product_tags pt JOIN api_tag t ON t.id = pt.tag_id
+             WHERE pt.product_id = p.id), ''
+        )), 'B')
+        || setweight(to_tsvector('simple', p.description), 'C')
+    FROM api_product p
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Creates and fills full-text search index of the products on the backends, which support it
+    """
+    statements = {
+        "sqlite": SQLITE_SQL,
+        "postgresql": POSTGRESQL_SQL,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    """
+    Drops full-text search index of the products
+    """
+    if schema_editor.connection.vendor in ("sqlite", "postgresql"):
+        schema_editor.execute("DROP TABLE IF EXISTS api_productsearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_product_rating_avg_product_reviews_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
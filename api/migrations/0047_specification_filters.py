@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:57
+
+from django.db import migrations, models
+
+from api.specifications import normalize, parse_number
+
+
+def fill_normalized_specifications(apps, schema_editor):
+    """
+    Fills normalized specification columns for already existing specifications
+    """
+    ProductSpecifications = apps.get_model("api", "ProductSpecifications")
+    specifications = list(ProductSpecifications.objects.all())
+    for specification in specifications:
+        specification.key = normalize(specification.name)
+        specification.value_key = normalize(specification.value)
+        specification.numeric_value = parse_number(specification.value)
+    ProductSpecifications.objects.bulk_update(
+        specifications, ["key", "value_key", "numeric_value"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0046_related_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productspecifications',
+            name='key',
+            field=models.CharField(default='', editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='productspecifications',
+            name='numeric_value',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productspecifications',
+            name='value_key',
+            field=models.CharField(default='', editable=False, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='productspecifications',
+            index=models.Index(fields=['key', 'value_key', 'product'], name='specification_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productspecifications',
+            index=models.Index(fields=['key', 'numeric_value', 'product'], name='specification_number_idx'),
+        ),
+        migrations.RunPython(fill_normalized_specifications, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_products(apps, schema_editor):
+    """
+    Counts not archived products of already existing categories and subcategories
+    """
+    Category = apps.get_model("api", "Category")
+    Subcategory = apps.get_model("api", "Subcategory")
+    Product = apps.get_model("api", "Product")
+    for model, lookup in ((Subcategory, "category"), (Category, "category__category")):
+        products = Product.objects.filter(**{lookup: OuterRef("pk")}, archived=False).order_by()
+        model.objects.update(
+            products_count=Coalesce(
+                Subquery(products.values(lookup).annotate(value=Count("id")).values("value")), 0
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0047_specification_filters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
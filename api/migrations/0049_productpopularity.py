@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0048_products_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='api.product')),
+                ('rank', models.PositiveIntegerField()),
+                ('score', models.FloatField(default=0)),
+                ('sales', models.FloatField(default=0)),
+                ('views', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['rank'], name='product_popularity_rank_idx')],
+            },
+        ),
+    ]
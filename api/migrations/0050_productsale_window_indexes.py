@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0049_productpopularity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productsale',
+            index=models.Index(fields=['dateTo', 'dateFrom'], name='productsale_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsale',
+            index=models.Index(fields=['dateFrom'], name='productsale_start_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0050_productsale_window_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSaleHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('salePrice', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('dateFrom', models.DateTimeField()),
+                ('dateTo', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'dateFrom'], name='salehistory_product_date_idx')],
+            },
+        ),
+    ]
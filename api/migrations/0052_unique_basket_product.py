@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:12
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Merges basket rows of the same user and product into the earliest one, summing their counts
+    """
+    Basket = apps.get_model("api", "Basket")
+    duplicates = Basket.objects.values("user", "product").annotate(
+        rows=Count("id"), first=Min("id"), total=Sum("count")
+    ).filter(rows__gt=1).order_by()
+    for row in duplicates:
+        Basket.objects.filter(pk=row["first"]).update(count=row["total"])
+        Basket.objects.filter(user=row["user"], product=row["product"]).exclude(pk=row["first"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0051_productsalehistory'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basket',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_basket_user_product'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def fill_product_cards(apps, schema_editor):
+    """
+    Builds cards of already existing products, which have no cards yet.
+    Cards are rendered by the API serializers, which work with the current models only,
+    so the cards are built by the same code as "rebuild_product_cards" command uses.
+    """
+    from api.cards import refresh_cards
+    from api.models import Product
+
+    refresh_cards(Product.objects.filter(card__isnull=True).values_list("pk", flat=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0054_productviews'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_product_cards, migrations.RunPython.noop),
+    ]
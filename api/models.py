@@ -1,5 +1,12 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Avg, Count, F, Max, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .specifications import normalize, parse_number
 
 
 def category_images_directory_path(instance: "Category", filename: str) -> str:
@@ -12,15 +19,58 @@ def category_images_directory_path(instance: "Category", filename: str) -> str:
     return "api/categories/{filename}".format(filename=filename)
 
 
+class CategoryQuerySet(models.QuerySet):
+    """
+    QuerySet for Category model
+    """
+
+    def refresh_products_count(self) -> int:
+        """
+        Recalculates denormalized "products_count" column (number of not archived products in all the subcategories)
+        of the categories in the queryset by a single UPDATE statement
+        :return: number of updated categories
+        """
+        products = Product.objects.filter(category__category=OuterRef("pk"), archived=False).order_by()
+        return self.update(
+            products_count=Coalesce(
+                Subquery(products.values("category__category").annotate(value=Count("id")).values("value")), 0
+            )
+        )
+
+
 class Category(models.Model):
     """
     Class for top level menu items
     Images stored in "api/categories"
+    "products_count" is maintained by signals on product changes
     """
     id = models.DecimalField(primary_key=True, max_digits=3, decimal_places=0, default=1, unique=True)
     title = models.CharField(max_length=30, blank=False, null=False)
     src = models.ImageField(null=True, blank=True, upload_to=category_images_directory_path)
     alt = models.CharField(max_length=50, default="There should be an image of the category")
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CategoryQuerySet.as_manager()
+
+
+class SubcategoryQuerySet(models.QuerySet):
+    """
+    QuerySet for Subcategory model
+    """
+
+    def refresh_products_count(self) -> int:
+        """
+        Recalculates denormalized "products_count" column (number of not archived products)
+        of the subcategories in the queryset by a single UPDATE statement
+        :return: number of updated subcategories
+        """
+        products = Product.objects.filter(category=OuterRef("pk"), archived=False).order_by()
+        return self.update(
+            products_count=Coalesce(
+                Subquery(products.values("category").annotate(value=Count("id")).values("value")), 0
+            )
+        )
 
 
 class Subcategory(models.Model):
@@ -28,12 +78,17 @@ class Subcategory(models.Model):
     Class for lower level menu items
     Images stored in "api/categories" with the images for Categories
     Relations with corresponding Categories establish through "category" Foreign key
+    "products_count" is maintained by signals on product changes
     """
     id = models.DecimalField(primary_key=True, max_digits=6, decimal_places=0, default=1001, unique=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     title = models.CharField(max_length=30, blank=False, null=False)
     src = models.ImageField(null=True, blank=True, upload_to=category_images_directory_path)
     alt = models.CharField(max_length=50, default="There should be an image of the subcategory")
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SubcategoryQuerySet.as_manager()
 
 
 class Tag(models.Model):
@@ -43,6 +98,69 @@ class Tag(models.Model):
     """
     name = models.CharField(max_length=20, null=False, blank=False)
     category = models.ManyToManyField(Subcategory)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+    QuerySet for Product model
+    """
+
+    def refresh_review_stats(self) -> int:
+        """
+        Recalculates denormalized "rating_avg" and "reviews_count" columns of the products in the queryset.
+        Both values are calculated by the database in a single UPDATE statement, so concurrent reviews
+        can't leave the columns inconsistent.
+        :return: number of updated products
+        """
+        reviews = Review.objects.filter(product=OuterRef("pk")).order_by().values("product")
+        return self.update(
+            rating_avg=Subquery(reviews.annotate(value=Avg("rate")).values("value")),
+            reviews_count=Coalesce(Subquery(reviews.annotate(value=Count("id")).values("value")), 0),
+        )
+
+    def with_price(self, at=None) -> "ProductQuerySet":
+        """
+        Annotates products with "current_price" - price of the product at the moment "at" (now by default).
+        Prices of all the products are resolved by the same query, whatever number of them is on sale.
+        :param at: moment, the price is calculated for
+        :return:
+        """
+        return self.annotate(current_price=current_price_expression(at=at))
+
+    def modification_state(self, sales=None, at=None) -> dict:
+        """
+        Returns the latest modification time of the products in the queryset and their number by a single query.
+        Prices of the products change without any modifications, when a sale starts or ends, so the latest
+        start or end of "sales" (all the sales by default), passed by the moment "at" (now by default),
+        counts as a modification too.
+        :param sales: sales, which affect prices of the products
+        :param at:
+        :return:
+        """
+        if sales is None:
+            sales = ProductSale.objects.all()
+        if at is None:
+            at = timezone.now()
+        boundaries = {
+            field: Max(Subquery(
+                sales.filter(**{f"{field}__lte": at}).order_by(f"-{field}").values(field)[:1]
+            ))
+            for field in ("dateFrom", "dateTo")
+        }
+        state = self.order_by().aggregate(updated=Max("updated_at"), count=Count("id"), **boundaries)
+        moments = [state[key] for key in ("updated", "dateFrom", "dateTo") if state[key] is not None]
+        return {"updated": max(moments) if moments else None, "count": state["count"]}
+
+    def for_cards(self, at=None) -> "ProductQuerySet":
+        """
+        Returns products with all the data product cards show: current price and precomputed card
+        (see "ProductCard"). Both are fetched by the same query as the products themselves,
+        so a page of product cards costs a single query.
+        :param at: moment, the price is calculated for
+        :return:
+        """
+        return self.with_price(at).select_related("card")
 
 
 class Product(models.Model):
@@ -51,6 +169,9 @@ class Product(models.Model):
     Images stored in separate model named "ProductImage"
     Relations with corresponding Subcategories establish through "category" Foreign key
     Relations with corresponding Tags establish through "tags" Many to Many field
+    Fields "rating_avg" and "reviews_count" are denormalized from "Review" and kept up to date by signals
+    Field "updated_at" is also touched by signals, when images, tags, sales, specifications or reviews
+    of the product change, so it's the modification time of all the product data
     """
 
     category = models.ForeignKey(Subcategory, on_delete=models.PROTECT)
@@ -64,6 +185,29 @@ class Product(models.Model):
     limited = models.BooleanField(default=False)
     available = models.BooleanField(default=True)
     tags = models.ManyToManyField(Tag)
+    rating_avg = models.FloatField(null=True, blank=True, editable=False)
+    reviews_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # indexes follow the catalog access patterns: filtering by (sub)category and price range together
+        # with sorting, keyset pagination (sort column + id) and limited products list.
+        # Catalog never shows archived products, so its indexes leave them out.
+        indexes = [
+            models.Index(
+                fields=["category", "price", "id"], condition=Q(archived=False), name="product_category_price_idx"
+            ),
+            models.Index(
+                fields=["category", "date", "id"], condition=Q(archived=False), name="product_category_date_idx"
+            ),
+            models.Index(fields=["price", "id"], condition=Q(archived=False), name="product_price_idx"),
+            models.Index(fields=["date", "id"], condition=Q(archived=False), name="product_date_idx"),
+            models.Index(fields=["rating_avg", "id"], condition=Q(archived=False), name="product_rating_idx"),
+            models.Index(fields=["reviews_count", "id"], condition=Q(archived=False), name="product_reviews_idx"),
+            models.Index(fields=["title"], condition=Q(limited=True), name="product_limited_title_idx"),
+        ]
 
     def __str__(self) -> str:
         """
@@ -72,6 +216,22 @@ class Product(models.Model):
         """
         return f"Product(pk={self.pk}, name={self.title!r})"
 
+    def get_current_price(self, at=None):
+        """
+        Returns price of the product at the moment "at" (now by default).
+        Uses "current_price" annotation if the product was fetched with "ProductQuerySet.with_price",
+        otherwise resolves the price by the sale schedule (see "sale_schedule.py") without queries.
+        :param at: moment, the price is calculated for
+        :return:
+        """
+        if at is None and hasattr(self, "current_price"):
+            # SQLite returns calculated decimals with float digits, so they are rounded to cents
+            return self.current_price.quantize(Decimal("0.01"))
+        # the schedule module imports models, so it's imported here
+        from .sale_schedule import get_prices
+
+        return get_prices({self.pk: self.price}, at)[self.pk]
+
 
 def product_images_directory_path(instance: "ProductImage", filename: str) -> str:
     """
@@ -94,6 +254,7 @@ class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     src = models.ImageField(null=True, blank=True, upload_to=product_images_directory_path)
     alt = models.CharField(max_length=50, default="There should be an image of the product")
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class Review(models.Model):
@@ -108,27 +269,168 @@ class Review(models.Model):
     text = models.TextField(null=False, blank=False, max_length=300)
     date = models.DateTimeField(auto_now_add=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProductCard(models.Model):
+    """
+    Class for precomputed product cards (denormalized read model of product lists)
+    Holds everything product lists show about the product except its current price, which depends on time
+    and is resolved by the list query itself. Cards are rebuilt by signals whenever the product, its images,
+    tags or reviews change, and by "rebuild_product_cards" command.
+    Relation with corresponding Product instance establishes through "product" One to One field
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="card")
+    data = models.JSONField(default=dict)
+
+
+class ProductSaleQuerySet(models.QuerySet):
+    """
+    QuerySet for ProductSale model
+    """
+
+    def active(self, at=None) -> "ProductSaleQuerySet":
+        """
+        Returns sales, which window contains the moment "at" (now by default).
+        The window includes "dateFrom" and excludes "dateTo".
+        :param at: moment, the sales are checked for
+        :return:
+        """
+        if at is None:
+            at = timezone.now()
+        return self.filter(dateFrom__lte=at, dateTo__gt=at)
+
+    def upcoming(self, at=None) -> "ProductSaleQuerySet":
+        """
+        Returns sales, which start after the moment "at" (now by default)
+        :param at:
+        :return:
+        """
+        if at is None:
+            at = timezone.now()
+        return self.filter(dateFrom__gt=at)
+
+    def ended(self, at=None) -> "ProductSaleQuerySet":
+        """
+        Returns sales, which ended by the moment "at" (now by default)
+        :param at:
+        :return:
+        """
+        if at is None:
+            at = timezone.now()
+        return self.filter(dateTo__lte=at)
+
+    def next_boundary(self, at=None):
+        """
+        Returns the nearest moment after "at" (now by default), when any of the sales starts or ends,
+        or None if there are no such moments
+        :param at:
+        :return:
+        """
+        if at is None:
+            at = timezone.now()
+        boundaries = self.aggregate(
+            start=Min("dateFrom", filter=Q(dateFrom__gt=at)),
+            end=Min("dateTo", filter=Q(dateTo__gt=at)),
+        )
+        moments = [moment for moment in boundaries.values() if moment is not None]
+        return min(moments) if moments else None
 
 
 class ProductSale(models.Model):
     """
     Class for products on sale
     Relation with corresponding Product instance establishes through "product" Foreign key
+    Sale is applied to the product only inside its window from "dateFrom" to "dateTo"
+    Active and upcoming sales end in the future, so they are found by the window index, starting from "dateTo".
     """
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     salePrice = models.DecimalField(default=0, max_digits=8, decimal_places=2)
     dateFrom = models.DateTimeField()
     dateTo = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductSaleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["dateTo", "dateFrom"], name="productsale_window_idx"),
+            models.Index(fields=["dateFrom"], name="productsale_start_idx"),
+        ]
+
+
+class ProductSaleHistory(models.Model):
+    """
+    Class for archived sales, which ended long ago
+    Sales are moved here from ProductSale by "archive_sales" command together with the ordinary price
+    of the product at the moment of archiving, so discounts can be summarized later.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+    salePrice = models.DecimalField(max_digits=8, decimal_places=2)
+    dateFrom = models.DateTimeField()
+    dateTo = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "dateFrom"], name="salehistory_product_date_idx"),
+        ]
+
+
+def current_price_expression(product_ref: str = "pk", price_ref: str = "price", at=None) -> Coalesce:
+    """
+    Returns expression, which calculates price of the product at the moment "at" (now by default).
+    If several sales of the product are active, the lowest sale price wins.
+    If the product isn't on sale, its ordinary price is used.
+    :param product_ref: lookup of the product primary key from the queried model
+    :param price_ref: lookup of the product ordinary price from the queried model
+    :param at: moment, the price is calculated for
+    :return:
+    """
+    sales = ProductSale.objects.active(at).filter(product=OuterRef(product_ref)).order_by("salePrice")
+    return Coalesce(
+        Subquery(sales.values("salePrice")[:1]),
+        F(price_ref),
+        output_field=models.DecimalField(max_digits=8, decimal_places=2),
+    )
 
 
 class ProductSpecifications(models.Model):
     """
     Class for product specifications
     Relation with corresponding Product instance establishes through "product" Foreign key
+    Fields "key", "value_key" and "numeric_value" are normalized copies of "name" and "value" for catalog filters
     """
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     name = models.CharField(null=False, blank=False, max_length=50)
     value = models.CharField(null=False, blank=True, max_length=50)
+    key = models.CharField(max_length=50, default="", editable=False)
+    value_key = models.CharField(max_length=50, default="", editable=False)
+    numeric_value = models.FloatField(null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # catalog filters select products by normalized name and value or by a range of numeric values
+        indexes = [
+            models.Index(fields=["key", "value_key", "product"], name="specification_value_idx"),
+            models.Index(fields=["key", "numeric_value", "product"], name="specification_number_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Modified method "save" fills normalized "key", "value_key" and "numeric_value" fields,
+        which catalog filters use
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        self.key = normalize(self.name)
+        self.value_key = normalize(self.value)
+        self.numeric_value = parse_number(self.value)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"key", "value_key", "numeric_value"}
+        super().save(*args, **kwargs)
 
 
 class Basket(models.Model):
@@ -136,12 +438,18 @@ class Basket(models.Model):
     Class for user basket items
     Relation with corresponding User instance establishes through "user" Foreign key
     Relation with corresponding Product instance establishes through "product" Foreign key
+    Every product is stored once in the user's basket, its "count" is the number of the items
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date = models.DateTimeField(auto_now_add=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product_id')
     count = models.DecimalField(max_digits=6, decimal_places=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "product"], name="unique_basket_user_product"),
+        ]
+
 
 class TemporaryBasket(models.Model):
     """
@@ -232,3 +540,98 @@ class Payment(models.Model):
     month = models.CharField(max_length=2, null=False, blank=False)
     year = models.CharField(max_length=4, null=False, blank=False)
     code = models.CharField(max_length=3, null=False, blank=False)
+
+
+class ProductCoPurchase(models.Model):
+    """
+    Class for co-purchase counts (sparse product co-occurrence matrix)
+    Row holds the number of paid orders, which contained both products. Every pair is stored in both directions,
+    so all the neighbours of a product are selected by its index range.
+    Rows are built by "build_related_products" command.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "other"], name="unique_product_copurchase"),
+        ]
+
+
+class ProductRelated(models.Model):
+    """
+    Class for top co-purchased products ("customers also bought"), precomputed from ProductCoPurchase
+    Products are ranked by the number of common orders, "rank" starts from 1.
+    Rows are built by "build_related_products" command.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="recommended_for")
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "rank"], name="unique_product_related_rank"),
+        ]
+
+
+class ProductPopularity(models.Model):
+    """
+    Class for precomputed popularity of products, combining rating, number of reviews, recent sales and views
+    Sales and views are decayed with time, "rank" starts from 1 for the most popular product.
+    Rows are rebuilt by "rank_popular_products" command.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="popularity")
+    rank = models.PositiveIntegerField()
+    score = models.FloatField(default=0)
+    sales = models.FloatField(default=0)
+    views = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["rank"], name="product_popularity_rank_idx"),
+        ]
+
+
+class ProductViews(models.Model):
+    """
+    Class for views of product pages, counted by web processes and not ranked yet.
+    Every row is a batch of views of a product, written at once. Rows are taken and deleted
+    by "rank_popular_products" command, views of deleted products are just dropped then.
+    """
+    product = models.ForeignKey(
+        Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    views = models.PositiveIntegerField()
+
+
+class JobState(models.Model):
+    """
+    Class for progress of incremental background jobs (management commands)
+    "last_id" is the id of the last processed row, the next run starts after it.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class DataVersion(models.Model):
+    """
+    Class for versions of the data, which processes keep in memory (category tree, tag index, sale schedule).
+    The version is a random token, replaced by every change in the same transaction as the data,
+    so all the processes see it changed right after the commit and never after a rollback.
+    """
+    key = models.CharField(max_length=50, unique=True)
+    version = models.CharField(max_length=32)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ResponseCacheStats(models.Model):
+    """
+    Class for hit and miss counters of the cached endpoints (see "API_RESPONSE_CACHE" setting)
+    Web processes count hits and misses in memory and add them to the stored counters in batches.
+    """
+    endpoint = models.CharField(max_length=50, unique=True)
+    hits = models.PositiveBigIntegerField(default=0)
+    misses = models.PositiveBigIntegerField(default=0)
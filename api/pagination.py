@@ -1,4 +1,13 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from operator import attrgetter
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
 
 
@@ -23,6 +32,174 @@ class CustomPagination(PageNumberPagination):
         })
 
 
+class KeysetPagination(BasePagination):
+    """
+    Cursor (keyset) paginator. Instead of page number client sends "cursor", received with the previous page.
+    Cursor holds values of the sort column and "id" of the last item on the previous page, so the next page
+    is selected by an index range condition without COUNT(*) and OFFSET, and deep pages cost the same as the first.
+    Queryset is sorted by its first ordering field (or by "id" if there is no ordering) and then by "id".
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Returns items of the page, which follows the position, specified by the cursor
+        :param queryset:
+        :param request:
+        :param view:
+        :return:
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_sort_field(queryset)
+        cursor = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.get_ordering())
+        if cursor is not None:
+            try:
+                queryset = queryset.filter(self.get_position_filter(cursor["value"], cursor["id"]))
+            except (ValidationError, ValueError, TypeError):
+                # the sort value of a forged cursor doesn't fit the sort field
+                raise NotFound(self.invalid_cursor_message)
+        self.page_number = cursor["page"] + 1 if cursor is not None else 1
+        items = list(queryset[:page_size + 1])
+        self.has_next = len(items) > page_size
+        items = items[:page_size]
+        self.next_cursor = self.encode_cursor(items[-1]) if self.has_next else None
+        return items
+
+    def get_page_size(self, request) -> int:
+        """
+        Returns page size from "limit" parameter, limited by "max_page_size"
+        :param request:
+        :return:
+        """
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    @staticmethod
+    def get_sort_field(queryset) -> tuple:
+        """
+        Returns name of the field, queryset is sorted by, and flag of the descending order
+        :param queryset:
+        :return:
+        """
+        ordering = [item for item in queryset.query.order_by if isinstance(item, str)]
+        if not ordering or ordering[0].lstrip("-") == "pk":
+            return "id", ordering[0].startswith("-") if ordering else False
+        return ordering[0].lstrip("-"), ordering[0].startswith("-")
+
+    def get_ordering(self) -> list:
+        """
+        Returns ordering of the queryset: sort field first, "id" as a tiebreaker.
+        NULL values go first in ascending order and last in descending on all database backends.
+        :return:
+        """
+        if self.descending:
+            ordering = [F(self.field).desc(nulls_last=True), F("id").desc()]
+        else:
+            ordering = [F(self.field).asc(nulls_first=True), F("id").asc()]
+        if self.field == "id":
+            return ordering[1:]
+        return ordering
+
+    def get_position_filter(self, value, last_id) -> Q:
+        """
+        Returns condition, which selects items following the item with the given sort value and id
+        :param value:
+        :param last_id:
+        :return:
+        """
+        field = self.field
+        if field == "id":
+            return Q(id__lt=last_id) if self.descending else Q(id__gt=last_id)
+        if self.descending:
+            if value is None:
+                return Q(**{f"{field}__isnull": True, "id__lt": last_id})
+            return (
+                Q(**{f"{field}__lt": value})
+                | Q(**{field: value, "id__lt": last_id})
+                | Q(**{f"{field}__isnull": True})
+            )
+        if value is None:
+            return Q(**{f"{field}__isnull": True, "id__gt": last_id}) | Q(**{f"{field}__isnull": False})
+        return Q(**{f"{field}__gt": value}) | Q(**{field: value, "id__gt": last_id})
+
+    def encode_cursor(self, item) -> str:
+        """
+        Returns cursor, which points to the position right after the item
+        :param item:
+        :return:
+        """
+        value = attrgetter(self.field.replace("__", "."))(item)
+        data = json.dumps(
+            {"value": value, "id": item.id, "page": self.page_number},
+            cls=DjangoJSONEncoder,
+        )
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request):
+        """
+        Returns position from the cursor of the request or None if there is no cursor
+        :param request:
+        :return:
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            return {"value": cursor["value"], "id": int(cursor["id"]), "page": int(cursor["page"])}
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_paginated_response(self, data):
+        """
+        Method "get_paginated_response" returns the same fields as CustomPagination does and the cursor
+        of the next page. Total number of pages is unknown, so "lastPage" is the next page if it exists.
+        :param data:
+        :return:
+        """
+        return Response({
+            'items': data,
+            'currentPage': self.page_number,
+            'lastPage': self.page_number + 1 if self.has_next else self.page_number,
+            'nextCursor': self.next_cursor,
+        })
+
+
+class KeysetPaginationMixin:
+    """
+    Mixin for list views, which lets client switch from the default paginator to KeysetPagination
+    with "pagination=cursor" parameter or by sending a cursor of the page.
+    """
+    keyset_pagination_class = KeysetPagination
+    pagination_mode_query_param = 'pagination'
+
+    @property
+    def paginator(self):
+        """
+        Returns KeysetPagination instance if client asked for it or default paginator in opposite case
+        :return:
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            cursor_param = self.keyset_pagination_class.cursor_query_param
+            if params.get(self.pagination_mode_query_param) == 'cursor' or cursor_param in params:
+                self._paginator = self.keyset_pagination_class()
+            else:
+                return super().paginator
+        return self._paginator
+
+
 class ProfilePagination(PageNumberPagination):
     """
     Paginator for user's profile data. It's the least intrusive way to fit swagger requirements.
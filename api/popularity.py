@@ -0,0 +1,177 @@
+"""
+Popularity ranking of products, precomputed by a scheduled job ("rank_popular_products" command).
+
+Score of a product combines its rating, number of reviews, recent sales and views:
+
+    score = RATING * rating + REVIEWS * log(1 + reviews) + SALES * log(1 + sales) + VIEWS * log(1 + views)
+
+Sales are the numbers of items in paid orders, each weighted by 0.5 ** (age / HALF_LIFE_DAYS),
+so a sale counts half as much after every half-life. Orders older than PERIOD_DAYS are left out.
+Views are counted by product pages in the memory of web processes and written to the database in batches
+(see "ProductViews"), the job takes them in its transaction and adds them to the views, stored by the previous
+run and decayed by the same half-life. Weights, periods and batches are set by "POPULARITY_RANKING" setting.
+Popular products endpoint reads the top of the ranking by a single query.
+"""
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .models import JobState, OrderItem, Payment, Product, ProductPopularity, ProductViews
+
+JOB_NAME = "popular_products"
+
+# views, counted by the current process and not written to the database yet
+_views = Counter()
+_views_lock = threading.Lock()
+_views_written_at = time.monotonic()
+
+
+def get_config() -> dict:
+    """
+    Returns ranking weights and periods from "POPULARITY_RANKING" setting
+    :return:
+    """
+    return settings.POPULARITY_RANKING
+
+
+def decay(days: float) -> float:
+    """
+    Returns weight of an event, which happened "days" ago
+    :param days:
+    :return:
+    """
+    return 0.5 ** (max(days, 0) / get_config()["HALF_LIFE_DAYS"])
+
+
+def record_view(product_id) -> None:
+    """
+    Counts a view of the product page in the process memory. Counted views are written to the database
+    by a single statement, when there are "VIEWS_BATCH_SIZE" of them or "VIEWS_BATCH_SECONDS" passed
+    since the previous write.
+    :param product_id:
+    :return:
+    """
+    global _views_written_at
+    if not str(product_id).isdigit():
+        return
+    config = get_config()
+    with _views_lock:
+        _views[int(product_id)] += 1
+        if (
+            _views.total() < config["VIEWS_BATCH_SIZE"]
+            and time.monotonic() - _views_written_at < config["VIEWS_BATCH_SECONDS"]
+        ):
+            return
+        views = dict(_views)
+        _views.clear()
+        _views_written_at = time.monotonic()
+    write_views(views)
+
+
+def write_views(views: dict) -> None:
+    """
+    Writes a batch of counted views to the database by a single statement
+    :param views: numbers of views by product ids
+    :return:
+    """
+    ProductViews.objects.bulk_create(
+        ProductViews(product_id=product_id, views=count) for product_id, count in views.items()
+    )
+
+
+def collect_views() -> dict:
+    """
+    Takes the written views out of the database. It's called in the transaction of the ranking,
+    so the views are deleted only together with saving the ranking, which counts them.
+    Views, written meanwhile, are left for the next run.
+    :return: numbers of views by product ids
+    """
+    last_id = ProductViews.objects.aggregate(last_id=Max("id"))["last_id"]
+    if last_id is None:
+        return {}
+    batches = ProductViews.objects.filter(id__lte=last_id)
+    views = dict(batches.values("product").annotate(total=Sum("views")).order_by().values_list("product", "total"))
+    batches.delete()
+    return views
+
+
+def count_sales(at) -> dict:
+    """
+    Returns decayed number of items, sold in paid orders for "PERIOD_DAYS" before the moment "at", by product ids
+    :param at:
+    :return:
+    """
+    since = at - timezone.timedelta(days=get_config()["PERIOD_DAYS"])
+    items = OrderItem.objects.filter(
+        order__createdAt__gte=since,
+        order__in=Payment.objects.values("order"),
+    ).values_list("product", "count", "order__createdAt")
+    sales = {}
+    for product_id, count, created in items.iterator(chunk_size=2000):
+        age = (at - created).total_seconds() / 86400
+        sales[product_id] = sales.get(product_id, 0) + float(count) * decay(age)
+    return sales
+
+
+def get_score(rating, reviews: int, sales: float, views: float) -> float:
+    """
+    Returns popularity score of a product
+    :param rating:
+    :param reviews:
+    :param sales:
+    :param views:
+    :return:
+    """
+    config = get_config()
+    return (
+        config["RATING"] * (rating or 0)
+        + config["REVIEWS"] * math.log1p(reviews)
+        + config["SALES"] * math.log1p(sales)
+        + config["VIEWS"] * math.log1p(views)
+    )
+
+
+def rank(at=None) -> int:
+    """
+    Rebuilds the ranking of all not archived products
+    :param at: moment, the ranking is built for (now by default)
+    :return: number of ranked products
+    """
+    at = at or timezone.now()
+    products = list(Product.objects.filter(archived=False).values_list("id", "rating_avg", "reviews_count"))
+    sales = count_sales(at)
+
+    with transaction.atomic():
+        state, created = JobState.objects.select_for_update().get_or_create(name=JOB_NAME)
+        new_views = collect_views()
+        views_decay = 0 if created else decay((at - state.updated_at).total_seconds() / 86400)
+        stored_views = dict(ProductPopularity.objects.values_list("product", "views"))
+        rows = []
+        for product_id, rating, reviews in products:
+            views = stored_views.get(product_id, 0) * views_decay + new_views.get(product_id, 0)
+            product_sales = sales.get(product_id, 0)
+            rows.append(ProductPopularity(
+                product_id=product_id,
+                score=get_score(rating, reviews, product_sales, views),
+                sales=product_sales,
+                views=views,
+            ))
+        rows.sort(key=lambda row: (-row.score, row.product_id))
+        for number, row in enumerate(rows, start=1):
+            row.rank = number
+        ProductPopularity.objects.filter(product__archived=True).delete()
+        ProductPopularity.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["rank", "score", "sales", "views"],
+            batch_size=1000,
+        )
+        state.save()
+    return len(rows)
@@ -0,0 +1,127 @@
+"""
+"Customers also bought" recommendations, built offline from paid orders.
+
+Paid orders (orders with a payment) are scanned in batches of payments. Every pair of products, bought
+together, increments its count in the sparse co-occurrence matrix (ProductCoPurchase), and top neighbours
+of the affected products are reselected into ProductRelated, which product pages read with a single query.
+Id of the last processed payment is kept in JobState, so every run processes only orders paid since
+the previous one.
+"""
+from collections import Counter
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import JobState, OrderItem, Payment, ProductCoPurchase, ProductRelated
+
+JOB_NAME = "related_products"
+
+
+def count_pairs(order_ids) -> Counter:
+    """
+    Returns number of orders, which contain each pair of products. Pairs are counted in both directions.
+    :param order_ids:
+    :return:
+    """
+    orders = {}
+    items = OrderItem.objects.filter(order__in=order_ids).values_list("order", "product").distinct()
+    for order_id, product_id in items:
+        orders.setdefault(order_id, set()).add(product_id)
+    pairs = Counter()
+    for products in orders.values():
+        for product, other in combinations(sorted(products), 2):
+            pairs[product, other] += 1
+            pairs[other, product] += 1
+    return pairs
+
+
+def add_pairs(pairs: Counter) -> None:
+    """
+    Adds pair counts to the stored ones by a single upsert
+    :param pairs:
+    :return:
+    """
+    if not pairs:
+        return
+    stored = ProductCoPurchase.objects.filter(
+        product__in={product for product, _ in pairs},
+        other__in={other for _, other in pairs},
+    ).values_list("product", "other", "count")
+    for product, other, count in stored:
+        if (product, other) in pairs:
+            pairs[product, other] += count
+    ProductCoPurchase.objects.bulk_create(
+        [
+            ProductCoPurchase(product_id=product, other_id=other, count=count)
+            for (product, other), count in pairs.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["product", "other"],
+        update_fields=["count"],
+        batch_size=1000,
+    )
+
+
+def select_related_products(product_ids=None) -> None:
+    """
+    Reselects top co-purchased products of the products with "product_ids" (all the products if None).
+    Number of the selected products is set by "RELATED_PRODUCTS_COUNT" setting.
+    :param product_ids:
+    :return:
+    """
+    ranked = ProductCoPurchase.objects.annotate(
+        rank=Window(
+            RowNumber(),
+            partition_by=F("product"),
+            order_by=(F("count").desc(), F("other").asc()),
+        )
+    )
+    related = ProductRelated.objects.all()
+    if product_ids is not None:
+        ranked = ranked.filter(product__in=product_ids)
+        related = related.filter(product__in=product_ids)
+    ranked = ranked.filter(rank__lte=settings.RELATED_PRODUCTS_COUNT).values_list("product", "other", "count", "rank")
+    rows = [
+        ProductRelated(product_id=product, related_id=other, score=count, rank=rank)
+        for product, other, count, rank in ranked
+    ]
+    related.delete()
+    ProductRelated.objects.bulk_create(rows, batch_size=1000)
+
+
+def update(batch_size: int = 500, full: bool = False) -> int:
+    """
+    Processes orders, paid since the previous run (all the paid orders if "full" is True), in batches
+    of "batch_size" payments. Every batch is saved together with the job progress in a single transaction.
+    :param batch_size:
+    :param full:
+    :return: number of processed orders
+    """
+    if full:
+        with transaction.atomic():
+            ProductCoPurchase.objects.all().delete()
+            ProductRelated.objects.all().delete()
+            JobState.objects.update_or_create(name=JOB_NAME, defaults={"last_id": 0})
+    processed = 0
+    while True:
+        with transaction.atomic():
+            state, _ = JobState.objects.select_for_update().get_or_create(name=JOB_NAME)
+            payments = list(
+                Payment.objects.filter(id__gt=state.last_id).order_by("id").values_list("id", "order")[:batch_size]
+            )
+            if not payments:
+                return processed
+            order_ids = {order_id for _, order_id in payments}
+            # orders, paid more than once, were counted by the first payment
+            order_ids -= set(
+                Payment.objects.filter(order__in=order_ids, id__lte=state.last_id).values_list("order", flat=True)
+            )
+            pairs = count_pairs(order_ids)
+            add_pairs(pairs)
+            select_related_products({product for product, _ in pairs})
+            state.last_id = payments[-1][0]
+            state.save()
+            processed += len(order_ids)
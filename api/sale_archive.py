@@ -0,0 +1,102 @@
+"""
+Archiving of ended sales and summary of discounts.
+
+Sales, which ended before a cutoff, are moved from ProductSale to ProductSaleHistory in batches,
+every batch in its own short transaction, so the hot sales table stays proportional to the number
+of active and upcoming sales and writers are never locked for long. Archived sales don't change
+current prices, so they are deleted without per-row signals, the sale schedule is invalidated once per batch.
+"""
+import time
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models.functions import TruncMonth
+
+from . import sale_schedule
+from .models import ProductSale, ProductSaleHistory
+
+
+def delete_sales(sale_ids) -> None:
+    """
+    Deletes sales by a single statement without sending signals
+    :param sale_ids:
+    :return:
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM {table} WHERE {pk} IN ({placeholders})".format(
+                table=connection.ops.quote_name(ProductSale._meta.db_table),
+                pk=connection.ops.quote_name(ProductSale._meta.pk.column),
+                placeholders=", ".join(["%s"] * len(sale_ids)),
+            ),
+            sale_ids,
+        )
+
+
+def archive(cutoff, batch_size: int = 500, pause: float = 0) -> int:
+    """
+    Moves sales, which ended before the cutoff, to the history
+    :param cutoff:
+    :param batch_size: number of sales, moved by a transaction
+    :param pause: seconds to sleep between the batches, letting other writers in
+    :return: number of archived sales
+    """
+    archived = 0
+    while True:
+        with transaction.atomic():
+            sales = list(
+                ProductSale.objects.filter(
+                    dateTo__lt=cutoff
+                ).order_by("dateTo", "id").values_list(
+                    "id", "product", "product__price", "salePrice", "dateFrom", "dateTo"
+                )[:batch_size]
+            )
+            if not sales:
+                return archived
+            ProductSaleHistory.objects.bulk_create(
+                ProductSaleHistory(
+                    product_id=product_id, price=price, salePrice=sale_price, dateFrom=start, dateTo=end
+                )
+                for _, product_id, price, sale_price, start, end in sales
+            )
+            delete_sales([sale_id for sale_id, *_ in sales])
+            sale_schedule.invalidate_schedule()
+        archived += len(sales)
+        if pause:
+            time.sleep(pause)
+
+
+def summarize_discounts(product) -> list:
+    """
+    Returns discounts of the product by months of the sale starts, archived and current sales together:
+    number of sales, the lowest sale price and the greatest discount in money and in percents.
+    Current sales are compared with the current ordinary price, archived ones with the price at archiving.
+    :param product:
+    :return:
+    """
+    rows = list(
+        ProductSaleHistory.objects.filter(product=product).annotate(
+            month=TruncMonth("dateFrom")
+        ).values_list("month", "price", "salePrice")
+    ) + [
+        (month, product.price, sale_price)
+        for month, sale_price in ProductSale.objects.filter(product=product).annotate(
+            month=TruncMonth("dateFrom")
+        ).values_list("month", "salePrice")
+    ]
+    months = {}
+    for month, price, sale_price in rows:
+        discount = max(price - sale_price, Decimal(0))
+        percent = (discount * 100 / price).quantize(Decimal("0.01")) if price else Decimal(0)
+        summary = months.setdefault(month, {
+            "period": month.strftime("%Y-%m"),
+            "sales": 0,
+            "minSalePrice": sale_price,
+            "maxDiscount": discount,
+            "maxDiscountPercent": percent,
+        })
+        summary["sales"] += 1
+        summary["minSalePrice"] = min(summary["minSalePrice"], sale_price)
+        summary["maxDiscount"] = max(summary["maxDiscount"], discount)
+        summary["maxDiscountPercent"] = max(summary["maxDiscountPercent"], percent)
+    return [months[month] for month in sorted(months)]
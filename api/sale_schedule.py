@@ -0,0 +1,144 @@
+"""
+In-memory schedule of sale prices, which answers "price of the product at the moment" without querying sales.
+
+Sale windows of every product are merged into a sorted array of moments, when the effective sale price
+changes, and an array of the prices, effective from each moment till the next one (None if no sale is active).
+So the price at any moment is found by a binary search. Precedence of overlapping sales is the same as
+in "current_price_expression": the window includes "dateFrom" and excludes "dateTo", and the lowest
+sale price of the active sales wins. If no sale is active, the ordinary price of the product is used.
+
+The schedule is built by a single query on the first use in a process and is kept under the current
+schedule version, stored in the database (see "DataVersion"), so a lookup costs a single query of the version.
+The version is bumped by signals, whenever any sale changes (see "signals.py"), so every process rebuilds
+its schedule on the next lookup after the change is committed.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import bump_stored_version, get_stored_version
+from .models import ProductSale
+
+SALE_SCHEDULE_VERSION_KEY = "api:sale_schedule:version"
+
+# moments, when the sale price of the product changes, and the prices, effective from them
+ProductSchedule = namedtuple("ProductSchedule", ["moments", "prices"])
+SaleSchedule = namedtuple("SaleSchedule", ["version", "products"])
+
+# schedule of the current process, replaced as a whole, so concurrent threads always see a consistent schedule
+_schedule = SaleSchedule(None, {})
+
+
+def build_product_schedule(sales) -> ProductSchedule:
+    """
+    Merges sale windows of a product into arrays of moments and effective sale prices
+    :param sales: list of (sale price, start, end)
+    :return:
+    """
+    moments = sorted({moment for _, start, end in sales for moment in (start, end)})
+    schedule = ProductSchedule([], [])
+    for moment in moments:
+        active = [price for price, start, end in sales if start <= moment < end]
+        price = min(active) if active else None
+        if not schedule.prices or schedule.prices[-1] != price:
+            schedule.moments.append(moment)
+            schedule.prices.append(price)
+    return schedule
+
+
+def build_schedule(version) -> SaleSchedule:
+    """
+    Builds schedules of all the products on sale by a single query
+    :param version:
+    :return:
+    """
+    sales = {}
+    # sales with empty windows are never active
+    rows = ProductSale.objects.filter(
+        dateFrom__lt=F("dateTo")
+    ).values_list("product", "salePrice", "dateFrom", "dateTo")
+    for product_id, price, start, end in rows.iterator(chunk_size=2000):
+        sales.setdefault(product_id, []).append((price, start, end))
+    return SaleSchedule(
+        version,
+        {product_id: build_product_schedule(product_sales) for product_id, product_sales in sales.items()},
+    )
+
+
+def get_schedule() -> SaleSchedule:
+    """
+    Returns the schedule of the current version, building it if the process has an outdated one
+    :return:
+    """
+    global _schedule
+    version = get_stored_version(SALE_SCHEDULE_VERSION_KEY)
+    schedule = _schedule
+    if schedule.version != version:
+        schedule = build_schedule(version)
+        _schedule = schedule
+    return schedule
+
+
+def invalidate_schedule() -> None:
+    """
+    Bumps the schedule version, so the schedule is rebuilt by every process on the next lookup
+    :return:
+    """
+    bump_stored_version(SALE_SCHEDULE_VERSION_KEY)
+
+
+def get_sale_prices(product_ids, at=None) -> dict:
+    """
+    Returns sale prices of the products, which are on sale at the moment "at" (now by default),
+    by the product ids. Products, which aren't on sale, are left out.
+    :param product_ids:
+    :param at:
+    :return:
+    """
+    if at is None:
+        at = timezone.now()
+    products = get_schedule().products
+    prices = {}
+    for product_id in product_ids:
+        schedule = products.get(product_id)
+        if schedule is None:
+            continue
+        position = bisect_right(schedule.moments, at) - 1
+        if position >= 0 and schedule.prices[position] is not None:
+            prices[product_id] = schedule.prices[position]
+    return prices
+
+
+def get_prices(products, at=None) -> dict:
+    """
+    Returns prices of the products at the moment "at" (now by default) by the product ids:
+    the sale price if the product is on sale, and the ordinary price in opposite case
+    :param products: dict of the ordinary prices by the product ids
+    :param at:
+    :return:
+    """
+    sale_prices = get_sale_prices(products, at)
+    return {
+        product_id: Decimal(sale_prices.get(product_id, price)).quantize(Decimal("0.01"))
+        for product_id, price in products.items()
+    }
+
+
+def get_price_history(product_id, price) -> list:
+    """
+    Returns changes of the product price: list of (moment, price) pairs, sorted by the moments.
+    The price before the first moment is the ordinary one.
+    :param product_id:
+    :param price: ordinary price of the product
+    :return:
+    """
+    schedule = get_schedule().products.get(product_id)
+    if schedule is None:
+        return []
+    return [
+        (moment, price if sale_price is None else sale_price)
+        for moment, sale_price in zip(schedule.moments, schedule.prices)
+    ]
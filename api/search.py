@@ -0,0 +1,216 @@
+"""
+Full-text search index over products title, description and tag names.
+
+SQLite keeps the index in FTS5 virtual table "api_productsearch" with product id as a rowid.
+PostgreSQL keeps weighted "tsvector" documents in "api_productsearch" table with GIN index.
+Both tables are created by migration "0042_productsearch". Other backends have no index,
+so search falls back to "icontains" lookup on the product title.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Expression, F, FloatField, QuerySet
+from django.db.models.expressions import RawSQL
+
+from .models import Product, Tag
+
+SEARCH_TABLE = "api_productsearch"
+
+# SQL, which (re)fills the index for the products, selected by "{where}" condition
+INDEX_SQL = {
+    "sqlite": """
+        INSERT INTO {search} (rowid, title, description, tags)
+        SELECT p.id, p.title, p.description, COALESCE(
+            (SELECT group_concat(t.name, ' ') FROM {through} pt JOIN {tag} t ON t.id = pt.tag_id
+             WHERE pt.product_id = p.id), ''
+        )
+        FROM {product} p {where}
+    """,
+    "postgresql": """
+        INSERT INTO {search} (product_id, document)
+        SELECT p.id,
+            setweight(to_tsvector('simple', p.title), 'A')
+            || setweight(to_tsvector('simple', COALESCE(
+                (SELECT string_agg(t.name, ' ') FROM {through} pt JOIN {tag} t ON t.id = pt.tag_id
+                 WHERE pt.product_id = p.id), ''
+            )), 'B')
+            || setweight(to_tsvector('simple', p.description), 'C')
+        FROM {product} p {where}
+    """,
+}
+
+DELETE_SQL = {
+    "sqlite": "DELETE FROM {search} {where}",
+    "postgresql": "DELETE FROM {search} {where}",
+}
+
+# key column of the index table and condition, which selects matching rows
+KEY_COLUMN = {
+    "sqlite": "rowid",
+    "postgresql": "product_id",
+}
+
+MATCH_SQL = {
+    "sqlite": "SELECT rowid FROM {search} WHERE {search} MATCH %s",
+    "postgresql": "SELECT product_id FROM {search} WHERE document @@ to_tsquery('simple', %s)",
+}
+
+# rank is calculated so that the better match has the greater rank on both backends.
+# FTS5 "bm25" weights are given for title, description and tags columns correspondingly.
+RANK_SQL = {
+    "sqlite": "(SELECT -bm25({search}, 10.0, 1.0, 5.0) FROM {search} WHERE {search} MATCH %s AND rowid = {key})",
+    "postgresql": (
+        "(SELECT ts_rank(document, to_tsquery('simple', %s)) FROM {search} WHERE product_id = {key})"
+    ),
+}
+
+
+def is_supported() -> bool:
+    """
+    Returns True if the database backend has full-text search index
+    :return:
+    """
+    return connection.vendor in INDEX_SQL
+
+
+def _format(sql: str, **kwargs) -> str:
+    """
+    Substitutes table names into the SQL template
+    :param sql:
+    :param kwargs:
+    :return:
+    """
+    return sql.format(
+        search=SEARCH_TABLE,
+        product=Product._meta.db_table,
+        tag=Tag._meta.db_table,
+        through=Product.tags.through._meta.db_table,
+        **kwargs
+    )
+
+
+def _where(column: str, product_ids) -> tuple:
+    """
+    Returns WHERE clause, which selects rows of the given products, and its parameters.
+    If product ids are not specified, all rows are selected.
+    :param column:
+    :param product_ids:
+    :return:
+    """
+    if product_ids is None:
+        return "", []
+    product_ids = list(product_ids)
+    return "WHERE {column} IN ({placeholders})".format(
+        column=column,
+        placeholders=", ".join(["%s"] * len(product_ids)),
+    ), product_ids
+
+
+def remove_products(product_ids=None) -> None:
+    """
+    Removes products from the index. If product ids are not specified, the whole index is cleared.
+    :param product_ids:
+    :return:
+    """
+    if not is_supported() or (product_ids is not None and not product_ids):
+        return
+    where, params = _where(KEY_COLUMN[connection.vendor], product_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(_format(DELETE_SQL[connection.vendor], where=where), params)
+
+
+def index_products(product_ids=None) -> None:
+    """
+    Puts current title, description and tag names of the products into the index.
+    If product ids are not specified, all products are indexed.
+    :param product_ids:
+    :return:
+    """
+    if not is_supported() or (product_ids is not None and not product_ids):
+        return
+    remove_products(product_ids)
+    where, params = _where("p.id", product_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(_format(INDEX_SQL[connection.vendor], where=where), params)
+
+
+def rebuild() -> None:
+    """
+    Rebuilds the whole index
+    :return:
+    """
+    index_products()
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(_format("INSERT INTO {search} ({search}) VALUES ('optimize')"))
+
+
+def build_query(text: str) -> str:
+    """
+    Converts text, typed by user, into full-text query of the backend.
+    Every word of the text must be present in the product data. The last word is matched as a prefix,
+    so the results are relevant while the user is still typing.
+    Returns empty string if the text contains no words.
+    :param text:
+    :return:
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return ""
+    if connection.vendor == "sqlite":
+        terms = ['"{}"'.format(word) for word in words]
+        terms[-1] += "*"
+        return " ".join(terms)
+    terms = list(words)
+    terms[-1] += ":*"
+    return " & ".join(terms)
+
+
+class SearchRank(Expression):
+    """
+    Relevance of the product to the full-text query. The better match has the greater rank.
+    """
+
+    def __init__(self, query: str):
+        super().__init__(output_field=FloatField())
+        self.query = query
+        self.key = F("pk")
+
+    def get_source_expressions(self) -> list:
+        return [self.key]
+
+    def set_source_expressions(self, exprs) -> None:
+        self.key, = exprs
+
+    def as_sql(self, compiler, connection):
+        """
+        Compiles correlated subquery, which selects rank of the outer product
+        :param compiler:
+        :param connection:
+        :return:
+        """
+        key_sql, key_params = compiler.compile(self.key)
+        return _format(RANK_SQL[connection.vendor], key=key_sql), [self.query, *key_params]
+
+
+def search(queryset: QuerySet, text: str) -> QuerySet:
+    """
+    Filters products queryset by the full-text query and annotates products with "search_rank".
+    Empty text (the frontend sends it when the search box is empty) leaves the queryset unfiltered,
+    text without any words matches no products.
+    :param queryset:
+    :param text:
+    :return:
+    """
+    if not text.strip():
+        return queryset
+    if not is_supported():
+        return queryset.filter(title__icontains=text)
+    query = build_query(text)
+    if not query:
+        return queryset.none()
+    return queryset.filter(
+        pk__in=RawSQL(_format(MATCH_SQL[connection.vendor]), [query])
+    ).annotate(
+        search_rank=SearchRank(query)
+    )
@@ -1,7 +1,11 @@
+import json
+
+from django.conf import settings
 from django.contrib.auth import authenticate
 
 from .models import (
     Product,
+    ProductCard,
     Category,
     Subcategory,
     ProductImage,
@@ -19,9 +23,12 @@ from .models import (
 )
 
 from django.contrib.auth.models import User
+from django.db.models import Count, Prefetch
 
 from rest_framework import serializers
-from django.db.models import Avg
+from rest_framework.renderers import JSONRenderer
+
+from . import sale_schedule
 
 
 class CategoryImageSerializer(serializers.ModelSerializer):
@@ -50,10 +57,11 @@ class SubcategorySerializer(serializers.ModelSerializer):
     Serializer for product subcategories
     """
     image = SubCategoryImageSerializer(many=True, read_only=True)
+    productsCount = serializers.IntegerField(source='products_count', read_only=True)
 
     class Meta:
         model = Subcategory
-        fields = ['id', 'title', 'image']
+        fields = ['id', 'title', 'image', 'productsCount']
 
     def to_representation(self, instance):
         """
@@ -73,10 +81,11 @@ class CategorySerializer(serializers.ModelSerializer):
     """
     image = CategoryImageSerializer(many=True, read_only=True)
     subcategories = SubcategorySerializer(many=True, read_only=True, source='subcategory_set')
+    productsCount = serializers.IntegerField(source='products_count', read_only=True)
 
     class Meta:
         model = Category
-        fields = ['id', 'title', 'image', 'subcategories']
+        fields = ['id', 'title', 'image', 'subcategories', 'productsCount']
 
     def to_representation(self, instance):
         """
@@ -103,6 +112,19 @@ class TagSerializer(serializers.ModelSerializer):
         )
 
 
+class TagCountSerializer(TagSerializer):
+    """
+    Serializer for product tags with number of their products, taken from "counts" dict of the context
+    """
+    count = serializers.SerializerMethodField()
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ('count',)
+
+    def get_count(self, instance: Tag) -> int:
+        return self.context["counts"].get(instance.pk, 0)
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
     """
     Serializer for product images
@@ -143,31 +165,79 @@ class CatalogSerializer(serializers.ModelSerializer):
 
     def get_price(self, obj):
         """
-        Method for calculating product price. First it checks, whether the product on sale, and, if so,
-        returns its sale price (reduced). If not, it returns product price (ordinary).
+        Method returns current product price: the lowest sale price (reduced), if the product is on sale now,
+        or product price (ordinary) in opposite case. Products, fetched with "ProductQuerySet.with_price",
+        already have the price resolved, so no additional queries are made for them.
         :param obj:
         :return:
         """
-        sale = ProductSale.objects.filter(product=obj)
-        if sale:
-            return sale.first().salePrice
-        return obj.price
+        return obj.get_current_price()
 
     def get_reviews(self, obj):
         """
-        Method calculates aggregate number of the products reviews.
+        Method returns number of the product reviews, stored in the product "reviews_count" column.
         :param obj:
         :return:
         """
-        return obj.review_set.count()
+        return obj.reviews_count
 
     def get_rating(self, obj):
         """
-        Method calculates average rate of the product, based on rates, made by users.
+        Method returns average rate of the product, stored in the product "rating_avg" column.
         :param obj:
         :return:
         """
-        return obj.review_set.aggregate(Avg('rate'))["rate__avg"]
+        return obj.rating_avg
+
+
+class ProductCardSerializer(serializers.BaseSerializer):
+    """
+    Serializer for product cards in product lists, which reads the precomputed "ProductCard" data.
+    Representation is the same as CatalogSerializer one. Only the current price is taken from the product,
+    so the products should be fetched with "ProductQuerySet.for_cards".
+    """
+
+    @staticmethod
+    def build_data(product: Product) -> dict:
+        """
+        Method builds card data of the product, which is stored in "ProductCard".
+        Data is rendered to plain JSON types exactly the way the API renders it. Price is left empty,
+        because it depends on time and is resolved on reading.
+        :param product:
+        :return:
+        """
+        data = CatalogSerializer(product).data
+        data['price'] = None
+        return json.loads(JSONRenderer().render(data))
+
+    @classmethod
+    def get_data(cls, product: Product) -> dict:
+        """
+        Method returns stored card data of the product. Cards, missing for any reason (i.e. products were
+        created bypassing signals), are built on the fly until "rebuild_product_cards" command stores them.
+        :param product:
+        :return:
+        """
+        try:
+            return dict(product.card.data)
+        except ProductCard.DoesNotExist:
+            return cls.build_data(product)
+
+    def to_representation(self, instance):
+        """
+        Method returns card data of the product with current price and absolute image urls.
+        :param instance:
+        :return:
+        """
+        response = self.get_data(instance)
+        request = self.context.get('request')
+        if request is not None:
+            response['images'] = [
+                dict(image, src=request.build_absolute_uri(image['src'])) if image['src'] else image
+                for image in response['images']
+            ]
+        response['price'] = instance.get_current_price()
+        return response
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -227,10 +297,11 @@ class CatalogItemSerializer(serializers.ModelSerializer):
     description = serializers.SerializerMethodField()
     price = serializers.SerializerMethodField()
     images = ProductImageSerializer(many=True, read_only=True, source='productimage_set')
-    reviews = ReviewSerializer(many=True, read_only=True, source='review_set')
+    reviews = serializers.SerializerMethodField()
     tags = TagSerializer(many=True, read_only=True)
     specifications = ProductSpecificationsSerializer(many=True, read_only=True, source='productspecifications_set')
     rating = serializers.SerializerMethodField()
+    ratingHistogram = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
@@ -249,99 +320,66 @@ class CatalogItemSerializer(serializers.ModelSerializer):
             'reviews',
             'specifications',
             'rating',
+            'ratingHistogram',
         ]
 
     def get_price(self, obj):
         """
-        Method for calculating product price. First it checks, whether the product on sale, and, if so,
-        returns its sale price (reduced). If not, it returns product price (ordinary).
+        Method returns current product price: the lowest sale price (reduced), if the product is on sale now,
+        or product price (ordinary) in opposite case. Products, fetched with "ProductQuerySet.with_price",
+        already have the price resolved, so no additional queries are made for them.
         :param obj:
         :return:
         """
-        sale = ProductSale.objects.filter(product=obj)
-        if sale:
-            return sale.first().salePrice
-        return obj.price
+        return obj.get_current_price()
 
-    def get_description(self, obj):
+    def get_reviews(self, obj):
         """
-        Method returns first 100 symbols of the product description.
+        Method returns the latest reviews of the product (see "PRODUCT_DETAIL_REVIEWS" setting).
+        Products, fetched by CatalogItemViewSet, already have them prefetched in "latest_reviews".
         :param obj:
         :return:
         """
-        return obj.description[:100]
+        reviews = getattr(obj, 'latest_reviews', None)
+        if reviews is None:
+            reviews = obj.review_set.select_related('author').order_by('-id')[:settings.PRODUCT_DETAIL_REVIEWS]
+        return ReviewSerializer(reviews, many=True).data
 
-    def get_fullDescription(self, obj):
+    def get_ratingHistogram(self, obj):
         """
-        Method returns all symbols of the product description, not only first 100, opposite to "get_description" above.
+        Method returns number of the product reviews with each rate from 1 to 5, counted by one grouped query.
         :param obj:
         :return:
         """
-        return obj.description
+        histogram = {rate: 0 for rate in range(1, 6)}
+        histogram.update(
+            obj.review_set.order_by().values_list('rate').annotate(count=Count('id')).values_list('rate', 'count')
+        )
+        return histogram
 
-    def get_rating(self, obj):
+    def get_description(self, obj):
         """
-        Method calculates average rate of the product, based on rates, made by users.
+        Method returns first 100 symbols of the product description.
         :param obj:
         :return:
         """
-        return obj.review_set.aggregate(Avg('rate'))["rate__avg"]
-
-
-class PopularProductsSerializer(serializers.ModelSerializer):
-    """
-    Serializer for first 8 products with average rate greater than 4,2
-    """
-
-    images = ProductImageSerializer(many=True, read_only=True, source='productimage_set')
-    reviews = serializers.SerializerMethodField()
-    rating = serializers.SerializerMethodField()
-    tags = TagSerializer(many=True, read_only=True)
-
-    class Meta:
-        model = Product
-        fields = [
-            'id',
-            'category',
-            'price',
-            'count',
-            'date',
-            'title',
-            'description',
-            'freeDelivery',
-            'images',
-            'tags',
-            'reviews',
-            'rating',
-        ]
+        return obj.description[:100]
 
-    def get_reviews(self, obj):
+    def get_fullDescription(self, obj):
         """
-        Method calculates aggregate number of the products reviews.
+        Method returns all symbols of the product description, not only first 100, opposite to "get_description" above.
         :param obj:
         :return:
         """
-        return obj.review_set.count()
+        return obj.description
 
     def get_rating(self, obj):
         """
-        Method calculates average rate of the product, based on rates, made by users.
+        Method returns average rate of the product, stored in the product "rating_avg" column.
         :param obj:
         :return:
         """
-        return obj.review_set.aggregate(Avg('rate'))["rate__avg"]
-
-
-class SaleProductImageSerializer(serializers.ModelSerializer):
-    """
-    Serializer for products on sale images
-    """
-
-    images = ProductImageSerializer(many=True, read_only=True, source='productimage_set')
-
-    class Meta:
-        model = Product
-        fields = "images",
+        return obj.rating_avg
 
 
 class SaleProductSerializer(serializers.ModelSerializer):
@@ -351,7 +389,6 @@ class SaleProductSerializer(serializers.ModelSerializer):
     price = serializers.SerializerMethodField()
     title = serializers.SerializerMethodField()
     id = serializers.SerializerMethodField()
-    images = SaleProductImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = ProductSale
@@ -362,7 +399,6 @@ class SaleProductSerializer(serializers.ModelSerializer):
             "dateFrom",
             "dateTo",
             "title",
-            "images"
         ]
 
     def get_id(self, obj):
@@ -371,7 +407,7 @@ class SaleProductSerializer(serializers.ModelSerializer):
         :param obj:
         :return:
         """
-        return obj.product.pk
+        return obj.product_id
 
     def get_price(self, obj):
         """
@@ -392,7 +428,7 @@ class SaleProductSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """
         Modified "to_representation" method.
-        Added SaleProductImageSerializer data to fit swagger requirements and
+        Added product images from the product card to fit swagger requirements and
         modified "dateFrom" and "dateTo" values to fit frontend forms
         :param instance:
         :return:
@@ -401,7 +437,7 @@ class SaleProductSerializer(serializers.ModelSerializer):
         product = instance.product
         response["dateFrom"] = instance.dateFrom.strftime("%d-%m")
         response["dateTo"] = instance.dateTo.strftime("%d-%m")
-        response['images'] = SaleProductImageSerializer(product).data['images']
+        response['images'] = ProductCardSerializer.get_data(product)['images']
         return response
 
 
@@ -421,11 +457,11 @@ class BasketSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """
         Modified "to_representation" method.
-        Added CatalogSerializer data to present products data in a way, which fits swagger requirements
+        Added product card data to present products data in a way, which fits swagger requirements
         :param instance:
         :return:
         """
-        response = CatalogSerializer(instance.product).data
+        response = ProductCardSerializer(instance.product).data
         response['count'] = instance.count
         return response
 
@@ -447,11 +483,11 @@ class TemporaryBasketSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """
         Modified "to_representation" method.
-        Added CatalogSerializer data to present products data in a way, which fits swagger requirements
+        Added product card data to present products data in a way, which fits swagger requirements
         :param instance:
         :return:
         """
-        response = CatalogSerializer(instance.product).data
+        response = ProductCardSerializer(instance.product).data
         response['count'] = instance.count
         return response
 
@@ -484,21 +520,17 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def get_totalCost(self, obj):
         """
-        Method returns total cost of the order. First it checks whether the product on sale. If so, the method
-        uses salePrice (reduced) instead of ordinary, if not, it uses ordinary product price.
+        Method returns total cost of the order. For the products on sale now the method uses
+        salePrice (reduced) instead of ordinary product price. Items are fetched by a single query
+        and priced by the sale schedule.
         :param obj:
         :return:
         """
-
-        result = 0
-        for item in OrderItem.objects.filter(order=obj.id):
-            sale = ProductSale.objects.filter(product=item.product)
-            if sale:
-                price = sale.first().salePrice
-            else:
-                price = item.product.price
-            result += price * item.count
-        return result
+        items = list(OrderItem.objects.filter(order=obj.id).values_list("product", "product__price", "count"))
+        if not items:
+            return 0
+        prices = sale_schedule.get_prices({product_id: price for product_id, price, _ in items})
+        return sum(prices[product_id] * count for product_id, _, count in items)
 
     def get_createdAt(self, obj):
         """
@@ -517,12 +549,13 @@ class OrderSerializer(serializers.ModelSerializer):
         :return:
         """
         result = []
-        basket = Basket.objects.filter(user=self.context['request'].user)
+        products = Prefetch("product", queryset=Product.objects.for_cards())
+        basket = Basket.objects.filter(user=self.context['request'].user).prefetch_related(products)
         if basket:
             for product in basket:
                 result.append(BasketSerializer(product).data)
         else:
-            order_items = OrderItem.objects.filter(order=obj.id)
+            order_items = OrderItem.objects.filter(order=obj.id).prefetch_related(products)
             for item in order_items:
                 result.append(BasketSerializer(item).data)
         return result
@@ -0,0 +1,438 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.db.models import QuerySet
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cards, category_tree, sale_schedule, search, snapshots, tag_index
+from .baskets import BASKET_SESSION_KEY, get_basket_key, merge_basket
+from .cache import bump_catalog_version
+from .models import (
+    Category,
+    Product,
+    ProductImage,
+    ProductSale,
+    ProductSpecifications,
+    Review,
+    Subcategory,
+    Tag,
+)
+
+
+def touch_products(product_ids) -> None:
+    """
+    Updates "updated_at" column of the products, which related data was changed
+    :param product_ids:
+    :return:
+    """
+    Product.objects.filter(pk__in=list(product_ids)).update(updated_at=timezone.now())
+
+
+def refresh_products(product_ids, touch: bool = True) -> None:
+    """
+    Updates search index and cards of the products, which titles, descriptions or tags were changed
+    :param product_ids:
+    :param touch: if True, "updated_at" column of the products is updated too
+    :return:
+    """
+    product_ids = list(product_ids)
+    search.index_products(product_ids)
+    cards.refresh_cards(product_ids)
+    if touch:
+        touch_products(product_ids)
+
+
+def is_deletion_of(origin, *models) -> bool:
+    """
+    Checks if the deletion was started from instances of the models
+    :param origin: "origin" argument of "post_delete" signal
+    :param models:
+    :return:
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model in models
+    return isinstance(origin, models)
+
+
+def is_product_deletion(origin) -> bool:
+    """
+    Checks if the deletion was started from products, so rows, deleted together with them,
+    don't need their products to be refreshed
+    :param origin: "origin" argument of "post_delete" signal
+    :return:
+    """
+    return is_deletion_of(origin, Product)
+
+
+def refresh_products_count(subcategory_ids) -> None:
+    """
+    Recalculates products count of the subcategories and their categories, which are shown in the category tree
+    :param subcategory_ids:
+    :return:
+    """
+    subcategory_ids = [pk for pk in subcategory_ids if pk is not None]
+    Subcategory.objects.filter(pk__in=subcategory_ids).refresh_products_count()
+    Category.objects.filter(subcategory__in=subcategory_ids).refresh_products_count()
+    category_tree.invalidate_tree()
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_product(sender, instance: Review, **kwargs) -> None:
+    """
+    Remembers the product, the review belonged to before saving,
+    so both products get their rating updated when a review is moved to another product (i.e. in admin)
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    instance.previous_product_id = None
+    if instance.pk:
+        instance.previous_product_id = Review.objects.filter(
+            pk=instance.pk
+        ).values_list("product_id", flat=True).first()
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance: Review, **kwargs) -> None:
+    """
+    Updates denormalized "rating_avg" and "reviews_count" columns and the card of the reviewed product
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    product_ids = {instance.product_id, getattr(instance, "previous_product_id", None)} - {None}
+    Product.objects.filter(pk__in=product_ids).refresh_review_stats()
+    cards.refresh_cards(product_ids)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance: Review, **kwargs) -> None:
+    """
+    Updates denormalized "rating_avg" and "reviews_count" columns and the card of the product,
+    which review was deleted
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if is_product_deletion(kwargs.get("origin")):
+        return
+    Product.objects.filter(pk=instance.product_id).refresh_review_stats()
+    cards.refresh_cards([instance.product_id])
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance: Product, **kwargs) -> None:
+    """
+    Updates search index and card of the saved product
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    refresh_products([instance.pk], touch=False)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance: Product, **kwargs) -> None:
+    """
+    Remembers subcategory and "archived" flag of the product before saving,
+    so products count is recalculated only when the product is added to or removed from a subcategory
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    instance.previous_category = None
+    if instance.pk:
+        instance.previous_category = Product.objects.filter(
+            pk=instance.pk
+        ).values_list("category_id", "archived").first()
+
+
+@receiver(post_save, sender=Product)
+def update_products_count_on_product_save(sender, instance: Product, **kwargs) -> None:
+    """
+    Updates products count of the subcategories, the product was added to or removed from
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    previous = getattr(instance, "previous_category", None)
+    if previous == (instance.category_id, instance.archived):
+        return
+    refresh_products_count({instance.category_id, previous and previous[0]})
+
+
+@receiver(post_delete, sender=Product)
+def update_products_count_on_product_delete(sender, instance: Product, **kwargs) -> None:
+    """
+    Updates products count of the subcategory of the deleted product.
+    Products, deleted together with their subcategories, are counted by the subcategory handler.
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if is_deletion_of(kwargs.get("origin"), Category, Subcategory):
+        return
+    refresh_products_count([instance.category_id])
+
+
+@receiver(post_save, sender=Subcategory)
+@receiver(post_delete, sender=Subcategory)
+def update_products_count_on_subcategory_change(sender, instance: Subcategory, **kwargs) -> None:
+    """
+    Updates products count of the categories, when a subcategory is added, moved or deleted.
+    Categories are few, so all of them are recalculated. Saved subcategory is recalculated too,
+    because saving writes the count, loaded with the instance, back to the database.
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if is_deletion_of(kwargs.get("origin"), Category):
+        return
+    if "created" in kwargs:
+        Subcategory.objects.filter(pk=instance.pk).refresh_products_count()
+    Category.objects.refresh_products_count()
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance: Product, **kwargs) -> None:
+    """
+    Removes deleted product from the search index
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    search.remove_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def index_products_on_tags_change(sender, instance, action: str, reverse: bool, pk_set, **kwargs) -> None:
+    """
+    Updates search index and cards of the products, which tags were changed.
+    Instance is a Product if tags were changed from the product side and a Tag in opposite case.
+    :param sender:
+    :param instance:
+    :param action:
+    :param reverse:
+    :param pk_set:
+    :param kwargs:
+    :return:
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            refresh_products([instance.pk])
+        return
+    if action == "pre_clear":
+        instance.cleared_product_ids = list(instance.product_set.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        refresh_products(pk_set)
+    elif action == "post_clear":
+        refresh_products(getattr(instance, "cleared_product_ids", []))
+
+
+@receiver(post_save, sender=Tag)
+def index_products_on_tag_save(sender, instance: Tag, created: bool, **kwargs) -> None:
+    """
+    Updates search index and cards of the products, which tag was renamed
+    :param sender:
+    :param instance:
+    :param created:
+    :param kwargs:
+    :return:
+    """
+    if not created:
+        refresh_products(list(instance.product_set.values_list("pk", flat=True)))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_products(sender, instance: Tag, **kwargs) -> None:
+    """
+    Remembers products of the tag before it is deleted, because the relations are deleted together with the tag
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    instance.deleted_product_ids = list(instance.product_set.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def index_products_on_tag_delete(sender, instance: Tag, **kwargs) -> None:
+    """
+    Updates search index and cards of the products, which tag was deleted
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    refresh_products(getattr(instance, "deleted_product_ids", []))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_card_on_image_change(sender, instance: ProductImage, **kwargs) -> None:
+    """
+    Updates card of the product, which image was added, changed or deleted
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if is_product_deletion(kwargs.get("origin")):
+        return
+    cards.refresh_cards([instance.product_id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductSale)
+@receiver(post_delete, sender=ProductSale)
+@receiver(post_save, sender=ProductSpecifications)
+@receiver(post_delete, sender=ProductSpecifications)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def touch_product_on_change(sender, instance, **kwargs) -> None:
+    """
+    Updates "updated_at" column of the product, which images, sales, specifications or reviews were changed
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if is_product_deletion(kwargs.get("origin")):
+        return
+    touch_products({instance.product_id, getattr(instance, "previous_product_id", None)} - {None})
+
+
+@receiver(m2m_changed, sender=Tag.category.through)
+def touch_tags_on_categories_change(sender, instance, action: str, reverse: bool, pk_set, **kwargs) -> None:
+    """
+    Updates "updated_at" column of the tags, which subcategories were changed.
+    Instance is a Tag if subcategories were changed from the tag side and a Subcategory in opposite case.
+    :param sender:
+    :param instance:
+    :param action:
+    :param reverse:
+    :param pk_set:
+    :param kwargs:
+    :return:
+    """
+    if reverse and action == "pre_clear":
+        instance.cleared_tag_ids = list(instance.tag_set.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        tag_ids = [instance.pk]
+    elif action == "post_clear":
+        tag_ids = getattr(instance, "cleared_tag_ids", [])
+    else:
+        tag_ids = pk_set
+    Tag.objects.filter(pk__in=list(tag_ids)).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductSale)
+@receiver(post_delete, sender=ProductSale)
+@receiver(post_save, sender=ProductSpecifications)
+@receiver(post_delete, sender=ProductSpecifications)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_catalog_cache(sender, **kwargs) -> None:
+    """
+    Invalidates cached catalog responses and republishes static snapshots, when any data,
+    shown in the catalog, changes
+    :param sender:
+    :param kwargs:
+    :return:
+    """
+    bump_catalog_version()
+    snapshots.schedule_publish()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Subcategory)
+@receiver(post_delete, sender=Subcategory)
+def invalidate_category_tree(sender, **kwargs) -> None:
+    """
+    Invalidates the category tree and republishes static snapshots, when any category or subcategory changes
+    :param sender:
+    :param kwargs:
+    :return:
+    """
+    category_tree.invalidate_tree()
+    snapshots.schedule_publish()
+
+
+@receiver(post_save, sender=Product)
+def invalidate_tag_index_on_product_save(sender, instance: Product, **kwargs) -> None:
+    """
+    Invalidates the tag index, when the product is moved to another subcategory or (un)archived
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    previous = getattr(instance, "previous_category", None)
+    if previous is not None and previous != (instance.category_id, instance.archived):
+        tag_index.invalidate_index()
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Tag)
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_tag_index(sender, **kwargs) -> None:
+    """
+    Invalidates the tag index, when products get or lose tags, or products or tags are deleted
+    :param sender:
+    :param kwargs:
+    :return:
+    """
+    if kwargs.get("action") in ("pre_add", "pre_remove", "pre_clear"):
+        return
+    tag_index.invalidate_index()
+
+
+@receiver(post_save, sender=ProductSale)
+@receiver(post_delete, sender=ProductSale)
+def invalidate_sale_schedule(sender, **kwargs) -> None:
+    """
+    Invalidates the sale schedule, when any sale changes
+    :param sender:
+    :param kwargs:
+    :return:
+    """
+    sale_schedule.invalidate_schedule()
+
+
+@receiver(user_logged_in)
+def merge_basket_on_login(sender, request, user, **kwargs) -> None:
+    """
+    Moves the items, which the visitor added to the temporary basket before login, into the user's basket
+    :param sender:
+    :param request:
+    :param user:
+    :param kwargs:
+    :return:
+    """
+    if request is None or not hasattr(request, "session"):
+        return
+    basket_key = get_basket_key(request)
+    if basket_key:
+        merge_basket(user, basket_key)
+        request.session.pop(BASKET_SESSION_KEY, None)
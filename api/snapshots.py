@@ -0,0 +1,166 @@
+"""
+Pre-rendered static snapshots of the endpoints, which are requested by every visitor,
+but change only when the catalog is edited: categories, tags and banners.
+
+Every snapshot is written as "<name>.<hash>.json" and its gzip-compressed copy "<name>.<hash>.json.gz"
+to the "ROOT" directory of "API_SNAPSHOTS" setting. The hash of the content in the file name allows
+to cache the files forever, while "manifest.json" (which must not be cached for long) maps endpoint names
+to their current files. So the frontend or a reverse proxy can serve the responses without Django,
+and the API endpoints stay as a fallback.
+
+Snapshots are published by "publish_snapshots" command and, if "PUBLISH_ON_CHANGE" is on,
+once after every transaction, which changes the catalog (see "signals.py"). Prices of the banners also change,
+when sales start or end, so the command should be scheduled periodically too.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from . import category_tree, tag_index
+from .models import Tag
+from .serializers import ProductCardSerializer, TagCountSerializer
+from .views import BannerListView
+
+MANIFEST_NAME = "manifest.json"
+
+logger = logging.getLogger(__name__)
+
+
+def get_config() -> dict:
+    """
+    Returns snapshots configuration from "API_SNAPSHOTS" setting
+    :return:
+    """
+    return getattr(settings, "API_SNAPSHOTS", {})
+
+
+def render_categories() -> bytes:
+    """
+    Returns the category tree of CategoriesListView
+    :return:
+    """
+    return category_tree.get_tree().content
+
+
+def render_tags() -> bytes:
+    """
+    Returns all the tags as TagListView does without "category" parameter
+    :return:
+    """
+    counts = tag_index.count_products()
+    return JSONRenderer().render(TagCountSerializer(Tag.objects.all(), many=True, context={"counts": counts}).data)
+
+
+def render_banners() -> bytes:
+    """
+    Returns banners of BannerListView. Image urls are relative, as there is no request to build them from.
+    :return:
+    """
+    return JSONRenderer().render(ProductCardSerializer(BannerListView().get_queryset(), many=True).data)
+
+
+# renderers of the snapshots by their names, the same as the responses of the corresponding endpoints
+RENDERERS = {
+    "categories": render_categories,
+    "tags": render_tags,
+    "banners": render_banners,
+}
+
+
+def write_file(path: Path, content: bytes) -> None:
+    """
+    Writes the file atomically, so it's never served partially written
+    :param path:
+    :param content:
+    :return:
+    """
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read_manifest(root: Path) -> dict:
+    """
+    Returns the published manifest or an empty dict, if nothing was published yet
+    :param root:
+    :return:
+    """
+    try:
+        return json.loads((root / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def publish(root=None) -> dict:
+    """
+    Renders all the snapshots, writes the changed ones with the manifest and removes the files,
+    which are referenced neither by the new manifest nor by the previous one (clients could have just read it).
+    :param root: directory of the snapshots, "ROOT" of "API_SNAPSHOTS" setting by default
+    :return: the new manifest
+    """
+    root = Path(root or get_config()["ROOT"])
+    root.mkdir(parents=True, exist_ok=True)
+    previous = read_manifest(root)
+    manifest = {}
+    for name, render in RENDERERS.items():
+        content = render()
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        file_name = f"{name}.{digest}.json"
+        if not (root / file_name).exists():
+            # zero modification time keeps the compressed file the same for the same content
+            write_file(root / f"{file_name}.gz", gzip.compress(content, compresslevel=9, mtime=0))
+            write_file(root / file_name, content)
+        manifest[name] = {"file": file_name, "hash": digest, "size": len(content)}
+    if manifest != previous:
+        write_file(root / MANIFEST_NAME, json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+    kept = set()
+    for item in list(manifest.values()) + list(previous.values()):
+        kept.update((item["file"], item["file"] + ".gz"))
+    for name in RENDERERS:
+        for path in root.glob(f"{name}.*.json*"):
+            if path.name not in kept:
+                path.unlink(missing_ok=True)
+    return manifest
+
+
+def publish_on_commit() -> None:
+    """
+    Publishes the snapshots after a commit. The changes are already committed then,
+    so a failure is logged instead of failing the request, which made them.
+    :return:
+    """
+    try:
+        publish()
+    except Exception:
+        logger.exception("Publishing of API snapshots failed")
+
+
+def schedule_publish() -> None:
+    """
+    Publishes the snapshots after the current transaction is committed, if "PUBLISH_ON_CHANGE" is on.
+    The snapshots are published once per transaction, however many catalog rows it changes.
+    :return:
+    """
+    config = get_config()
+    if not (config.get("PUBLISH_ON_CHANGE") and config.get("ROOT")):
+        return
+    connection = transaction.get_connection()
+    # callbacks of the rolled back savepoints are dropped from the list, so they are scheduled again
+    if any(func is publish_on_commit for _, func, *_ in connection.run_on_commit):
+        return
+    transaction.on_commit(publish_on_commit)
@@ -0,0 +1,31 @@
+"""
+Normalization of product specifications for catalog filters.
+
+Specification names and values are free-form, so they are stored together with normalized copies:
+"key" (lowercased name with collapsed spaces), "value_key" (the same for the value) and "numeric_value"
+(leading number of the value, i.e. 8 for "8 GB" or 6.5 for '6,5"'), which range filters compare with.
+"""
+import re
+
+NUMBER_RE = re.compile(r"^\s*([-+]?\d+(?:[.,]\d+)?)")
+
+
+def normalize(text: str) -> str:
+    """
+    Returns lowercased text with single spaces between words
+    :param text:
+    :return:
+    """
+    return " ".join(text.split()).lower()
+
+
+def parse_number(text: str):
+    """
+    Returns the leading number of the text, or None if the text doesn't start with a number
+    :param text:
+    :return:
+    """
+    match = NUMBER_RE.match(text or "")
+    if match is None:
+        return None
+    return float(match.group(1).replace(",", "."))
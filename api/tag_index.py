@@ -0,0 +1,155 @@
+"""
+In-memory inverted index of product tags.
+
+Every tag and every category (and subcategory) is mapped to a bitmap of its not archived products:
+a Python integer, which bit number N is set, if product with id N belongs to it. So products with all
+(or any) of the tags are found by AND (OR) of the bitmaps, and number of products with a tag in a category
+is a bit count of their intersection, without any M2M joins in the database.
+
+The index is built by two queries on the first use in a process and is kept under the current index version,
+stored in the database (see "DataVersion"). The version is bumped by signals (see "signals.py"), whenever products
+get or lose tags, are archived or moved to another subcategory, so every process rebuilds its index
+on the next request after a change.
+"""
+from collections import namedtuple
+
+from django.db.models import Count
+
+from .cache import bump_stored_version, get_stored_version
+from .models import Product
+
+TAG_INDEX_VERSION_KEY = "api:tag_index:version"
+
+# products matched by the index are filtered by the list of their ids, unless there are more of them
+MAX_LISTED_IDS = 500
+
+TagIndex = namedtuple("TagIndex", ["version", "tags", "categories"])
+
+# index of the current process, replaced as a whole, so concurrent threads always see a consistent index
+_index = TagIndex(None, {}, {})
+
+
+def from_ids(ids) -> int:
+    """
+    Returns bitmap with the bits of the product ids set
+    :param ids:
+    :return:
+    """
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for product_id in ids:
+        data[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(data, "little")
+
+
+def build_index(version) -> TagIndex:
+    """
+    Builds bitmaps of the tags and the categories by two queries
+    :param version:
+    :return:
+    """
+    tags = {}
+    links = Product.tags.through.objects.filter(product__archived=False).values_list("tag_id", "product_id")
+    for tag_id, product_id in links.iterator(chunk_size=2000):
+        tags.setdefault(tag_id, []).append(product_id)
+    categories = {}
+    products = Product.objects.filter(archived=False).values_list("category_id", "category__category_id", "id")
+    for subcategory_id, category_id, product_id in products.iterator(chunk_size=2000):
+        categories.setdefault(int(subcategory_id), []).append(product_id)
+        categories.setdefault(int(category_id), []).append(product_id)
+    return TagIndex(
+        version,
+        {tag_id: from_ids(ids) for tag_id, ids in tags.items()},
+        {category_id: from_ids(ids) for category_id, ids in categories.items()},
+    )
+
+
+def get_index() -> TagIndex:
+    """
+    Returns the index of the current version, building it if the process has an outdated one
+    :return:
+    """
+    global _index
+    version = get_stored_version(TAG_INDEX_VERSION_KEY)
+    index = _index
+    if index.version != version:
+        index = build_index(version)
+        _index = index
+    return index
+
+
+def invalidate_index() -> None:
+    """
+    Bumps the index version, so the index is rebuilt by every process on the next request
+    :return:
+    """
+    bump_stored_version(TAG_INDEX_VERSION_KEY)
+
+
+def match(tag_ids, match_all: bool = True) -> int:
+    """
+    Returns bitmap of the products with all the tags (with any of them, if "match_all" is False)
+    :param tag_ids:
+    :param match_all:
+    :return:
+    """
+    tags = get_index().tags
+    bitmaps = [tags.get(tag_id, 0) for tag_id in set(tag_ids)]
+    if not bitmaps:
+        return 0
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+        result = result & bitmap if match_all else result | bitmap
+    return result
+
+
+def to_ids(bitmap: int) -> list:
+    """
+    Returns ids of the products, which bits are set in the bitmap
+    :param bitmap:
+    :return:
+    """
+    ids = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        ids.append(lowest.bit_length() - 1)
+        bitmap ^= lowest
+    return ids
+
+
+def filter_products(queryset, tag_ids, match_all: bool = True):
+    """
+    Filters products queryset by the tags. Matched products are selected by the list of their ids,
+    unless there are more than "MAX_LISTED_IDS" of them: then they are selected by a subquery
+    of the tags table, which doesn't join products.
+    :param queryset:
+    :param tag_ids:
+    :param match_all:
+    :return:
+    """
+    bitmap = match(tag_ids, match_all)
+    if bitmap.bit_count() <= MAX_LISTED_IDS:
+        return queryset.filter(pk__in=to_ids(bitmap))
+    links = Product.tags.through.objects.filter(tag__in=set(tag_ids)).values("product")
+    if match_all:
+        links = links.annotate(tags=Count("tag", distinct=True)).filter(tags=len(set(tag_ids)))
+    return queryset.filter(pk__in=links.values("product"))
+
+
+def count_products(category=None) -> dict:
+    """
+    Returns number of not archived products with each of the tags in the category or subcategory
+    (in the whole catalog, if category is None) by the tag ids. Tags without products are left out.
+    :param category: id of a category or a subcategory
+    :return:
+    """
+    index = get_index()
+    scope = None if category is None else index.categories.get(int(category), 0)
+    counts = {}
+    for tag_id, bitmap in index.tags.items():
+        if scope is not None:
+            bitmap &= scope
+        if bitmap:
+            counts[tag_id] = bitmap.bit_count()
+    return counts
@@ -1,18 +1,47 @@
-from django.test import TestCase, Client
+import base64
+import gzip
+import json
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from django.utils.http import http_date
 from django.urls import reverse
 from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
+from . import popularity, sale_schedule, tag_index
+from .baskets import merge_basket
+from . import cache as response_cache
+from .cache import bump_catalog_version, get_cache_stats, get_timeout
+from .serializers import CatalogSerializer, CategorySerializer, OrderSerializer
 from .models import (
     Category,
     Subcategory,
     Product,
+    ProductCard,
     ProductImage,
     ProductSale,
+    ProductSaleHistory,
     Review,
     Tag,
     Basket,
+    TemporaryBasket,
     Order,
     OrderItem,
+    Payment,
+    ProductPopularity,
+    ProductViews,
+    ProductRelated,
+    ProductSpecifications,
     Profile,
     ProfileImage,
 )
@@ -45,7 +74,7 @@ class CategoriesListViewTestCase(TestCase):
 
     def test_get(self):
         response = self.client.get(reverse("api:categories"))
-        data = response.data[0]
+        data = response.json()[0]
         subcategories = data["subcategories"][0]
         subcategory_image = subcategories["image"]
         image = data["image"]
@@ -59,6 +88,387 @@ class CategoriesListViewTestCase(TestCase):
         self.assertContains(response, image["alt"])
 
 
+class CategoryTreeTestCase(TestCase):
+    """
+    TestCase for the cached category tree of CategoriesListView
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.category.delete()
+        cls.subcategory.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_built_once(self):
+        url = reverse("api:categories")
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        expected = CategorySerializer(Category.objects.all(), many=True).data
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+        # the tree is built once, then only its version is checked
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).content, response.content)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_rebuilt_on_change(self):
+        url = reverse("api:categories")
+        etag = self.client.get(url)["ETag"]
+        Subcategory.objects.filter(pk=self.subcategory.pk).update(title="graphics card")
+        # queryset updates bypass signals, so the stale tree is still served
+        self.assertEqual(self.client.get(url)["ETag"], etag)
+        self.subcategory.title = "graphics card"
+        self.subcategory.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.subcategory.title = "video card"
+        self.subcategory.save()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["subcategories"][0]["title"], "graphics card")
+        self.assertEqual(self.client.get(url).json()[0]["subcategories"][0]["title"], "video card")
+
+
+class ProductsCountTestCase(TestCase):
+    """
+    TestCase for products count of categories and subcategories and banners, selected by it
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(id=123, title="computers")
+        cls.subcategory_one = Subcategory.objects.create(id=123001, category=cls.category, title="video cards")
+        cls.subcategory_two = Subcategory.objects.create(id=123002, category=cls.category, title="laptops")
+        cls.products = [
+            Product.objects.create(category=subcategory, title=f"product {number}", price=100, count=1)
+            for number, subcategory in enumerate(
+                [cls.subcategory_one, cls.subcategory_two, cls.subcategory_two, cls.subcategory_two]
+            )
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in cls.products:
+            product.delete()
+        cls.subcategory_one.delete()
+        cls.subcategory_two.delete()
+        cls.category.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCounts(self, category, subcategory_one, subcategory_two):
+        self.assertEqual(Category.objects.get(pk=123).products_count, category)
+        self.assertEqual(Subcategory.objects.get(pk=123001).products_count, subcategory_one)
+        self.assertEqual(Subcategory.objects.get(pk=123002).products_count, subcategory_two)
+
+    def test_counts(self):
+        self.assertCounts(4, 1, 3)
+        data = self.client.get(reverse("api:categories")).json()[0]
+        self.assertEqual(data["productsCount"], 4)
+        self.assertEqual([item["productsCount"] for item in data["subcategories"]], [1, 3])
+
+        product = self.products[1]
+        product.category = self.subcategory_one
+        product.save()
+        self.assertCounts(4, 2, 2)
+        product.archived = True
+        product.save()
+        self.assertCounts(3, 1, 2)
+        self.assertEqual(self.client.get(reverse("api:categories")).json()[0]["productsCount"], 3)
+        product.archived = False
+        product.category = self.subcategory_two
+        product.save()
+        self.assertCounts(4, 1, 3)
+
+        self.subcategory_two.title = "notebooks"
+        self.subcategory_two.save()
+        self.assertCounts(4, 1, 3)
+
+        extra = Product.objects.create(category=self.subcategory_one, title="extra", price=100, count=1)
+        self.assertCounts(5, 2, 3)
+        extra.delete()
+        self.assertCounts(4, 1, 3)
+
+    def test_banners(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("api:banners"))
+        self.assertEqual([item["id"] for item in response.data], [self.products[1].id, self.products[0].id])
+
+
+class SnapshotsTestCase(TestCase):
+    """
+    TestCase for static snapshots of categories, tags and banners
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(id=123, title="computers")
+        cls.subcategory = Subcategory.objects.create(id=123001, category=cls.category, title="video cards")
+        cls.product_tag = Tag.objects.create(name="Gaming")
+        cls.product_tag.category.set([cls.subcategory])
+        cls.product = Product.objects.create(category=cls.subcategory, title="video card", price=100, count=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.product_tag.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+
+    def publish(self):
+        call_command("publish_snapshots", root=self.root, stdout=open(os.devnull, "w"))
+        with open(os.path.join(self.root, "manifest.json")) as file:
+            return json.load(file)
+
+    def read(self, file_name):
+        with open(os.path.join(self.root, file_name), "rb") as file:
+            content = file.read()
+        with gzip.open(os.path.join(self.root, file_name + ".gz")) as file:
+            self.assertEqual(file.read(), content)
+        return content
+
+    def test_publish(self):
+        manifest = self.publish()
+        self.assertEqual(set(manifest), {"categories", "tags", "banners"})
+        self.assertEqual(self.read(manifest["categories"]["file"]), self.client.get(reverse("api:categories")).content)
+        self.assertEqual(self.read(manifest["tags"]["file"]), self.client.get(reverse("api:tags")).content)
+        banners = json.loads(self.read(manifest["banners"]["file"]))
+        self.assertEqual([item["id"] for item in banners], [self.product.id])
+
+        self.assertEqual(self.publish(), manifest)
+        self.assertEqual(len(os.listdir(self.root)), 7)
+
+    def test_old_files_removed(self):
+        files = []
+        for title in ("first", "second", "third"):
+            self.category.title = title
+            self.category.save()
+            files.append(self.publish()["categories"]["file"])
+        self.category.title = "computers"
+        self.category.save()
+        self.assertEqual(len(set(files)), 3)
+        self.assertFalse(os.path.exists(os.path.join(self.root, files[0])))
+        self.assertTrue(os.path.exists(os.path.join(self.root, files[1])))
+        self.assertTrue(os.path.exists(os.path.join(self.root, files[2])))
+
+    def test_publish_on_change(self):
+        with override_settings(API_SNAPSHOTS={"ROOT": self.root, "PUBLISH_ON_CHANGE": True}):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product_tag.name = "Games"
+                self.product_tag.save()
+        self.product_tag.name = "Gaming"
+        self.product_tag.save()
+        with open(os.path.join(self.root, "manifest.json")) as file:
+            manifest = json.load(file)
+        self.assertIn(b"Games", self.read(manifest["tags"]["file"]))
+
+    def test_publish_once_per_transaction(self):
+        with override_settings(API_SNAPSHOTS={"ROOT": self.root, "PUBLISH_ON_CHANGE": True}):
+            with mock.patch("api.snapshots.publish") as publish:
+                with self.captureOnCommitCallbacks(execute=True):
+                    for title in ("first", "second"):
+                        self.product.title = title
+                        self.product.save()
+                    self.product_tag.name = "Games"
+                    self.product_tag.save()
+                self.assertEqual(publish.call_count, 1)
+        self.product.title = "video card"
+        self.product.save()
+        self.product_tag.name = "Gaming"
+        self.product_tag.save()
+
+    def test_publish_failure_logged(self):
+        with override_settings(API_SNAPSHOTS={"ROOT": self.root, "PUBLISH_ON_CHANGE": True}):
+            with mock.patch("api.snapshots.publish", side_effect=OSError("Read-only file system")):
+                with self.assertLogs("api.snapshots", "ERROR"), self.captureOnCommitCallbacks(execute=True):
+                    self.product_tag.name = "Games"
+                    self.product_tag.save()
+        self.product_tag.name = "Gaming"
+        self.product_tag.save()
+
+
+class TagIndexTestCase(TestCase):
+    """
+    TestCase for catalog filtering by tags and tag counts, served by the tag index
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(id=123, title="computers")
+        cls.subcategory_one = Subcategory.objects.create(id=123001, category=cls.category, title="video cards")
+        cls.subcategory_two = Subcategory.objects.create(id=123002, category=cls.category, title="laptops")
+        cls.gaming = Tag.objects.create(name="Gaming")
+        cls.office = Tag.objects.create(name="Office")
+        cls.gaming.category.set([cls.subcategory_one, cls.subcategory_two])
+        cls.office.category.set([cls.subcategory_two])
+        cls.products = []
+        for subcategory, tags in (
+            (cls.subcategory_one, [cls.gaming]),
+            (cls.subcategory_two, [cls.gaming, cls.office]),
+            (cls.subcategory_two, [cls.office]),
+        ):
+            product = Product.objects.create(category=subcategory, title="product", price=100, count=1)
+            product.tags.set(tags)
+            cls.products.append(product)
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in cls.products:
+            product.delete()
+        cls.gaming.delete()
+        cls.office.delete()
+        cls.subcategory_one.delete()
+        cls.subcategory_two.delete()
+        cls.category.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def get_ids(self, params):
+        response = self.client.get(reverse("api:catalog"), params)
+        return sorted(item["id"] for item in response.data["items"])
+
+    def test_filter(self):
+        tags = [self.gaming.id, self.office.id]
+        ids = [product.id for product in self.products]
+        self.assertEqual(self.get_ids({"filter[tags][]": tags}), [ids[1]])
+        self.assertEqual(self.get_ids({"filter[tags][]": tags, "filter[tagsMode]": "or"}), ids)
+        self.assertEqual(self.get_ids({"tags[]": [self.gaming.id]}), ids[:2])
+        with mock.patch.object(tag_index, "MAX_LISTED_IDS", 0):
+            cache.clear()
+            self.assertEqual(self.get_ids({"filter[tags][]": tags}), [ids[1]])
+            self.assertEqual(self.get_ids({"filter[tags][]": tags, "filter[tagsMode]": "or"}), ids)
+
+    def test_index_refreshed(self):
+        self.assertEqual(self.get_ids({"filter[tags][]": [self.office.id]}), [p.id for p in self.products[1:]])
+        self.products[0].tags.add(self.office)
+        self.assertEqual(self.get_ids({"filter[tags][]": [self.office.id]}), [p.id for p in self.products])
+        self.products[0].tags.remove(self.office)
+        self.products[2].archived = True
+        self.products[2].save()
+        self.assertEqual(self.get_ids({"filter[tags][]": [self.office.id]}), [self.products[1].id])
+        self.products[2].archived = False
+        self.products[2].save()
+
+    def test_counts(self):
+        response = self.client.get(reverse("api:tags"), {"category": "123"})
+        self.assertEqual(
+            [(tag["name"], tag["count"]) for tag in response.data],
+            [("Gaming", 2), ("Office", 2)],
+        )
+        response = self.client.get(reverse("api:tags"), {"category": "123001"})
+        self.assertEqual([(tag["name"], tag["count"]) for tag in response.data], [("Gaming", 1)])
+        etag = response["ETag"]
+        # the index is built once, then tags are counted by the version query only
+        with self.assertNumQueries(3):
+            self.client.get(reverse("api:tags"), {"category": "123002"})
+        self.products[1].tags.remove(self.gaming)
+        response = self.client.get(reverse("api:tags"), {"category": "123001"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.products[0].tags.remove(self.gaming)
+        response = self.client.get(reverse("api:tags"), {"category": "123001"}, HTTP_IF_NONE_MATCH=etag)
+        self.products[0].tags.add(self.gaming)
+        self.products[1].tags.add(self.gaming)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["count"], 0)
+
+
+class PopularityTestCase(TestCase):
+    """
+    TestCase for the popularity ranking and PopularProductsListView
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.user = User.objects.create_user("test_popularity_user", "test@test.test", "!@#$%67890qwerty")
+        cls.category = Category.objects.create(id=123, title="computers")
+        cls.subcategory = Subcategory.objects.create(id=123001, category=cls.category, title="video cards")
+        cls.rated, cls.sold, cls.viewed, cls.plain = [
+            Product.objects.create(category=cls.subcategory, title=title, price=100, count=1)
+            for title in ("rated", "sold", "viewed", "plain")
+        ]
+        Review.objects.create(product=cls.rated, author=cls.user, rate=5, text="review text")
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in (cls.rated, cls.sold, cls.viewed, cls.plain):
+            product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        cls.user.delete()
+
+    def setUp(self):
+        cache.clear()
+        popularity._views.clear()
+
+    def sell(self, product, count, days_ago=0):
+        order = Order.objects.create(user=self.user, fullName="Test User")
+        Order.objects.filter(pk=order.pk).update(createdAt=timezone.now() - timezone.timedelta(days=days_ago))
+        OrderItem.objects.create(order=order, product=product, count=count)
+        Payment.objects.create(
+            order=order, name="Test User", number="1234567812345678", month="01", year="2030", code="123"
+        )
+
+    def get_ids(self):
+        return [item["id"] for item in self.client.get(reverse("api:popular")).data]
+
+    def test_fallback(self):
+        self.assertEqual(self.get_ids(), [self.rated.id])
+
+    @override_settings(POPULARITY_RANKING=dict(settings.POPULARITY_RANKING, VIEWS_BATCH_SIZE=3))
+    def test_ranking(self):
+        self.sell(self.sold, 1000)
+        # sales older than the counted period are left out
+        self.sell(self.plain, 1000, days_ago=200)
+        for _ in range(2):
+            self.client.get(reverse("api:product-detail", kwargs={"pk": self.viewed.id}))
+        self.assertFalse(ProductViews.objects.exists())
+        self.client.get(reverse("api:product-detail", kwargs={"pk": self.viewed.id}))
+        self.assertEqual(list(ProductViews.objects.values_list("product", "views")), [(self.viewed.id, 3)])
+        call_command("rank_popular_products", stdout=open(os.devnull, "w"))
+        self.assertEqual(self.get_ids(), [self.sold.id, self.rated.id, self.viewed.id, self.plain.id])
+        self.assertEqual(ProductPopularity.objects.get(product=self.viewed).views, 3)
+
+        Product.objects.filter(pk=self.sold.pk).update(archived=True)
+        self.assertEqual(self.get_ids(), [self.rated.id, self.viewed.id, self.plain.id])
+        Product.objects.filter(pk=self.sold.pk).update(archived=False)
+
+    def test_failed_run_keeps_views(self):
+        popularity.write_views({self.viewed.id: 5})
+        with mock.patch.object(ProductPopularity.objects, "bulk_create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                popularity.rank()
+        self.assertEqual(list(ProductViews.objects.values_list("product", "views")), [(self.viewed.id, 5)])
+        popularity.rank()
+        self.assertFalse(ProductViews.objects.exists())
+        self.assertEqual(ProductPopularity.objects.get(product=self.viewed).views, 5)
+
+    def test_decay(self):
+        half_life = settings.POPULARITY_RANKING["HALF_LIFE_DAYS"]
+        self.assertEqual(popularity.decay(0), 1)
+        self.assertAlmostEqual(popularity.decay(half_life), 0.5)
+        self.assertAlmostEqual(popularity.decay(2 * half_life), 0.25)
+
+
 class SaleProductsListViewTestCase(TestCase):
     """
     TestCase for SaleProductsListView
@@ -95,8 +505,7 @@ class SaleProductsListViewTestCase(TestCase):
             product=cls.product,
             salePrice=200.67,
             dateFrom=timezone.now(),
-            dateTo=timezone.now()
-
+            dateTo=timezone.now() + timezone.timedelta(days=1)
         )
 
     @classmethod
@@ -120,6 +529,183 @@ class SaleProductsListViewTestCase(TestCase):
         self.assertContains(response, response.data["lastPage"])
 
 
+class SaleStatusTestCase(TestCase):
+    """
+    TestCase for sales listing by the sale status
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(id=123, title="computers")
+        cls.subcategory = Subcategory.objects.create(id=123001, category=cls.category, title="video cards")
+        cls.products = []
+        cls.sales = {}
+        now = timezone.now()
+        for status, start, end in (
+            ("ended", -2, -1),
+            ("active", -1, 1),
+            ("upcoming", 1, 2),
+        ):
+            product = Product.objects.create(category=cls.subcategory, title=status, price=500, count=1)
+            ProductImage.objects.create(product=product, src="/3.png", alt="Image alt string")
+            cls.sales[status] = ProductSale.objects.create(
+                product=product,
+                salePrice=100,
+                dateFrom=now + timezone.timedelta(days=start),
+                dateTo=now + timezone.timedelta(days=end),
+            )
+            cls.products.append(product)
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in cls.products:
+            product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def test_statuses(self):
+        for params, status in (
+            ({}, "active"),
+            ({"status": "active"}, "active"),
+            ({"status": "upcoming"}, "upcoming"),
+            ({"status": "ended"}, "ended"),
+            ({"status": "unknown"}, "active"),
+        ):
+            # count, sales with products and cards
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse("api:sales"), params)
+            self.assertEqual([item["title"] for item in response.data["items"]], [status])
+            self.assertEqual(response.data["items"][0]["images"][0]["alt"], "Image alt string")
+
+
+class SaleScheduleTestCase(TestCase):
+    """
+    TestCase for prices, resolved by the sale schedule
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.user = User.objects.create_user("test_schedule_user", "test@test.test", "!@#$%67890qwerty")
+        cls.category = Category.objects.create(id=123, title="computers")
+        cls.subcategory = Subcategory.objects.create(id=123001, category=cls.category, title="video cards")
+        cls.product = Product.objects.create(category=cls.subcategory, title="on sale", price=500, count=1)
+        cls.other = Product.objects.create(category=cls.subcategory, title="not on sale", price=300, count=1)
+        cls.now = timezone.now()
+        day = timezone.timedelta(days=1)
+        # overlapping sales: 400 for days 1..4, 350 for days 2..3
+        for price, start, end in ((400, 1, 4), (350, 2, 3)):
+            ProductSale.objects.create(
+                product=cls.product, salePrice=price, dateFrom=cls.now + start * day, dateTo=cls.now + end * day
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.other.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        cls.user.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_prices(self):
+        day = timezone.timedelta(days=1)
+        products = {self.product.id: self.product.price, self.other.id: self.other.price}
+        sale_schedule.get_schedule()
+        # a lookup checks the schedule version only
+        with self.assertNumQueries(6):
+            for days, price in ((0, 500), (1, 400), (2, 350), (2.5, 350), (3, 400), (4, 500)):
+                prices = sale_schedule.get_prices(products, self.now + days * day)
+                self.assertEqual(prices, {self.product.id: Decimal(price), self.other.id: Decimal(300)})
+        for days in (0, 1, 2, 3, 4):
+            at = self.now + days * day
+            self.assertEqual(
+                self.product.get_current_price(at),
+                Product.objects.with_price(at).values_list("current_price", flat=True).get(pk=self.product.pk),
+            )
+        self.assertEqual(
+            sale_schedule.get_price_history(self.product.id, self.product.price),
+            [(self.now + day, 400), (self.now + 2 * day, 350), (self.now + 3 * day, 400), (self.now + 4 * day, 500)],
+        )
+
+    def test_refreshed_on_change(self):
+        self.assertEqual(self.product.get_current_price(), Decimal(500))
+        sale = ProductSale.objects.create(
+            product=self.product, salePrice=100, dateFrom=self.now, dateTo=self.now + timezone.timedelta(hours=1)
+        )
+        self.assertEqual(self.product.get_current_price(), Decimal(100))
+        sale.delete()
+        self.assertEqual(self.product.get_current_price(), Decimal(500))
+
+    def test_refreshed_in_other_processes(self):
+        # a process, which built the schedule before the change and doesn't share the cache with the writer
+        schedule = sale_schedule.get_schedule()
+        sale = ProductSale.objects.create(
+            product=self.product, salePrice=100, dateFrom=self.now, dateTo=self.now + timezone.timedelta(hours=1)
+        )
+        sale_schedule._schedule = schedule
+        cache.clear()
+        self.assertEqual(self.product.get_current_price(), Decimal(100))
+        sale.delete()
+
+    def test_order_total(self):
+        order = Order.objects.create(user=self.user, fullName="Test User")
+        OrderItem.objects.create(order=order, product=self.product, count=2)
+        OrderItem.objects.create(order=order, product=self.other, count=1)
+        ProductSale.objects.create(
+            product=self.product, salePrice=100, dateFrom=self.now, dateTo=self.now + timezone.timedelta(hours=1)
+        )
+        self.assertEqual(OrderSerializer().get_totalCost(order), Decimal(500))
+
+
+class SaleArchiveTestCase(TestCase):
+    """
+    TestCase for archiving of ended sales and the discounts summary
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(id=123, title="computers")
+        cls.subcategory = Subcategory.objects.create(id=123001, category=cls.category, title="video cards")
+        cls.product = Product.objects.create(category=cls.subcategory, title="video card", price=500, count=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        for price, start, end in ((400, 100, 90), (250, 95, 80), (450, 50, 40), (300, 1, -1)):
+            ProductSale.objects.create(
+                product=self.product,
+                salePrice=price,
+                dateFrom=now - timezone.timedelta(days=start),
+                dateTo=now - timezone.timedelta(days=end),
+            )
+
+    def test_archive(self):
+        before = self.client.get(reverse("api:product_discounts", kwargs={"id": self.product.id})).data
+        call_command("archive_sales", days=30, batch_size=2, stdout=open(os.devnull, "w"))
+        self.assertEqual(ProductSaleHistory.objects.filter(product=self.product).count(), 3)
+        self.assertEqual(
+            list(ProductSale.objects.filter(product=self.product).values_list("salePrice", flat=True)), [300]
+        )
+        self.assertEqual(self.product.get_current_price(), Decimal(300))
+        with self.assertNumQueries(3):
+            after = self.client.get(reverse("api:product_discounts", kwargs={"id": self.product.id})).data
+        self.assertEqual(after, before)
+
+    def test_discounts(self):
+        periods = self.client.get(reverse("api:product_discounts", kwargs={"id": self.product.id})).data["periods"]
+        self.assertEqual(sum(period["sales"] for period in periods), 4)
+        self.assertEqual(max(period["maxDiscount"] for period in periods), Decimal(250))
+        self.assertEqual(max(period["maxDiscountPercent"] for period in periods), Decimal(50))
+        self.assertEqual(periods, sorted(periods, key=lambda period: period["period"]))
+        response = self.client.get(reverse("api:product_discounts", kwargs={"id": 999999}))
+        self.assertEqual(response.status_code, 404)
+
+
 class CatalogListViewTsetCase(TestCase):
     """
     TestCase for CatalogListView
@@ -436,6 +1022,17 @@ class LimitedProductsListViewTsetCase(TestCase):
         self.assertContains(response, data["rating"])
 
 
+    def test_sale_started_after_import(self):
+        sale = ProductSale.objects.create(
+            product=self.product_one,
+            salePrice=400,
+            dateFrom=timezone.now(),
+            dateTo=timezone.now() + timezone.timedelta(days=1),
+        )
+        response = self.client.get(reverse("api:limited"))
+        self.assertEqual(Decimal(str(response.data[0]["price"])), Decimal("400.00"))
+        sale.delete()
+
 class BannerListViewTsetCase(TestCase):
     """
     TestCase for BannerListView
@@ -872,6 +1469,69 @@ class BasketViewSetTestCase(TestCase):
         self.assertEqual(response.status_code, 204)
 
 
+class AnonymousBasketTestCase(TestCase):
+    """
+    TestCase for baskets of anonymous visitors
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(id=123, title="computers")
+        cls.subcategory = Subcategory.objects.create(id=123001, category=cls.category, title="video cards")
+        cls.product = Product.objects.create(category=cls.subcategory, title="video card", price=100, count=10)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    @staticmethod
+    def add(client, product, count):
+        data = {"id": product.id, "count": count}
+        client.post(reverse("api:basket-list"), data=data, content_type="application/json")
+
+    def test_visitors_baskets(self):
+        first, second = Client(), Client()
+        self.assertEqual(first.get(reverse("api:basket-list")).data, [])
+        self.add(first, self.product, 2)
+        self.add(first, self.product, 1)
+        self.add(second, self.product, 5)
+        self.assertEqual([item["count"] for item in first.get(reverse("api:basket-list")).data], [3])
+        self.assertEqual([item["count"] for item in second.get(reverse("api:basket-list")).data], [5])
+        self.assertEqual(TemporaryBasket.objects.values("session").distinct().count(), 2)
+        self.assertEqual(Client().get(reverse("api:basket-list")).data, [])
+
+    def test_merge_on_login(self):
+        user = User.objects.create_user("test_merge_user", "test@test.test", "!@#$%67890qwerty")
+        other = Product.objects.create(category=self.subcategory, title="mouse", price=10, count=10)
+        Basket.objects.create(user=user, product=self.product, count=4)
+        client = Client()
+        self.add(client, self.product, 2)
+        self.add(client, other, 1)
+        client.login(username="test_merge_user", password="!@#$%67890qwerty")
+        self.assertFalse(TemporaryBasket.objects.exists())
+        self.assertEqual(
+            dict(Basket.objects.filter(user=user).values_list("product", "count")),
+            {self.product.id: 6, other.id: 1},
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("api:basket-list"))
+        self.assertEqual(sorted(item["count"] for item in response.data), [1, 6])
+        self.assertFalse([query for query in queries if not query["sql"].startswith("SELECT")])
+        client.logout()
+        client.login(username="test_merge_user", password="!@#$%67890qwerty")
+        self.assertEqual(Basket.objects.filter(user=user).count(), 2)
+
+        TemporaryBasket.objects.create(session="merge", product=other, count=2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(merge_basket(user, "merge"), 1)
+        statements = [query["sql"].split()[0] for query in queries if "SAVEPOINT" not in query["sql"]]
+        self.assertEqual(statements, ["INSERT", "DELETE"])
+        self.assertEqual(Basket.objects.get(user=user, product=other).count, 3)
+        other.delete()
+        user.delete()
+
+
 class OrderViewSetTestCase(TestCase):
     """
     TestCase for OrdersViewSet
@@ -1325,3 +1985,1140 @@ class PaymentCreateViewTestCase(TestCase):
             content_type='application/json',
         )
         self.assertEquals(response.status_code, 201)
+
+
+class ProductReviewStatsTestCase(TestCase):
+    """
+    TestCase for denormalized "rating_avg" and "reviews_count" columns of Product
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.user = User.objects.create_user("test_review_stats_user", "test@test.test", "!@#$%67890qwerty")
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product = Product.objects.create(
+            category=cls.subcategory,
+            title="video card",
+            description="",
+            price=500.67,
+            count=3,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        cls.user.delete()
+
+    def test_review_create(self):
+        for rate in (5, 4):
+            response = self.client.post(
+                reverse("api:review_create", kwargs={"id": self.product.id}),
+                data={"text": "review text", "rate": rate},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 201)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reviews_count, 2)
+        self.assertEqual(self.product.rating_avg, 4.5)
+
+    def test_review_delete(self):
+        review = Review.objects.create(product=self.product, author=self.user, rate=3, text="review text")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reviews_count, 1)
+        review.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reviews_count, 0)
+        self.assertIsNone(self.product.rating_avg)
+
+    def test_backfill_command(self):
+        Review.objects.create(product=self.product, author=self.user, rate=2, text="review text")
+        Product.objects.filter(pk=self.product.pk).update(rating_avg=None, reviews_count=0)
+        call_command("refresh_review_stats", stdout=open(os.devnull, "w"))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reviews_count, 1)
+        self.assertEqual(self.product.rating_avg, 2)
+
+
+class ProductPriceTestCase(TestCase):
+    """
+    TestCase for current price resolution of the products on sale
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.user = User.objects.create_user("test_price_user", "test@test.test", "!@#$%67890qwerty")
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product = Product.objects.create(
+            category=cls.subcategory,
+            title="video card",
+            description="",
+            price=500,
+            count=3,
+        )
+        now = timezone.now()
+        day = timezone.timedelta(days=1)
+        for sale_price, date_from, date_to in (
+            (100, now - 3 * day, now - day),  # expired
+            (300, now - day, now + day),  # active
+            (250, now - day, now + day),  # active, the lowest one
+            (50, now + day, now + 3 * day),  # upcoming
+        ):
+            ProductSale.objects.create(
+                product=cls.product,
+                salePrice=sale_price,
+                dateFrom=date_from,
+                dateTo=date_to,
+            )
+        cls.order = Order.objects.create(fullName="Mikhail Nartsissov", user=cls.user)
+        cls.order_item = OrderItem.objects.create(order=cls.order, product=cls.product, count=2)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.order_item.delete()
+        cls.order.delete()
+        cls.product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        cls.user.delete()
+
+    def test_with_price(self):
+        now = timezone.now()
+        product = Product.objects.with_price().get(pk=self.product.pk)
+        self.assertEqual(product.current_price, 250)
+        product = Product.objects.with_price(now + timezone.timedelta(days=2)).get(pk=self.product.pk)
+        self.assertEqual(product.current_price, 50)
+        product = Product.objects.with_price(now + timezone.timedelta(days=5)).get(pk=self.product.pk)
+        self.assertEqual(product.current_price, 500)
+
+    def test_catalog_price(self):
+        response = self.client.get(reverse("api:catalog"))
+        self.assertEqual(response.data["items"][0]["price"], 250)
+
+    def test_order_total_cost(self):
+        response = self.client.get(reverse("api:orders-detail", kwargs={"pk": self.order.pk}))
+        self.assertEqual(response.data["totalCost"], 500)
+
+
+class ProductListsQueryBudgetTestCase(TestCase):
+    """
+    TestCase for number of queries, made by product lists.
+    Number of queries mustn't depend on number of products on the page.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.user = User.objects.create_user("test_budget_user", "test@test.test", "!@#$%67890qwerty")
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product_tag = Tag.objects.create(
+            name="Gaming",
+        )
+        cls.products = []
+        for number in range(10):
+            product = Product.objects.create(
+                category=cls.subcategory,
+                title=f"video card {number}",
+                description="",
+                price=500 + number,
+                count=3,
+                limited=True,
+            )
+            product.tags.set([cls.product_tag])
+            ProductImage.objects.create(product=product, src="/3.png", alt="Image alt string")
+            ProductSale.objects.create(
+                product=product,
+                salePrice=100 + number,
+                dateFrom=timezone.now() - timezone.timedelta(days=1),
+                dateTo=timezone.now() + timezone.timedelta(days=1),
+            )
+            Review.objects.create(product=product, author=cls.user, rate=5, text="review text")
+            cls.products.append(product)
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in cls.products:
+            product.delete()
+        cls.product_tag.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        cls.user.delete()
+
+    @override_settings(API_RESPONSE_CACHE={})
+    def test_catalog(self):
+        for limit in (2, 10):
+            # conditional request validation, count, products
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse("api:catalog"), {"limit": limit})
+            self.assertEqual(len(response.data["items"]), limit)
+
+    def test_popular(self):
+        call_command("rank_popular_products", stdout=open(os.devnull, "w"))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("api:popular"))
+        self.assertEqual(len(response.data), 8)
+
+    def test_limited(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("api:limited"))
+        self.assertEqual(len(response.data), 10)
+
+    def test_banners(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("api:banners"))
+        self.assertEqual(response.data[0]["id"], self.products[0].id)
+
+    @override_settings(API_RESPONSE_CACHE={})
+    def test_archived_hidden(self):
+        Product.objects.filter(pk=self.products[0].pk).update(archived=True)
+        response = self.client.get(reverse("api:catalog"), {"limit": 20})
+        Product.objects.filter(pk=self.products[0].pk).update(archived=False)
+        self.assertNotIn(self.products[0].id, [item["id"] for item in response.data["items"]])
+        self.assertEqual(len(response.data["items"]), 9)
+
+    def test_benchmark(self):
+        with open(os.devnull, "w") as stdout:
+            call_command("benchmark_catalog", products=200, repeat=1, stdout=stdout)
+        self.assertEqual(Product.objects.count(), 10)
+
+
+class ProductSearchTestCase(TestCase):
+    """
+    TestCase for full-text search in CatalogListView
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product_tag = Tag.objects.create(
+            name="Gaming",
+        )
+        cls.product_one = Product.objects.create(
+            category=cls.subcategory,
+            title="Radeon graphics card",
+            description="Card for office computers",
+            price=500,
+            count=3,
+        )
+        cls.product_two = Product.objects.create(
+            category=cls.subcategory,
+            title="Geforce video card",
+            description="Powerful graphics for games",
+            price=900,
+            count=3,
+        )
+        cls.product_two.tags.set([cls.product_tag])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product_one.delete()
+        cls.product_two.delete()
+        cls.product_tag.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def search(self, name):
+        response = self.client.get(reverse("api:catalog"), {"filter[name]": name})
+        return [item["id"] for item in response.data["items"]]
+
+    def test_ranking(self):
+        # match in the title is more relevant than match in the description
+        self.assertEqual(self.search("graphics"), [self.product_one.id, self.product_two.id])
+
+    def test_prefix(self):
+        self.assertEqual(self.search("gefo"), [self.product_two.id])
+
+    def test_no_words(self):
+        self.assertEqual(self.search("!!!"), [])
+        self.assertEqual(sorted(self.search("")), sorted([self.product_one.id, self.product_two.id]))
+
+    def test_tags(self):
+        self.assertEqual(self.search("gaming"), [self.product_two.id])
+        self.product_tag.name = "Esports"
+        self.product_tag.save()
+        self.assertEqual(self.search("gaming"), [])
+        self.assertEqual(self.search("esports"), [self.product_two.id])
+
+    def test_product_change(self):
+        self.product_one.title = "Radeon accelerator"
+        self.product_one.save()
+        self.assertEqual(self.search("accelerator"), [self.product_one.id])
+        self.assertEqual(self.search("radeon graphics"), [])
+
+    def test_rebuild_command(self):
+        Product.objects.filter(pk=self.product_one.pk).update(title="Matrox")
+        call_command("rebuild_search_index", stdout=open(os.devnull, "w"))
+        self.assertEqual(self.search("matrox"), [self.product_one.id])
+
+
+class KeysetPaginationTestCase(TestCase):
+    """
+    TestCase for keyset pagination of CatalogListView
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.products = [
+            Product.objects.create(
+                category=cls.subcategory,
+                title=f"video card {number}",
+                description="",
+                # prices repeat to check "id" tiebreaker
+                price=100 * (number % 3),
+                count=3,
+            )
+            for number in range(7)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in cls.products:
+            product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def collect_pages(self, params):
+        ids = []
+        params = dict(params, pagination="cursor", limit=2)
+        pages = 0
+        while True:
+            response = self.client.get(reverse("api:catalog"), params)
+            pages += 1
+            self.assertEqual(response.data["currentPage"], pages)
+            ids.extend(item["id"] for item in response.data["items"])
+            if response.data["nextCursor"] is None:
+                return ids
+            params["cursor"] = response.data["nextCursor"]
+
+    def test_pages(self):
+        all_ids = sorted(product.id for product in self.products)
+        prices = {product.id: product.price for product in self.products}
+        self.assertEqual(self.collect_pages({}), all_ids)
+        self.assertEqual(self.collect_pages({"sort": "rating"}), all_ids)
+        ids = self.collect_pages({"sort": "price"})
+        self.assertEqual(ids, sorted(all_ids, key=lambda pk: (prices[pk], pk)))
+        ids = self.collect_pages({"sort": "price", "sortType": "inc"})
+        self.assertEqual(ids, sorted(all_ids, key=lambda pk: (prices[pk], pk), reverse=True))
+
+    @override_settings(API_RESPONSE_CACHE={})
+    def test_deep_page_queries(self):
+        params = {"pagination": "cursor", "limit": 2, "sort": "price"}
+        response = self.client.get(reverse("api:catalog"), params)
+        response = self.client.get(reverse("api:catalog"), dict(params, cursor=response.data["nextCursor"]))
+        with self.assertNumQueries(2):
+            self.client.get(reverse("api:catalog"), dict(params, cursor=response.data["nextCursor"]))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("api:catalog"), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+        for value in ("abc", [1], {"value": 1}):
+            cursor = base64.urlsafe_b64encode(json.dumps({"value": value, "id": 1, "page": 1}).encode()).decode()
+            for sort in ("price", "date", "reviews"):
+                response = self.client.get(reverse("api:catalog"), {"cursor": cursor, "sort": sort})
+                self.assertEqual(response.status_code, 404)
+
+
+class CatalogFacetsViewTestCase(TestCase):
+    """
+    TestCase for CatalogFacetsView
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product_tag = Tag.objects.create(
+            name="Gaming",
+        )
+        cls.products = []
+        for number in range(4):
+            product = Product.objects.create(
+                category=cls.subcategory,
+                title=f"video card {number}",
+                description="",
+                price=100 * (number + 1),
+                count=3,
+                freeDelivery=number % 2 == 0,
+                available=number != 3,
+            )
+            if number < 2:
+                product.tags.set([cls.product_tag])
+            cls.products.append(product)
+        # the most expensive product is on sale, so the price range is 100 - 300
+        cls.product_sale = ProductSale.objects.create(
+            product=cls.products[3],
+            salePrice=250,
+            dateFrom=timezone.now() - timezone.timedelta(days=1),
+            dateTo=timezone.now() + timezone.timedelta(days=1),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in cls.products:
+            product.delete()
+        cls.product_tag.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(API_RESPONSE_CACHE={})
+    def test_get(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("api:catalog_facets"), {"category": self.subcategory.id})
+        data = response.data
+        self.assertEqual(data["total"], 4)
+        self.assertEqual(data["freeDelivery"], {"true": 2, "false": 2})
+        self.assertEqual(data["available"], {"true": 3, "false": 1})
+        self.assertEqual(data["price"]["min"], 100)
+        self.assertEqual(data["price"]["max"], 300)
+        self.assertEqual(sum(bucket["count"] for bucket in data["price"]["histogram"]), 4)
+        self.assertEqual(data["price"]["histogram"][-1]["count"], 1)
+        self.assertEqual(data["tags"], [{"id": self.product_tag.id, "name": "Gaming", "count": 2}])
+
+    def test_filters(self):
+        response = self.client.get(reverse("api:catalog_facets"), {"filter[freeDelivery]": "true"})
+        self.assertEqual(response.data["total"], 2)
+        self.assertEqual(response.data["tags"][0]["count"], 1)
+
+    def test_cache(self):
+        self.client.get(reverse("api:catalog_facets"), {"filter[available]": "true", "category": "123"})
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("api:catalog_facets"), {"category": "123", "filter[available]": "true"})
+        self.assertEqual(response.data["total"], 3)
+
+
+class CatalogResponseCacheTestCase(TestCase):
+    """
+    TestCase for cached responses of CatalogListView
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product = Product.objects.create(
+            category=cls.subcategory,
+            title="video card",
+            description="",
+            price=500,
+            count=3,
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def setUp(self):
+        cache.clear()
+        response_cache._stats.clear()
+
+    def test_hit(self):
+        response = self.client.get(reverse("api:catalog"), {"sort": "price", "limit": 5})
+        self.assertEqual(response["X-Cache"], "MISS")
+        # the catalog version only
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("api:catalog"), {"limit": 5, "sort": "price"})
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.data["items"][0]["id"], self.product.id)
+        self.assertEqual(get_cache_stats("catalog"), {"hits": 1, "misses": 1})
+
+    @override_settings(API_RESPONSE_CACHE_STATS={"BATCH_SIZE": 2, "BATCH_SECONDS": 60})
+    def test_stats_shared(self):
+        for _ in range(3):
+            self.client.get(reverse("api:catalog"))
+        # counters, written by this process, are seen by the others
+        pending = dict(response_cache._stats)
+        response_cache._stats.clear()
+        self.assertEqual(get_cache_stats("catalog"), {"hits": 1, "misses": 1})
+        response_cache._stats.update(pending)
+        self.assertEqual(get_cache_stats("catalog"), {"hits": 2, "misses": 1})
+
+    def test_version_shared(self):
+        self.client.get(reverse("api:catalog"))
+        # the change is made by another process with its own local cache
+        with mock.patch("api.cache.cache", LocMemCache("other-process", {})):
+            Product.objects.filter(pk=self.product.pk).update(price=400)
+            bump_catalog_version()
+        response = self.client.get(reverse("api:catalog"))
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["items"][0]["price"], 400)
+
+    def test_invalidation(self):
+        self.client.get(reverse("api:catalog"))
+        ProductSale.objects.create(
+            product=self.product,
+            salePrice=100,
+            dateFrom=timezone.now() - timezone.timedelta(days=1),
+            dateTo=timezone.now() + timezone.timedelta(days=1),
+        )
+        response = self.client.get(reverse("api:catalog"))
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["items"][0]["price"], 100)
+
+    def test_timeout_till_sale_start(self):
+        ProductSale.objects.create(
+            product=self.product,
+            salePrice=100,
+            dateFrom=timezone.now() + timezone.timedelta(seconds=30),
+            dateTo=timezone.now() + timezone.timedelta(days=1),
+        )
+        self.assertLessEqual(get_timeout(300), 31)
+
+    @override_settings(API_RESPONSE_CACHE={"catalog": {"ENABLED": False}})
+    def test_disabled(self):
+        self.client.get(reverse("api:catalog"))
+        response = self.client.get(reverse("api:catalog"))
+        self.assertNotIn("X-Cache", response)
+
+
+class ProductCardTestCase(TestCase):
+    """
+    TestCase for precomputed product cards
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.user = User.objects.create_user(username="card_test_user", password="password")
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product_tag = Tag.objects.create(
+            name="Gaming",
+        )
+        cls.product = Product.objects.create(
+            category=cls.subcategory,
+            title="video card",
+            description="video card description",
+            price=500,
+            count=3,
+        )
+        cls.product.tags.set([cls.product_tag])
+        ProductImage.objects.create(product=cls.product, src="/3.png", alt="Image alt string")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.product_tag.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        cls.user.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def get_card(self):
+        return ProductCard.objects.get(product=self.product).data
+
+    def test_same_as_catalog_serializer(self):
+        response = self.client.get(reverse("api:catalog"))
+        product = Product.objects.with_price().get(pk=self.product.pk)
+        expected = CatalogSerializer(product, context={"request": response.wsgi_request}).data
+        self.assertJSONEqual(
+            response.content.decode(),
+            JSONRenderer().render({"items": [expected], "currentPage": 1, "lastPage": 1}).decode(),
+        )
+
+    def test_updated_by_signals(self):
+        self.product_tag.name = "Esports"
+        self.product_tag.save()
+        self.assertEqual(self.get_card()["tags"], [{"id": self.product_tag.id, "name": "Esports"}])
+        image = ProductImage.objects.create(product=self.product, src="/4.png", alt="Second image")
+        self.assertEqual(len(self.get_card()["images"]), 2)
+        image.delete()
+        self.assertEqual(len(self.get_card()["images"]), 1)
+        review = Review.objects.create(product=self.product, author=self.user, rate=4, text="review text")
+        self.assertEqual((self.get_card()["reviews"], self.get_card()["rating"]), (1, 4.0))
+        review.delete()
+        self.assertEqual(self.get_card()["reviews"], 0)
+        self.product_tag.name = "Gaming"
+        self.product_tag.save()
+
+    def test_missing_card(self):
+        ProductCard.objects.filter(product=self.product).delete()
+        response = self.client.get(reverse("api:catalog"))
+        self.assertEqual(response.data["items"][0]["title"], "video card")
+        call_command("rebuild_product_cards", stdout=open(os.devnull, "w"))
+        self.assertEqual(self.get_card()["title"], "video card")
+
+    def test_deleted_with_product(self):
+        product = Product.objects.create(category=self.subcategory, title="mouse", price=10, count=1)
+        ProductImage.objects.create(product=product, src="/3.png", alt="Image alt string")
+        Review.objects.create(product=product, author=self.user, rate=5, text="review text")
+        product.delete()
+        self.assertFalse(ProductCard.objects.filter(product_id=product.id).exists())
+
+
+class QueryExplainTestCase(TestCase):
+    """
+    TestCase for query plan inspection of catalog requests
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.staff = User.objects.create_user(username="explain_staff", password="password", is_staff=True)
+        cls.user = User.objects.create_user(username="explain_user", password="password")
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product = Product.objects.create(
+            category=cls.subcategory,
+            title="video card",
+            description="video card description",
+            price=500,
+            count=3,
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        cls.staff.delete()
+        cls.user.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(API_QUERY_EXPLAIN=True)
+    def test_staff(self):
+        self.client.login(username="explain_staff", password="password")
+        self.client.get(reverse("api:catalog"), {"category": "123001"})
+        response = self.client.get(reverse("api:catalog"), {"category": "123001", "explain": "1"})
+        self.assertEqual(response.data["status"], 200)
+        products_query = response.data["queries"][-1]
+        self.assertIn("api_product", products_query["sql"])
+        self.assertEqual(products_query["rows"], 1)
+        self.assertTrue(products_query["plan"])
+        self.assertNotIn("items", response.data)
+
+    @override_settings(API_QUERY_EXPLAIN=True)
+    def test_not_staff(self):
+        self.client.login(username="explain_user", password="password")
+        response = self.client.get(reverse("api:catalog"), {"explain": "1"})
+        self.assertIn("items", response.data)
+        self.assertNotIn("queries", response.data)
+
+    def test_disabled_by_default(self):
+        self.client.login(username="explain_staff", password="password")
+        response = self.client.get(reverse("api:catalog_facets"), {"explain": "1"})
+        self.assertNotIn("queries", response.data)
+
+
+class ProductReviewsTestCase(TestCase):
+    """
+    TestCase for product reviews list and reviews, embedded into the product details
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.users = [
+            User.objects.create_user(f"reviews_test_user_{number}", f"user{number}@test.test", "password")
+            for number in range(3)
+        ]
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product = Product.objects.create(
+            category=cls.subcategory,
+            title="video card",
+            description="",
+            price=500,
+            count=3,
+        )
+        cls.reviews = [
+            Review.objects.create(
+                product=cls.product,
+                author=cls.users[number % 3],
+                rate=number % 5 + 1,
+                text=f"review {number}",
+            )
+            for number in range(25)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        for user in cls.users:
+            user.delete()
+
+    @override_settings(PRODUCT_DETAIL_REVIEWS=5)
+    def test_product_details(self):
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse("api:product-detail", kwargs={"pk": self.product.id}))
+        self.assertEqual(
+            [review["text"] for review in response.data["reviews"]],
+            [f"review {number}" for number in range(24, 19, -1)],
+        )
+        self.assertEqual(response.data["reviews"][0]["author"], self.users[0].username)
+        self.assertEqual(response.data["ratingHistogram"], {1: 5, 2: 5, 3: 5, 4: 5, 5: 5})
+
+    def test_list(self):
+        texts = []
+        params = {"limit": 10}
+        for page in range(1, 4):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse("api:review_create", kwargs={"id": self.product.id}), params)
+            self.assertEqual(response.data["currentPage"], page)
+            texts += [review["text"] for review in response.data["items"]]
+            params["cursor"] = response.data["nextCursor"]
+        self.assertIsNone(params["cursor"])
+        self.assertEqual(texts, [f"review {number}" for number in range(24, -1, -1)])
+        self.assertEqual(response.data["items"][0]["email"], "user1@test.test")
+
+
+class ConditionalResponseTestCase(TestCase):
+    """
+    TestCase for conditional GET requests to the read endpoints
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.product_tag = Tag.objects.create(
+            name="Gaming",
+        )
+        cls.product_tag.category.set([cls.subcategory])
+        cls.product = Product.objects.create(
+            category=cls.subcategory,
+            title="video card",
+            description="video card description",
+            price=500,
+            count=3,
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.product.delete()
+        cls.product_tag.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url, params=None, queries=None, last_modified=False):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.has_header("Last-Modified"), last_modified)
+        if queries is None:
+            return self.client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+        with self.assertNumQueries(queries):
+            return self.client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_product_details(self):
+        url = reverse("api:product-detail", kwargs={"pk": self.product.id})
+        response = self.revalidate(url, queries=1, last_modified=True)
+        self.assertEqual(response.status_code, 304)
+        etag = response["ETag"]
+        image = ProductImage.objects.create(product=self.product, src="/4.png", alt="Second image")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        image.delete()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_catalog_cached(self):
+        # the catalog version only
+        response = self.revalidate(reverse("api:catalog"), {"category": "123001"}, queries=1)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    @override_settings(API_RESPONSE_CACHE={})
+    def test_catalog(self):
+        response = self.revalidate(reverse("api:catalog"), {"category": "123001"}, queries=1)
+        self.assertEqual(response.status_code, 304)
+        etag = response["ETag"]
+        Product.objects.filter(pk=self.product.pk).update(archived=True)
+        response = self.client.get(reverse("api:catalog"), {"category": "123001"}, HTTP_IF_NONE_MATCH=etag)
+        Product.objects.filter(pk=self.product.pk).update(archived=False)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(API_RESPONSE_CACHE={})
+    def test_catalog_deletion(self):
+        params = {"category": "123001"}
+        response = self.client.get(reverse("api:catalog"), params)
+        etag = response["ETag"]
+        extra = Product.objects.create(category=self.subcategory, title="extra", price=100, count=1)
+        extra.delete()
+        # a date can't tell, that the list lost an item, so lists are validated by ETag only
+        response = self.client.get(reverse("api:catalog"), params, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("api:catalog"), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Product.objects.filter(pk=self.product.pk).delete()
+        response = self.client.get(reverse("api:catalog"), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_tags_banners(self):
+        for url, params in (
+            (reverse("api:tags"), {"category": "123"}),
+            (reverse("api:banners"), None),
+        ):
+            self.assertEqual(self.revalidate(url, params).status_code, 304)
+
+    def test_tag_categories_change(self):
+        url = reverse("api:tags")
+        etag = self.client.get(url, {"category": "123001"})["ETag"]
+        self.subcategory.tag_set.clear()
+        response = self.client.get(url, {"category": "123001"}, HTTP_IF_NONE_MATCH=etag)
+        self.product_tag.category.set([self.subcategory])
+        self.assertEqual(response.status_code, 200)
+
+    def test_sale_boundary(self):
+        start = timezone.now() + timezone.timedelta(hours=1)
+        ProductSale.objects.create(
+            product=self.product,
+            salePrice=100,
+            dateFrom=start,
+            dateTo=start + timezone.timedelta(days=1),
+        )
+        before = Product.objects.modification_state()["updated"]
+        after = Product.objects.modification_state(at=start + timezone.timedelta(minutes=1))["updated"]
+        self.assertLess(before, start)
+        self.assertEqual(after, start)
+
+
+class ProductsBatchViewTestCase(TestCase):
+    """
+    TestCase for ProductsBatchView
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.products = [
+            Product.objects.create(
+                category=cls.subcategory,
+                title=f"video card {number}",
+                description="",
+                price=500 + number,
+                count=3,
+            )
+            for number in range(5)
+        ]
+        ProductImage.objects.create(product=cls.products[0], src="/3.png", alt="Image alt string")
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in cls.products:
+            product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def test_get(self):
+        ids = [self.products[3].id, self.products[0].id, 999999, self.products[3].id, self.products[1].id]
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("api:products_batch"), {"ids": ",".join(map(str, ids))})
+        self.assertEqual(
+            [item["id"] for item in response.data],
+            [self.products[3].id, self.products[0].id, self.products[1].id],
+        )
+        self.assertEqual(response.data[0]["price"], 503)
+        self.assertEqual(response.data[1]["images"][0]["src"], "http://testserver/3.png")
+
+    def test_empty(self):
+        response = self.client.get(reverse("api:products_batch"))
+        self.assertEqual(response.data, [])
+
+    @override_settings(PRODUCTS_BATCH_MAX_IDS=3)
+    def test_invalid(self):
+        response = self.client.get(reverse("api:products_batch"), {"ids": "1,2,3,4"})
+        self.assertEqual(response.status_code, 400)
+        for ids in ("1,a", "1,\u00b2", "1,-2"):
+            response = self.client.get(reverse("api:products_batch"), {"ids": ids})
+            self.assertEqual(response.status_code, 400)
+
+
+class RelatedProductsTestCase(TestCase):
+    """
+    TestCase for "customers also bought" recommendations
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.user = User.objects.create_user("related_test_user", "test@test.test", "password")
+        cls.category = Category.objects.create(
+            id=123,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="video card",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.products = [
+            Product.objects.create(
+                category=cls.subcategory,
+                title=f"video card {number}",
+                description="",
+                price=500 + number,
+                count=3,
+            )
+            for number in range(4)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        Order.objects.filter(user=cls.user).delete()
+        for product in cls.products:
+            product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+        cls.user.delete()
+
+    def create_order(self, products, paid=True):
+        order = Order.objects.create(fullName="Test User", user=self.user)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, count=1)
+        if paid:
+            Payment.objects.create(order=order, name="Test User", number="2222", month="01", year="2030", code="123")
+        return order
+
+    def get_related(self, product):
+        response = self.client.get(reverse("api:related_products", kwargs={"id": product.id}))
+        return [item["id"] for item in response.data]
+
+    def build(self, **options):
+        call_command("build_related_products", stdout=open(os.devnull, "w"), **options)
+
+    def test_build(self):
+        first, second, third, fourth = self.products
+        self.create_order([first, second, third])
+        self.create_order([first, third])
+        self.create_order([first, fourth], paid=False)
+        self.build()
+        with self.assertNumQueries(1):
+            related = self.get_related(first)
+        self.assertEqual(related, [third.id, second.id])
+        self.assertEqual(self.get_related(fourth), [])
+
+        # only new payments are processed by the next run
+        self.create_order([first, second])
+        self.create_order([first, second])
+        self.build()
+        self.assertEqual(self.get_related(first), [second.id, third.id])
+        self.assertEqual(ProductRelated.objects.get(product=first, related=second).score, 3)
+
+        self.build(full=True)
+        self.assertEqual(ProductRelated.objects.get(product=first, related=second).score, 3)
+
+    @override_settings(RELATED_PRODUCTS_COUNT=1)
+    def test_top(self):
+        first, second, third, _ = self.products
+        self.create_order([first, second, third])
+        self.create_order([first, third])
+        self.build(batch_size=1)
+        self.assertEqual(self.get_related(first), [third.id])
+        self.assertEqual(self.get_related(second), [first.id])
+
+
+class SpecificationFiltersTestCase(TestCase):
+    """
+    TestCase for catalog filters by product specifications
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.category = Category.objects.create(
+            id=123,
+            title="phones",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.subcategory = Subcategory.objects.create(
+            id=123001,
+            category=cls.category,
+            title="phones",
+            src="/3.png",
+            alt="Image alt string"
+        )
+        cls.products = []
+        for number, (ram, screen) in enumerate((("8 GB", '6.1"'), ("8 gb", '6,7"'), ("12 GB", '6.5"'))):
+            product = Product.objects.create(
+                category=cls.subcategory,
+                title=f"phone {number}",
+                description="",
+                price=500 + number,
+                count=3,
+            )
+            ProductSpecifications.objects.create(product=product, name="RAM", value=ram)
+            ProductSpecifications.objects.create(product=product, name="Screen  size", value=screen)
+            cls.products.append(product)
+
+    @classmethod
+    def tearDownClass(cls):
+        for product in cls.products:
+            product.delete()
+        cls.subcategory.delete()
+        cls.category.delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def get_ids(self, params):
+        response = self.client.get(reverse("api:catalog"), dict(params, sort="price"))
+        return [item["id"] for item in response.data["items"]]
+
+    def test_value(self):
+        first, second, third = self.products
+        self.assertEqual(self.get_ids({"filter[spec.ram]": "8 GB"}), [first.id, second.id])
+        self.assertEqual(self.get_ids({"filter[spec.RAM]": "12 gb"}), [third.id])
+
+    def test_range(self):
+        first, second, third = self.products
+        self.assertEqual(self.get_ids({"filter[spec.screen size.min]": "6.5"}), [second.id, third.id])
+        self.assertEqual(
+            self.get_ids({"filter[spec.screen size.min]": "6.2", "filter[spec.Screen size.max]": "6.6"}),
+            [third.id],
+        )
+        self.assertEqual(
+            self.get_ids({"filter[spec.screen size.max]": "6.5", "filter[spec.ram]": "8 GB"}),
+            [first.id],
+        )
+
+    def test_invalidation(self):
+        first = self.products[0]
+        self.assertEqual(self.get_ids({"filter[spec.ram]": "16 GB"}), [])
+        specification = ProductSpecifications.objects.get(product=first, key="ram")
+        specification.value = "16 GB"
+        specification.save()
+        self.assertEqual(self.get_ids({"filter[spec.ram]": "16 GB"}), [first.id])
+        self.assertEqual(specification.numeric_value, 16)
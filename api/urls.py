@@ -5,12 +5,16 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     CategoriesListView,
     CatalogListView,
+    CatalogFacetsView,
     PopularProductsListView,
     LimitedProductsListView,
+    ProductsBatchView,
     SaleProductsListView,
     BannerListView,
     CatalogItemViewSet,
-    ReviewCreateView,
+    ReviewListCreateView,
+    RelatedProductsListView,
+    ProductDiscountsView,
     BasketViewSet,
     OrderViewSet,
     PaymentCreateView,
@@ -34,15 +38,19 @@ routers.register(r'order', OrderViewSet, basename="order")
 urlpatterns = [
     path("", include(routers.urls)),
     path("catalog", CatalogListView.as_view(), name="catalog"),
+    path("catalog/facets", CatalogFacetsView.as_view(), name="catalog_facets"),
     path("tags", TagListView.as_view(), name="tags"),
     path("profile", ProfileListCreateView.as_view(), name="profile"),
     path("profile/avatar", AvatarListCreateView.as_view(), name="avatar"),
-    path("product/<int:id>/reviews", ReviewCreateView.as_view(), name="review_create"),
+    path("product/<int:id>/reviews", ReviewListCreateView.as_view(), name="review_create"),
+    path("product/<int:id>/related", RelatedProductsListView.as_view(), name="related_products"),
+    path("product/<int:id>/discounts", ProductDiscountsView.as_view(), name="product_discounts"),
     path("payment/<int:id>", PaymentCreateView.as_view(), name="payment_create"),
     path("categories", CategoriesListView.as_view(), name="categories"),
     path("catalog/", CatalogListView.as_view(), name="catalog"),
     path("products/popular", PopularProductsListView.as_view(), name="popular"),
     path("products/limited", LimitedProductsListView.as_view(), name="limited"),
+    path("products", ProductsBatchView.as_view(), name="products_batch"),
     path("sales", SaleProductsListView.as_view(), name="sales"),
     path("banners", BannerListView.as_view(), name="banners"),
     path("sign-out", sign_out_view, name="sign-out"),
@@ -1,9 +1,12 @@
-from itertools import chain
-
+import re
+from decimal import Decimal
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.contrib.sessions.backends.db import SessionStore
-from django.db.models import Count, Avg
 from django.contrib.auth import logout, login
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Max, Min, Prefetch, Q, Window
+from django.db.models.functions import DenseRank, Floor, Least, RowNumber
+from django.http import HttpResponse
 
 from rest_framework.generics import ListAPIView, CreateAPIView, ListCreateAPIView, UpdateAPIView
 from rest_framework.permissions import AllowAny
@@ -15,17 +18,25 @@ from rest_framework import status
 from rest_framework.decorators import action
 from django.contrib.auth.mixins import LoginRequiredMixin
 
+from . import popularity, sale_archive, search, tag_index
+from .baskets import get_basket_key
+from .cache import CachedResponseMixin, ConditionalResponseMixin
+from .category_tree import get_tree
+from .explain import QueryExplainMixin
 from .pagination import (
     CustomPagination,
+    KeysetPagination,
+    KeysetPaginationMixin,
     ProfilePagination,
 )
+from .specifications import normalize, parse_number
 
 from .models import (
     Product,
-    Category,
-    Subcategory,
     Tag,
     ProductSale,
+    ProductSpecifications,
+    Review,
     Basket,
     Profile,
     ProfileImage,
@@ -36,10 +47,8 @@ from .models import (
 )
 
 from .serializers import (
-    CategorySerializer,
-    CatalogSerializer,
-    TagSerializer,
-    PopularProductsSerializer,
+    ProductCardSerializer,
+    TagCountSerializer,
     SaleProductSerializer,
     CatalogItemSerializer,
     ReviewSerializer,
@@ -55,49 +64,69 @@ from .serializers import (
 )
 
 
-class CategoriesListView(APIView):
+class CategoriesListView(ConditionalResponseMixin, APIView):
     """
     View for categories
+    Returns the pre-rendered category tree (see "category_tree.py") and supports conditional requests by ETag
+    Query budget: a single query (version of the tree), 3 queries if the tree is rebuilt
     """
 
-    def get(self, request: Request) -> Response:
-        categories = Category.objects.all().prefetch_related()
-        serialized = CategorySerializer(categories, many=True)
-        return Response(serialized.data)
+    def get(self, request: Request) -> HttpResponse:
+        self.tree = get_tree()
+        return self.get_conditional_response(
+            lambda: HttpResponse(self.tree.content, content_type="application/json")
+        )
+
+    def get_validators(self) -> dict:
+        """
+        ETag of the category tree is a hash of its content
+        :return:
+        """
+        return {"ETag": self.tree.etag}
 
 
-class SaleProductsListView(ListAPIView):
+class SaleProductsListView(KeysetPaginationMixin, ListAPIView):
     """
     View for products on sale
+    "status" parameter selects "active" (by default), "upcoming" or "ended" sales, by the sale window index.
+    Supports keyset pagination with "pagination=cursor" parameter
+    Products and their cards are fetched by the same query as the sales.
+    Query budget: 2 queries per page (count, sales with products and cards)
     """
     pagination_class = CustomPagination
     serializer_class = SaleProductSerializer
+    sale_statuses = ("active", "upcoming", "ended")
 
     def get_queryset(self):
-        queryset = ProductSale.objects.all().order_by("salePrice").prefetch_related()
-        return queryset
+        status_param = self.request.query_params.get("status")
+        if status_param not in self.sale_statuses:
+            status_param = "active"
+        queryset = getattr(ProductSale.objects, status_param)()
+        return queryset.order_by("salePrice", "id").select_related("product__card")
 
 
-class CatalogListView(ListAPIView):
+class CatalogFilterMixin:
     """
-    View for products catalog
+    Mixin for views, which filter products by the catalog query parameters
     """
-    pagination_class = CustomPagination
-    serializer_class = CatalogSerializer
+    filter_query_params = ('category', 'tags[]')
+    filter_query_prefix = 'filter['
+    specification_filter_prefix = 'filter[spec.'
 
-    def get_queryset(self):
+    def filter_catalog(self, queryset):
         """
-        Modified "get_queryset" method
-        returns queryset, constructed on the base of query parameters
+        Returns products queryset, filtered on the base of query parameters
+        :param queryset:
         :return:
         """
 
-        queryset = Product.objects.all().prefetch_related()
+        # archived products are never shown in the catalog, its indexes leave them out too
+        queryset = queryset.filter(archived=False)
 
-        # getting name of the product to filter by
+        # getting name of the product to search by in the full-text index
         name = self.request.query_params.get('filter[name]')
         if name is not None:
-            queryset = queryset.filter(title__icontains=name)
+            queryset = search.search(queryset, name)
 
         # getting minimal price of the product to filter by price
         minprice = self.request.query_params.get('filter[minPrice]')
@@ -123,6 +152,20 @@ class CatalogListView(ListAPIView):
             if available == "True":
                 queryset = queryset.filter(available=available)
 
+        # getting tags to filter by: products with all the tags, or with any of them if "filter[tagsMode]" is "or".
+        # Frontend sends the tags as "tags[]" parameter
+        tags = self.request.query_params.getlist('filter[tags][]') or self.request.query_params.getlist('tags[]')
+        tag_ids = [int(tag) for tag in tags if tag.isdigit()]
+        if tag_ids:
+            match_all = self.request.query_params.get('filter[tagsMode]') != 'or'
+            queryset = tag_index.filter_products(queryset, tag_ids, match_all=match_all)
+
+        # getting specifications to filter by: "filter[spec.<name>]" selects products with the specification value,
+        # "filter[spec.<name>.min]" and "filter[spec.<name>.max]" select a range of its numeric values
+        for key, value in self.request.query_params.items():
+            if key.startswith(self.specification_filter_prefix) and key.endswith(']'):
+                queryset = self.filter_specification(queryset, key[len(self.specification_filter_prefix):-1], value)
+
         # getting category to filter by
         category = self.request.query_params.get('category')
         if category is not None and category.isdigit():
@@ -131,27 +174,213 @@ class CatalogListView(ListAPIView):
             else:
                 queryset = queryset.filter(category__category=category)
 
+        return queryset
+
+    @staticmethod
+    def filter_specification(queryset, name: str, value: str):
+        """
+        Returns products, which specification "name" has the value (or fits the range, if the name ends with
+        ".min" or ".max"). Products are selected by the index of normalized specifications only.
+        :param queryset:
+        :param name:
+        :param value:
+        :return:
+        """
+        name, _, bound = name.rpartition('.')
+        if bound not in ('min', 'max'):
+            name, bound = f'{name}.{bound}' if name else bound, None
+        specifications = ProductSpecifications.objects.filter(key=normalize(name))
+        if bound is None:
+            specifications = specifications.filter(value_key=normalize(value))
+        else:
+            number = parse_number(value)
+            if number is None:
+                return queryset
+            lookup = 'numeric_value__gte' if bound == 'min' else 'numeric_value__lte'
+            specifications = specifications.filter(**{lookup: number})
+        return queryset.filter(pk__in=specifications.values('product'))
+
+    def get_filter_params(self) -> list:
+        """
+        Returns normalized filter set of the request: sorted pairs of filter parameters and their values.
+        Requests, which differ by order of parameters or by not filtering parameters, have the same filter set.
+        :return:
+        """
+        return sorted(
+            (key, value)
+            for key, values in self.request.query_params.lists()
+            if key.startswith(self.filter_query_prefix) or key in self.filter_query_params
+            for value in values
+        )
+
+
+class CatalogListView(
+    QueryExplainMixin,
+    CachedResponseMixin,
+    ConditionalResponseMixin,
+    CatalogFilterMixin,
+    KeysetPaginationMixin,
+    ListAPIView,
+):
+    """
+    View for products catalog
+    Query budget: 3 queries per page (validation, count, products with prices and cards) whatever the page limit is,
+    2 queries with keyset pagination ("pagination=cursor" parameter), which doesn't count products.
+    Filtering by tags costs one more query (version of the tag index, see "tag_index.py").
+    Responses are cached as "catalog" endpoint of "API_RESPONSE_CACHE" setting.
+    Staff users can get report of the request queries with "explain=1" parameter (see "API_QUERY_EXPLAIN").
+    Supports conditional requests by ETag, validation costs a single query,
+    cached responses are validated by the catalog version query only.
+    """
+    send_last_modified = False
+    cache_endpoint = "catalog"
+    pagination_class = CustomPagination
+    serializer_class = ProductCardSerializer
+
+    def get_modification_state(self):
+        """
+        Catalog page changes with the filtered products and with their prices, when any sale starts or ends
+        :return:
+        """
+        state = self.filter_catalog(Product.objects.all()).modification_state()
+        return [state["updated"]], [state["count"]]
+
+    def get_queryset(self):
+        """
+        Modified "get_queryset" method
+        returns queryset, constructed on the base of query parameters
+        :return:
+        """
+
+        queryset = self.filter_catalog(Product.objects.for_cards())
+
         # getting sorting parameters
         sort_param = self.request.query_params.get('sort')
         if sort_param is not None:
+            # reviews and rating are stored in denormalized product columns
             if sort_param == "reviews":
-                queryset = queryset.annotate(reviews_count=Count("review"))
                 sort_param = "reviews_count"
             if sort_param == "rating":
-                queryset = queryset.annotate(rating=Avg("review__rate"))
-                sort_param = "rating"
+                sort_param = "rating_avg"
             sort_type = self.request.query_params.get('sortType')
             if sort_type is not None:
                 if sort_type == 'inc':
                     sort_param = "-" + sort_param
             queryset = queryset.order_by(sort_param)
+        elif "search_rank" in queryset.query.annotations:
+            # the most relevant search results go first, if other sorting isn't specified
+            queryset = queryset.order_by("-search_rank", "id")
 
         return queryset
 
 
-class CatalogItemViewSet(ModelViewSet):
+class CatalogFacetsView(QueryExplainMixin, CachedResponseMixin, CatalogFilterMixin, APIView):
+    """
+    View for catalog facets: number of products for each filter choice, given the same filters as CatalogListView.
+    Query budget: 3 queries (totals and prices, tags, price histogram).
+    Facets are cached per normalized filter set as "facets" endpoint of "API_RESPONSE_CACHE" setting.
+    Staff users can get report of the request queries with "explain=1" parameter (see "API_QUERY_EXPLAIN").
+    """
+    cache_endpoint = "facets"
+
+    def get(self, request: Request) -> Response:
+        return self.get_cached_response(
+            lambda: Response(self.get_facets(self.filter_catalog(Product.objects.with_price())))
+        )
+
+    def get_cache_params(self) -> list:
+        """
+        Modified method "get_cache_params" returns only filter parameters, because facets don't depend on
+        sorting and pagination
+        :return:
+        """
+        return self.get_filter_params()
+
+    def get_facets(self, queryset) -> dict:
+        """
+        Method calculates facets of the filtered products: free delivery and availability breakdowns,
+        current price range and histogram, and number of products with each tag.
+        :param queryset:
+        :return:
+        """
+        summary = queryset.aggregate(
+            total=Count("id"),
+            free_delivery=Count("id", filter=Q(freeDelivery=True)),
+            available=Count("id", filter=Q(available=True)),
+            min_price=Min("current_price"),
+            max_price=Max("current_price"),
+        )
+        tags = Tag.objects.filter(
+            product__in=queryset.values("pk")
+        ).values(
+            "id", "name"
+        ).annotate(
+            count=Count("product")
+        ).order_by("-count", "id")
+        return {
+            "total": summary["total"],
+            "freeDelivery": {
+                "true": summary["free_delivery"],
+                "false": summary["total"] - summary["free_delivery"],
+            },
+            "available": {
+                "true": summary["available"],
+                "false": summary["total"] - summary["available"],
+            },
+            "price": {
+                "min": summary["min_price"] and summary["min_price"].quantize(Decimal("0.01")),
+                "max": summary["max_price"] and summary["max_price"].quantize(Decimal("0.01")),
+                "histogram": self.get_price_histogram(queryset, summary["min_price"], summary["max_price"]),
+            },
+            "tags": list(tags),
+        }
+
+    @staticmethod
+    def get_price_histogram(queryset, min_price, max_price) -> list:
+        """
+        Method splits the price range into "CATALOG_FACETS_PRICE_BUCKETS" equal buckets
+        and counts products in each of them by one grouped query. Empty buckets are returned too.
+        :param queryset:
+        :param min_price:
+        :param max_price:
+        :return:
+        """
+        if min_price is None:
+            return []
+        # SQLite returns calculated decimals with float digits, so they are rounded to cents
+        min_price = min_price.quantize(Decimal("0.01"))
+        max_price = max_price.quantize(Decimal("0.01"))
+        buckets = settings.CATALOG_FACETS_PRICE_BUCKETS
+        width = (max_price - min_price) / buckets or 1
+        counts = dict(
+            queryset.annotate(
+                bucket=Least(
+                    Floor((F("current_price") - min_price) / width),
+                    buckets - 1,
+                    output_field=IntegerField(),
+                )
+            ).values("bucket").annotate(
+                count=Count("id")
+            ).values_list("bucket", "count").order_by()
+        )
+        return [
+            {
+                "from": round(min_price + width * number, 2),
+                "to": round(min_price + width * (number + 1), 2),
+                "count": counts.get(number, 0),
+            }
+            for number in range(buckets)
+        ]
+
+
+class CatalogItemViewSet(ConditionalResponseMixin, ModelViewSet):
     """
     View for specific products in catalog
+    Product embeds only its latest reviews (see "PRODUCT_DETAIL_REVIEWS" setting) and the rating histogram,
+    all the reviews are listed by ReviewListCreateView.
+    Query budget: 7 queries (validation, product with price, images, tags, specifications, latest reviews,
+    rating histogram) whatever the number of reviews is.
+    Product details support conditional requests by ETag and Last-Modified.
     """
     serializer_class = CatalogItemSerializer
 
@@ -162,21 +391,98 @@ class CatalogItemViewSet(ModelViewSet):
         specified product data if it is, or all products in opposite case
         :return:
         """
-        queryset = Product.objects.all().prefetch_related()
+        queryset = Product.objects.with_price().prefetch_related(
+            "productimage_set",
+            "tags",
+            "productspecifications_set",
+            Prefetch(
+                "review_set",
+                queryset=Review.objects.select_related("author").order_by("-id")[:settings.PRODUCT_DETAIL_REVIEWS],
+                to_attr="latest_reviews",
+            ),
+        )
 
         product_id = self.kwargs.get('pk')
         if product_id is not None:
             queryset = queryset.filter(id=product_id)
         return queryset
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Modified method "retrieve" counts the view of the product for the popularity ranking
+        and answers conditional requests
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        popularity.record_view(kwargs["pk"])
+        return self.get_conditional_response(lambda: super(CatalogItemViewSet, self).retrieve(request, *args, **kwargs))
+
+    def get_modification_state(self):
+        """
+        Product details change with the product data and with its price, when any of its sales starts or ends
+        :return:
+        """
+        product_id = self.kwargs["pk"]
+        state = Product.objects.filter(pk=product_id).modification_state(
+            sales=ProductSale.objects.filter(product=product_id)
+        )
+        if not state["count"]:
+            return None
+        return [state["updated"]], []
+
 
-class ReviewCreateView(CreateAPIView):
+class RelatedProductsListView(ListAPIView):
+    """
+    View for products, which customers also bought together with the product.
+    Related products are precomputed by "build_related_products" command.
+    Query budget: a single query (related products with prices and cards)
+    """
+    serializer_class = ProductCardSerializer
+
+    def get_queryset(self):
+        """
+        Modified "get_queryset" method returns related products of the product ordered by their rank
+        :return:
+        """
+        return Product.objects.filter(
+            recommended_for__product=self.kwargs["id"],
+            archived=False,
+        ).order_by("recommended_for__rank").for_cards()
+
+
+class ProductDiscountsView(APIView):
+    """
+    View for summary of discounts of the product by months, archived and current sales together
+    (see "sale_archive.summarize_discounts")
+    Query budget: 3 queries (product, archived sales, current sales)
+    """
+
+    def get(self, request: Request, id: int) -> Response:
+        product = Product.objects.filter(pk=id).first()
+        if product is None:
+            return Response(status=status.HTTP_404_NOT_FOUND, data="Error: Product not found.")
+        return Response({"product": product.pk, "periods": sale_archive.summarize_discounts(product)})
+
+
+class ReviewListCreateView(ListCreateAPIView):
     """
     View for product reviews
+    Reviews are listed newest first with keyset pagination, authors are fetched by the same query,
+    so every page costs a single query whatever the number of reviews is.
     """
 
+    pagination_class = KeysetPagination
     serializer_class = ReviewSerializer
 
+    def get_queryset(self):
+        """
+        Modified "get_queryset" method returns reviews of the product with their authors
+        :return:
+        """
+        return Review.objects.filter(product=self.kwargs["id"]).select_related("author").order_by("-id")
+
     def perform_create(self, serializer):
         """
         Modified "perform_create" method for review creation
@@ -184,56 +490,107 @@ class ReviewCreateView(CreateAPIView):
         :return:
         """
         product = Product.objects.filter(pk=self.kwargs["id"])[0]
-        serializer.save(product=product, author=self.request.user)
+        # review and denormalized rating of the product are saved together
+        with transaction.atomic():
+            serializer.save(product=product, author=self.request.user)
 
 
 class PopularProductsListView(ListAPIView):
     """
-    View for popular products (First 8 products with average rate greater than 4,2)
+    View for popular products (first 8 products of the popularity ranking, see "popularity.py")
+    Until the ranking is built, products with average rate greater than 4,2 are returned, the best rated first.
+    Query budget: a single query (products with prices and cards), one more if the ranking isn't built.
     """
-    queryset = Product.objects.annotate(
-        rating=Avg("review__rate")
-    ).filter(
-        rating__gte=4.2
-    ).order_by(
-        "rating"
-    ).prefetch_related(
-    )[:8]
-    serializer_class = PopularProductsSerializer
+    serializer_class = ProductCardSerializer
+
+    def get_queryset(self):
+        products = Product.objects.filter(archived=False).for_cards()
+        queryset = products.filter(popularity__isnull=False).order_by("popularity__rank")[:8]
+        if not queryset:
+            queryset = products.filter(rating_avg__gte=4.2).order_by("-rating_avg", "id")[:8]
+        return queryset
 
 
 class LimitedProductsListView(ListAPIView):
     """
     View for limited products (First 16 products with "limited"=True)
+    Query budget: a single query (products with prices and cards)
     """
-    queryset = Product.objects.filter(limited=True).order_by("title").prefetch_related()[:16]
-    serializer_class = PopularProductsSerializer
+    serializer_class = ProductCardSerializer
 
+    def get_queryset(self):
+        # prices depend on the moment of the request, so the queryset is built per request
+        return Product.objects.filter(limited=True, archived=False).order_by("title").for_cards()[:16]
 
-class BannerListView(ListAPIView):
+
+class ProductsBatchView(APIView):
     """
-    View for banners (manually specified product ids in queryset)
+    View for cards of several products, requested by ids (i.e. for comparison list, wishlist or re-order screen)
+    Ids are passed as comma separated "ids" parameter, their number is limited by "PRODUCTS_BATCH_MAX_IDS" setting.
+    Cards are returned in the order of requested ids, missing products and repeated ids are skipped.
+    Query budget: a single query (products with prices and cards) whatever the number of ids is.
     """
-    serializer_class = PopularProductsSerializer
 
-    def get_queryset(self):
+    def get(self, request: Request) -> Response:
+        ids = []
+        for value in request.query_params.get("ids", "").split(","):
+            value = value.strip()
+            if not value:
+                continue
+            if not re.fullmatch(r"\d+", value, re.ASCII):
+                return Response(status=status.HTTP_400_BAD_REQUEST, data="Error: Product ids must be integers.")
+            if int(value) not in ids:
+                ids.append(int(value))
+        if len(ids) > settings.PRODUCTS_BATCH_MAX_IDS:
+            error_message = "Error: No more than {} products can be requested at once.".format(
+                settings.PRODUCTS_BATCH_MAX_IDS
+            )
+            return Response(status=status.HTTP_400_BAD_REQUEST, data=error_message)
+        products = Product.objects.for_cards().in_bulk(ids)
+        serialized = ProductCardSerializer(
+            [products[pk] for pk in ids if pk in products],
+            many=True,
+            context={"request": request},
+        )
+        return Response(serialized.data)
+
+
+class BannerListView(ConditionalResponseMixin, ListAPIView):
+    """
+    View for banners (one product from each of three subcategories with the most products)
+    Query budget: 2 queries (validation, products with prices and cards)
+    Supports conditional requests by ETag.
+    """
+    send_last_modified = False
+    serializer_class = ProductCardSerializer
+
+    def get_modification_state(self):
         """
-        Modified method "get_queryset" gets available subcategories and counts amount of products in each subcategory,
-        then selects first three subcategories with the most amount of products in them and returns one product from
-        each selected category in resulting queryset.
+        Banners change with any product and with prices, when any sale starts or ends
         :return:
         """
+        state = Product.objects.modification_state()
+        return [state["updated"]], [state["count"]]
 
-        categories_available = Subcategory.objects.all()
-        products_in_categories = list()
-        for category in categories_available:
-            key = category.id
-            value = Product.objects.filter(category=category).count()
-            products_in_categories.append((key, value))
-        products_in_categories.sort(key=lambda a: a[1], reverse=True)
-        categories_list = [item[0] for item in products_in_categories[:3]]
-        queryset = list(chain(Product.objects.filter(category=category).prefetch_related().first()
-                              for category in categories_list))
+    def get_queryset(self):
+        """
+        Modified method "get_queryset" selects three subcategories with the most products by their stored
+        products count and the first product of each of them by a single query: products are ranked
+        by the count of their subcategory and numbered within it by window functions.
+        :return:
+        """
+        queryset = Product.objects.for_cards().filter(
+            archived=False
+        ).annotate(
+            subcategory_rank=Window(
+                DenseRank(),
+                order_by=(F("category__products_count").desc(), F("category").asc()),
+            ),
+            number=Window(RowNumber(), partition_by=F("category"), order_by=F("id").asc()),
+        ).filter(
+            subcategory_rank__lte=3,
+            number=1,
+        ).order_by("subcategory_rank")
         return queryset
 
 
@@ -242,37 +599,29 @@ class BasketViewSet(ModelViewSet):
     ViewSet for user basket
     """
     serializer_class = BasketSerializer
-    session = SessionStore()
-    session.create()
 
     def get_queryset(self):
         """
-        Modified method "get_queryset" checks if there are any products with a specific session_id
-        in temporary basket (user added them into temporary basket before log in) and? if they are, moves
-        them into user's basket? deleting them from temporary basket
+        Modified method "get_queryset" returns items of the user's basket. Items, which the visitor added
+        into temporary basket before log in, are moved into user's basket on login (see "baskets.py").
         If user is Anonymous TemporaryBasket model and serializer used instead of Basket.
         :return:
         """
         if self.request.user.is_authenticated:
-            if self.session.session_key:
-                for item in TemporaryBasket.objects.filter(session=self.session.session_key):
-                    Basket.objects.create(
-                        user=self.request.user,
-                        date=item.date,
-                        product=item.product,
-                        count=item.count
-                    )
-                    item.delete()
-            return Basket.objects.filter(user=self.request.user).prefetch_related()
+            return Basket.objects.filter(user=self.request.user).prefetch_related(
+                Prefetch("product", queryset=Product.objects.for_cards())
+            )
         self.serializer_class = TemporaryBasketSerializer
-        return TemporaryBasket.objects.filter(session=self.session.session_key)
+        return TemporaryBasket.objects.filter(session=get_basket_key(self.request)).prefetch_related(
+            Prefetch("product", queryset=Product.objects.for_cards())
+        )
 
     def create(self, request, *args, **kwargs):
         """
         Modified method "create" checks if user is authenticated and if there is corresponding item in the basket
         If item exists, it will be modified, if not, it will be created.
-        If user is Anonymous TemporaryBasket model and serializer used instead of Basket and "session" id will be
-        calculated and set.
+        If user is Anonymous TemporaryBasket model and serializer used instead of Basket and the visitor's
+        basket key (see "baskets.py") will be used as "session", the key is created for the first item.
 
         :param request:
         :param args:
@@ -287,8 +636,8 @@ class BasketViewSet(ModelViewSet):
         if request.user.is_authenticated:
             instance = Basket.objects.filter(user=request.user.id, product=request.data['id'])
         else:
-            data['session'] = self.session.session_key
-            instance = TemporaryBasket.objects.filter(session=self.session.session_key, product=request.data['id'])
+            data['session'] = get_basket_key(request, create=True)
+            instance = TemporaryBasket.objects.filter(session=data['session'], product=request.data['id'])
         if instance:
             partial = True
             instance = instance[0]
@@ -322,8 +671,7 @@ class BasketViewSet(ModelViewSet):
         if request.user.is_authenticated:
             instance = Basket.objects.filter(user=request.user, product=request.data['id'])
         else:
-            session = self.session
-            instance = TemporaryBasket.objects.filter(session=session.session_key, product=request.data['id'])
+            instance = TemporaryBasket.objects.filter(session=get_basket_key(request), product=request.data['id'])
         if instance:
             instance = instance[0]
         if instance.count > count:
@@ -350,11 +698,12 @@ class BasketViewSet(ModelViewSet):
         instance.delete()
 
 
-class OrderViewSet(LoginRequiredMixin, ModelViewSet):
+class OrderViewSet(LoginRequiredMixin, KeysetPaginationMixin, ModelViewSet):
     """
     ViewSet for Orders creation and representation.
     It takes part in the steps of the order creation after specifying user, delivery and payment data.
     Before it another ViewSet named "OrderViewSet" used.
+    Orders list supports keyset pagination with "pagination=cursor" parameter.
     """
     serializer_class = OrderSerializer
 
@@ -651,11 +1000,38 @@ class CreateUserView(CreateAPIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class TagListView(ListAPIView):
+class TagListView(ConditionalResponseMixin, ListAPIView):
     """
-    View for product tags
+    View for product tags with number of not archived products with each tag in the requested category
+    Products are counted by the tag index (see "tag_index.py") without joining products.
+    Supports conditional requests by ETag
     """
-    serializer_class = TagSerializer
+    send_last_modified = False
+    serializer_class = TagCountSerializer
+
+    def get_modification_state(self):
+        """
+        Tags list changes with the tags of the requested category and with their products
+        :return:
+        """
+        tags = self.get_queryset().aggregate(updated=Max("updated_at"), count=Count("id"))
+        return [tags["updated"]], [tags["count"], sorted(self.get_counts().items())]
+
+    def get_counts(self) -> dict:
+        """
+        Returns number of products with each tag in the requested category by the tag ids.
+        Products are counted once per request.
+        :return:
+        """
+        if not hasattr(self, "counts"):
+            category = self.request.query_params.get("category")
+            self.counts = tag_index.count_products(category if category and category.isdigit() else None)
+        return self.counts
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["counts"] = self.get_counts()
+        return context
 
     def get_queryset(self):
         """
@@ -667,7 +1043,6 @@ class TagListView(ListAPIView):
         category = self.request.query_params.get("category")
         if category:
             if len(category) < 4:
-                category = Subcategory.objects.filter(category=category).values("id")
-                return Tag.objects.filter(category__in=[(item["id"]) for item in category]).distinct()
+                return Tag.objects.filter(category__category=category).distinct()
             return Tag.objects.filter(category=category)
         return Tag.objects.all()
@@ -146,6 +146,48 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Cached catalog endpoints: "ENABLED" turns caching of the endpoint on or off,
+# "TIMEOUT" is a lifetime of the cached response in seconds
+API_RESPONSE_CACHE = {
+    "catalog": {"ENABLED": True, "TIMEOUT": 300},
+    "facets": {"ENABLED": True, "TIMEOUT": 300},
+}
+# Hit and miss counters of the cached endpoints are written to the database by every process
+# in batches of "BATCH_SIZE" requests or once in "BATCH_SECONDS" seconds (see "response_cache_stats" command)
+API_RESPONSE_CACHE_STATS = {"BATCH_SIZE": 100, "BATCH_SECONDS": 60}
+# Number of equal buckets in the price histogram of the catalog facets
+CATALOG_FACETS_PRICE_BUCKETS = 10
+# Number of the latest reviews, embedded into the product details, the rest are listed by product reviews endpoint
+PRODUCT_DETAIL_REVIEWS = 10
+# Maximal number of products, which cards can be requested at once by their ids
+PRODUCTS_BATCH_MAX_IDS = 50
+# Number of related products (customers also bought), stored and shown for each product
+RELATED_PRODUCTS_COUNT = 8
+# Popularity ranking of products (see "rank_popular_products" command): weights of rating, logarithms
+# of reviews count, recent sales and views in the score, half-life of sales and views and period of counted sales.
+# Web processes write counted views of product pages by batches of "VIEWS_BATCH_SIZE" views or once in
+# "VIEWS_BATCH_SECONDS" seconds, so views, counted since the last batch, are lost if the process stops.
+POPULARITY_RANKING = {
+    "RATING": 1.0,
+    "REVIEWS": 0.5,
+    "SALES": 1.0,
+    "VIEWS": 0.2,
+    "HALF_LIFE_DAYS": 14,
+    "PERIOD_DAYS": 90,
+    "VIEWS_BATCH_SIZE": 100,
+    "VIEWS_BATCH_SECONDS": 60,
+}
+# Allows staff users to get SQL, query plans, row counts and timings of catalog requests
+# with "explain=1" parameter instead of the response. Off by default.
+API_QUERY_EXPLAIN = False
+# Static snapshots of categories, tags and banners for serving without Django (see "publish_snapshots" command):
+# "ROOT" is a directory of the snapshot files and their manifest,
+# "PUBLISH_ON_CHANGE" republishes the snapshots after every catalog change
+API_SNAPSHOTS = {
+    "ROOT": BASE_DIR / "snapshots",
+    "PUBLISH_ON_CHANGE": False,
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -160,5 +202,10 @@ LOGGING = {
             'level': 'DEBUG',  # change debug level as appropiate
             'propagate': False,
         },
+        'api': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }